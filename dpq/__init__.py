@@ -12,13 +12,22 @@ from .connections import (
     use_connection,
     push_connection,
     pop_connection,
+    set_default_connection,
+    clear_default_connection,
     Connection)
-from .queue import Queue
-from .job import cancel_job
-from .worker import Worker
+from .queue import Queue, cancel_jobs
+from .job import cancel_job, get_current_job
+from .worker import Worker, ThreadWorker
+from .cache import memoize
+from .batching import batch
+from .retries import retry
+from .chains import chain
 
 __all__ = ['get_current_connection', 'use_connection', 'push_connection',
-           'pop_connection', 'Connection', 'Queue', 'cancel_job', 'Worker']
+           'pop_connection', 'set_default_connection',
+           'clear_default_connection', 'Connection', 'Queue', 'cancel_job',
+           'cancel_jobs', 'get_current_job', 'Worker', 'ThreadWorker',
+           'memoize', 'batch', 'retry', 'chain']
 
 version_info = (0, 0, 1)
 __version__ = ".".join([str(v) for v in version_info])
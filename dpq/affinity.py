@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+"""
+Pinning workers, and the work horses they fork, to sets of CPUs.
+
+Uses `os.sched_setaffinity` where available (Python 3), psutil if it is
+installed, and the C library on Linux otherwise.  Where none of these
+work, `set_affinity` returns False and processes stay unpinned.
+"""
+
+import os
+import glob
+import ctypes
+import ctypes.util
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def parse_cpu_list(text):
+    """Returns the CPUs of a list like '0-3,8,10-11', as in
+    /sys/devices/system/node/node0/cpulist or `taskset -c`.
+    """
+    cpus = set()
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        cpus.update(range(int(first), int(last or first) + 1))
+    return sorted(cpus)
+
+
+def format_cpu_list(cpus):
+    """The reverse of `parse_cpu_list`."""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(first) if first == last else '%d-%d' % (first, last)
+                    for first, last in ranges)
+
+
+def online_cpus():
+    """Returns the CPUs that are online."""
+    try:
+        with open('/sys/devices/system/cpu/online') as f:
+            return parse_cpu_list(f.read())
+    except (IOError, OSError, ValueError):
+        return range(os.sysconf('SC_NPROCESSORS_ONLN'))
+
+
+def sockets():
+    """Returns the CPUs of each NUMA node (i.e. socket, on most boxes).
+    Outside of Linux all CPUs count as one node.
+    """
+    nodes = []
+    paths = glob.glob('/sys/devices/system/node/node[0-9]*/cpulist')
+    for path in sorted(paths, key=lambda p: int(p.split('/')[-2][4:])):
+        try:
+            with open(path) as f:
+                cpus = parse_cpu_list(f.read())
+        except (IOError, OSError, ValueError):
+            continue
+        if cpus:
+            nodes.append(cpus)
+    return nodes or [online_cpus()]
+
+
+def placements(policy):
+    """Returns the CPU sets to hand out to workers, round-robin, following
+    the given policy: 'core' pins each worker to a single core, 'socket'
+    to all cores of a NUMA node.  Anything else is read as a CPU list all
+    workers share.
+    """
+    if policy == 'core':
+        return [[cpu] for cpu in online_cpus()]
+    if policy == 'socket':
+        return sockets()
+    try:
+        cpus = parse_cpu_list(policy)
+    except ValueError:
+        cpus = None
+    if not cpus:
+        raise ValueError('Expected \'core\', \'socket\' or a CPU list, '
+                         'got %r.' % policy)
+    return [cpus]
+
+
+class _CPUSet(ctypes.Structure):
+    # cpu_set_t, as in <sched.h>
+    _fields_ = [('bits', ctypes.c_ulong * (1024 // (8 * ctypes.sizeof(
+        ctypes.c_ulong))))]
+
+
+_libc = None
+if os.uname()[0] == 'Linux':
+    try:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        _libc.sched_getaffinity
+    except (OSError, AttributeError):
+        _libc = None
+
+
+def _libc_call(func, mask):
+    if func(0, ctypes.sizeof(mask), ctypes.byref(mask)) != 0:
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code))
+
+
+def get_affinity():
+    """Returns the CPUs the current process may run on, or None if that is
+    unknown.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    if psutil is not None:
+        return sorted(psutil.Process().cpu_affinity())
+    if _libc is not None:
+        mask = _CPUSet()
+        _libc_call(_libc.sched_getaffinity, mask)
+        width = 8 * ctypes.sizeof(ctypes.c_ulong)
+        return [i * width + bit for i, word in enumerate(mask.bits)
+                for bit in range(width) if word >> bit & 1]
+    return None
+
+
+def set_affinity(cpus):
+    """Pins the current process, and the processes it forks from now on, to
+    the given CPUs.  Returns False where that is not supported.
+    """
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    elif psutil is not None:
+        psutil.Process().cpu_affinity(list(cpus))
+    elif _libc is not None:
+        mask = _CPUSet()
+        width = 8 * ctypes.sizeof(ctypes.c_ulong)
+        for cpu in cpus:
+            mask.bits[cpu // width] |= 1 << cpu % width
+        _libc_call(_libc.sched_setaffinity, mask)
+    else:
+        return False
+    return True
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+"""
+Batched execution of many small jobs of the same function.
+"""
+
+
+def batch(max_size=500, max_wait_ms=50):
+    """Marks a job function as batchable::
+
+        @batch(max_size=500, max_wait_ms=50)
+        def score_items(calls):
+            ids = [item_id for (item_id,) in calls]
+            return bulk_score(ids)
+
+        queue.enqueue(score_items, 42)
+
+    Each job is still enqueued with its own arguments, but a worker that
+    dequeues one collects up to `max_size` queued jobs of the same function
+    (waiting at most `max_wait_ms` for more to arrive) and calls the function
+    once, with the list of the jobs' argument tuples.  It must return a list
+    with one result per job, in the same order; an exception instance in that
+    list fails just the corresponding job.  Batch jobs cannot take keyword
+    arguments.
+    """
+    def decorator(func):
+        func._dpq_batch = (max_size, max_wait_ms)
+        return func
+    return decorator
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmarks for the enqueue, fetch and dequeue hot paths.
+
+Every benchmark runs against a connection wrapped in a `RoundTripCounter`,
+so besides the throughput it reports how many round trips to Redis a single
+operation costs.  Run them with `dpqbench`.
+
+`JobRepresentationBenchmark` compares the in-memory cost of job instances
+and of their hash encoding, without touching Redis.
+"""
+
+import sys
+import json
+import time
+import times
+import datetime
+import platform
+import traceback
+from timeit import default_timer
+
+from . import __version__
+from .connections import Connection
+from .queue import Queue, get_failed_queue
+from .job import Job, to_timestamp
+from .memory import MemoryRedis
+
+
+DEFAULT_PAYLOAD_SIZES = (16, 1024, 65536)
+# Deep queues of the largest payloads take up to 64 MB of Redis memory
+DEFAULT_DEPTHS = (100, 1000)
+
+
+def noop(*args, **kwargs):
+    """The job function enqueued by the benchmarks."""
+    pass
+
+
+class RoundTripCounter(object):
+    """Wraps a Redis connection and counts the round trips made through it.
+
+    Every command counts as one round trip, except for commands issued on a
+    pipeline, which count once when the pipeline is executed.  Scripts count
+    like commands.  Through redis-py, a pipeline running scripts first
+    checks that the server knows them, which counts as well, and so does
+    loading a script the server does not know.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+        self.round_trips = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self._connection, name)
+        if not callable(attr):
+            return attr
+
+        def counted(*args, **kwargs):
+            self.round_trips += 1
+            return attr(*args, **kwargs)
+        return counted
+
+    def pipeline(self, *args, **kwargs):
+        return _CountedPipeline(self,
+                                self._connection.pipeline(*args, **kwargs))
+
+
+class _CountedPipeline(object):
+
+    def __init__(self, counter, pipeline):
+        self._counter = counter
+        self._pipeline = pipeline
+        immediate = getattr(pipeline, 'immediate_execute_command', None)
+        if immediate is not None:
+            # Sent right away, e.g. to check for and load scripts
+            def counted(*args, **kwargs):
+                counter.round_trips += 1
+                return immediate(*args, **kwargs)
+            pipeline.immediate_execute_command = counted
+
+    def __getattr__(self, name):
+        return getattr(self._pipeline, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self._pipeline.reset()
+
+    def execute(self, *args, **kwargs):
+        self._counter.round_trips += 1
+        return self._pipeline.execute(*args, **kwargs)
+
+    def run_script(self, script, keys, args):
+        """Queues a `dpq.scripts.Script` on the wrapped pipeline, which has
+        to know about it to load it before it is executed.
+        """
+        return script(keys, args, self._pipeline)
+
+
+class Benchmark(object):
+    """Runs the benchmark suite against the given connection.
+
+    Each benchmark case first runs its setup and then measures `ops`
+    operations, yielding one result dict per case.
+    """
+    # The number of jobs `fill` pushes per pipeline
+    fill_batch_size = 1000
+
+    def __init__(self, connection, payload_sizes=DEFAULT_PAYLOAD_SIZES,
+                 depths=DEFAULT_DEPTHS, iterations=1000):
+        self.counter = RoundTripCounter(connection)
+        self.connection = connection
+        self.payload_sizes = payload_sizes
+        self.depths = depths
+        self.iterations = iterations
+
+    def measure(self, name, func, ops, **params):
+        self.counter.round_trips = 0
+        start = default_timer()
+        func()
+        elapsed = default_timer() - start
+        result = {
+            'name': name,
+            'ops': ops,
+            'seconds': elapsed,
+            'ops_per_sec': ops / elapsed if elapsed else None,
+            'round_trips_per_op': self.counter.round_trips * 1.0 / ops,
+        }
+        result.update(params)
+        return result
+
+    def fill(self, queue, depth, payload):
+        """Pushes `depth` jobs onto the queue, `fill_batch_size` per
+        pipeline, so deep queues of large payloads are not buffered all at
+        once.
+        """
+        for start in range(0, depth, self.fill_batch_size):
+            with self.connection.pipeline() as p:
+                for _ in range(min(self.fill_batch_size, depth - start)):
+                    job = Job.create(noop, payload, connection=p)
+                    job.origin = queue.name
+                    job.timeout = queue.default_job_timeout
+                    job.save()
+                    p.rpush(queue.key, job.id)
+                p.execute()
+
+    def bench_enqueue(self, payload):
+        q = Queue('bench', connection=self.counter)
+
+        def run():
+            for _ in range(self.iterations):
+                q.enqueue(noop, payload)
+        return self.measure('Queue.enqueue', run, self.iterations,
+                            payload=len(payload))
+
+    def bench_job_save(self, payload):
+        jobs = [Job.create(noop, payload, connection=self.counter)
+                for _ in range(self.iterations)]
+
+        def run():
+            for job in jobs:
+                job.save()
+        return self.measure('Job.save', run, self.iterations,
+                            payload=len(payload))
+
+    def bench_job_refresh(self, payload):
+        job = Job.create(noop, payload, connection=self.counter)
+        job.save()
+
+        def run():
+            for _ in range(self.iterations):
+                job.refresh()
+        return self.measure('Job.refresh', run, self.iterations,
+                            payload=len(payload))
+
+    def bench_dequeue_any(self, payload, depth):
+        queues = [Queue('bench-empty', connection=self.counter),
+                  Queue('bench', connection=self.counter)]
+        self.fill(queues[1], depth, payload)
+
+        def run():
+            for _ in range(depth):
+                Queue.dequeue_any(queues, False, connection=self.counter)
+        return self.measure('Queue.dequeue_any', run, depth,
+                            payload=len(payload), depth=depth)
+
+    def bench_quarantine(self, payload):
+        fq = get_failed_queue(connection=self.counter)
+        jobs = [Job.create(noop, payload, connection=self.counter)
+                for _ in range(self.iterations)]
+        try:
+            raise ValueError(payload[:64])
+        except ValueError:
+            exc_info = traceback.format_exc()
+
+        def run():
+            for job in jobs:
+                fq.quarantine(job, exc_info=exc_info)
+        return self.measure('FailedQueue.quarantine', run, self.iterations,
+                            payload=len(payload))
+
+    def bench_compat(self, payload, depth):
+        q = Queue('bench', connection=self.counter)
+        self.fill(q, depth, payload)
+        # Kill every other job, so compat() has something to drop
+        for job_id in q.job_ids[::2]:
+            self.connection.delete(Job.key_for(job_id))
+
+        return self.measure('Queue.compat', q.compat, depth,
+                            payload=len(payload), depth=depth)
+
+    def cases(self):
+        for size in self.payload_sizes:
+            payload = 'x' * size
+            yield self.bench_enqueue, (payload,)
+            yield self.bench_job_save, (payload,)
+            yield self.bench_job_refresh, (payload,)
+            yield self.bench_quarantine, (payload,)
+            for depth in self.depths:
+                yield self.bench_dequeue_any, (payload, depth)
+                yield self.bench_compat, (payload, depth)
+
+    def run(self, only=None):
+        with Connection(self.counter):
+            for case, args in self.cases():
+                if only and not any(name in case.__name__ for name in only):
+                    continue
+                self.connection.flushdb()
+                yield case(*args)
+        self.connection.flushdb()
+
+
+def unslotted(cls):
+    """Returns a copy of the given slotted class whose instances keep their
+    attributes in a `__dict__` instead.
+    """
+    attrs = dict((name, value) for name, value in vars(cls).items()
+                 if name not in cls.__slots__ and name != '__slots__')
+    return type('Unslotted' + cls.__name__, cls.__bases__, attrs)
+
+
+def legacy_values(values):
+    """Rewrites HMGET values of a job hash the way versions storing
+    `times` formatted dates wrote them.
+    """
+    values = list(values)
+    for i, name in enumerate(Job.properties):
+        if name.endswith('_at') and values[i] is not None:
+            values[i] = times.format(
+                datetime.datetime.utcfromtimestamp(float(values[i])), 'UTC')
+    return values
+
+
+class JobRepresentationBenchmark(object):
+    """Compares the memory and CPU cost of creating and refreshing `count`
+    jobs held in memory: slotted `Job` instances against ones with a
+    `__dict__`, and hashes with epoch timestamps against ones with the
+    `times` strings of older versions.
+    """
+
+    def __init__(self, count=1000000):
+        self.count = count
+        self.connection = MemoryRedis()
+
+    def measure(self, name, func, variant, **params):
+        start = default_timer()
+        func()
+        elapsed = default_timer() - start
+        result = {
+            'name': name,
+            'variant': variant,
+            'ops': self.count,
+            'seconds': elapsed,
+            'ops_per_sec': self.count / elapsed if elapsed else None,
+        }
+        result.update(params)
+        return result
+
+    def make_job(self, cls=Job):
+        job = cls(connection=self.connection)
+        job._func_name = 'dpq.bench.noop'
+        job._args = ()
+        job._kwargs = {}
+        job.origin = 'bench'
+        job.enqueued_at = job.ended_at = job.created_at
+        job.timeout = 180
+        return job
+
+    def bench_create(self, cls, variant):
+        def run():
+            for _ in range(self.count):
+                self.make_job(cls)
+        result = self.measure('Job()', run, variant)
+        job = self.make_job(cls)
+        size = sys.getsizeof(job)
+        if hasattr(job, '__dict__'):
+            size += sys.getsizeof(job.__dict__)
+        result['bytes_per_job'] = size
+        return result
+
+    def bench_dates(self, variant):
+        """Encoding of a job's dates, which is all `Job.dump` does
+        differently between the two formats.
+        """
+        job = self.make_job()
+        if variant == 'times':
+            encode = lambda dt: times.format(dt, 'UTC')  # noqa
+        else:
+            encode = to_timestamp
+
+        def run():
+            for _ in range(self.count):
+                encode(job.created_at)
+                encode(job.enqueued_at)
+                encode(job.ended_at)
+        return self.measure('Job.dump dates', run, variant)
+
+    def bench_load(self, variant):
+        job = self.make_job()
+        job.save()
+        values = self.connection.hmget(job.key, Job.properties)
+        if variant == 'times':
+            values = legacy_values(values)
+
+        def run():
+            for _ in range(self.count):
+                job.load(values)
+        return self.measure('Job.load', run, variant)
+
+    def run(self):
+        yield self.bench_create(Job, 'slots')
+        yield self.bench_create(unslotted(Job), 'dict')
+        yield self.bench_dates('epoch')
+        yield self.bench_dates('times')
+        yield self.bench_load('epoch')
+        yield self.bench_load('times')
+
+
+def report(backend, results):
+    """Returns the JSON document describing a benchmark run."""
+    return {
+        'dpq_version': __version__,
+        'python': '%s %s' % (platform.python_implementation(),
+                             platform.python_version()),
+        'platform': platform.platform(),
+        'backend': backend,
+        'timestamp': time.time(),
+        'results': results,
+    }
+
+
+def result_key(result):
+    return (result['name'], result.get('payload'), result.get('depth'),
+            result.get('variant'))
+
+
+def compare(baseline, results, out=sys.stdout):
+    """Prints the ops/sec ratio of each result against a baseline run."""
+    previous = dict((result_key(r), r) for r in baseline['results'])
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None or not old['ops_per_sec']:
+            continue
+        ratio = result['ops_per_sec'] / old['ops_per_sec']
+        out.write('%-24s payload=%-6s depth=%-6s %8.0f -> %8.0f ops/s '
+                  '(%+.1f%%)\n' % (result['name'], result.get('payload'),
+                                   result.get('depth', '-'),
+                                   old['ops_per_sec'], result['ops_per_sec'],
+                                   (ratio - 1) * 100))
+
+
+def dump(document, fp):
+    json.dump(document, fp, indent=2, sort_keys=True)
+    fp.write('\n')
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""
+Result memoization for deterministic job functions.
+
+Jobs enqueued with a `cache_ttl` (or whose function is decorated with
+`memoize`) have their results stored under a hash of their function and
+arguments.  A worker that finds a cached result for such a job writes it to
+the job right away, without forking a work horse.
+"""
+
+import time
+
+from .connections import resolve_connection
+from .cluster import pipeline_for
+
+
+def memoize(ttl):
+    """Marks a job function as deterministic, so its results are cached for
+    `ttl` seconds::
+
+        @memoize(ttl=600)
+        def render(page_id):
+            ...
+    """
+    def decorator(func):
+        func._dpq_cache_ttl = ttl
+        return func
+    return decorator
+
+
+class ResultCache(object):
+    """Pickled job results keyed by `Job.get_unique_key()`.
+
+    Entries expire after their TTL, and the least recently used ones are
+    evicted once there are more than `max_size` of them.  Hits and misses
+    are counted in the `stats_key` hash.
+    """
+    prefix = 'dpq:cache:'
+    index_key = 'dpq:cache-lru'
+    stats_key = 'dpq:cache-stats'
+
+    def __init__(self, connection=None, max_size=10000):
+        self.connection = resolve_connection(connection)
+        self.max_size = max_size
+
+    def key_for(self, digest):
+        return self.prefix + digest
+
+    def get(self, job):
+        """Returns the pickled result cached for the given job, or None."""
+        digest = job.get_unique_key()
+        rv = self.connection.get(self.key_for(digest))
+        p = pipeline_for(self.connection)
+        if rv is not None:
+            p.zadd(self.index_key, time.time(), digest)
+            p.hincrby(self.stats_key, 'hits', 1)
+        else:
+            p.hincrby(self.stats_key, 'misses', 1)
+        p.execute()
+        return rv
+
+    def set(self, job, rv, ttl):
+        """Caches the pickled result of the given job for `ttl` seconds."""
+        digest = job.get_unique_key()
+        p = pipeline_for(self.connection)
+        p.setex(self.key_for(digest), int(ttl), rv)
+        p.zadd(self.index_key, time.time(), digest)
+        p.zcard(self.index_key)
+        size = p.execute()[-1]
+        if size > self.max_size:
+            self.evict(size - self.max_size)
+
+    def evict(self, count):
+        """Drops the `count` least recently used entries."""
+        digests = self.connection.zrange(self.index_key, 0, count - 1)
+        if not digests:
+            return
+        p = pipeline_for(self.connection)
+        for digest in digests:
+            p.delete(self.key_for(digest))
+        p.zrem(self.index_key, *digests)
+        p.execute()
+
+    def stats(self):
+        """Returns the hit and miss counters."""
+        stats = self.connection.hgetall(self.stats_key)
+        return dict((name, int(stats.get(name, 0)))
+                    for name in ('hits', 'misses'))
+
+    def clear(self):
+        digests = self.connection.zrange(self.index_key, 0, -1)
+        p = pipeline_for(self.connection)
+        for digest in digests:
+            p.delete(self.key_for(digest))
+        p.delete(self.index_key)
+        p.delete(self.stats_key)
+        p.execute()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+"""
+Jobs running several functions one after the other, each called with the
+return value of the previous one.
+"""
+
+
+class Chain(object):
+    """The steps of a chain: its first function, and the `(function name,
+    queue name)` pairs of the steps following it, where the queue name is
+    None for steps running on the queue of the step before.
+    """
+
+    def __init__(self, first, rest):
+        self.first = first
+        self.rest = tuple(rest)
+
+
+def func_name_of(func):
+    return '%s.%s' % (func.__module__, func.__name__)
+
+
+def chain(first, *steps):
+    """Chains functions into a single job::
+
+        queue.enqueue(chain(fetch, parse, (index, 'search')), url)
+
+    The worker performing the job calls `fetch(url)`, then `parse` with the
+    return value of `fetch`, in the same process, without a round trip
+    through Redis between the steps.  The job's result is the return value
+    of the last step it ran.  The steps share the job's timeout and
+    retries.
+
+    A step given as a `(function, queue name)` pair runs on that queue
+    instead: the worker enqueues a job calling it with the return value of
+    the step before, and carrying the rest of the chain, there.  The job
+    handing the chain over records the id of that job in its `chain_next`
+    (see `Job.chain_end`).
+
+    After each step, the job checkpoints the return value in its hash, so
+    that a job performed again, e.g. after its work horse crashed and it
+    was retried, resumes with the step that did not finish.
+    """
+    if not callable(first):
+        raise ValueError('The first step of a chain runs on the queue the '
+                         'chain is enqueued on.')
+    rest = []
+    for step in (first,) + steps:
+        func, queue_name = step if isinstance(step, tuple) else (step, None)
+        if getattr(func, '_dpq_batch', None) is not None:
+            raise ValueError('Batch functions cannot be chained.')
+        if func.__module__ == '__main__':
+            raise ValueError("Functions from __main__ module cannot be "
+                             "processed by workers.")
+        rest.append((func_name_of(func), queue_name))
+    return Chain(first, rest[1:])
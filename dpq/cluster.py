@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+"""
+Helpers for running DPQ against a Redis Cluster.
+
+In cluster mode every queue key and the hashes of the jobs enqueued on it
+carry the same hash tag (``{<queue name>}``), so they live in the same slot
+and multi-key operations on a queue never fail with CROSSSLOT.
+"""
+
+from itertools import groupby
+
+from redis import Redis, StrictRedis
+
+
+CLUSTER_SLOTS = 16384
+
+_CLUSTER_CLIENTS = ('StrictRedisCluster', 'RedisCluster')
+
+
+def is_cluster_client(connection):
+    """Returns whether the given connection talks to a Redis Cluster."""
+    return any(klass.__name__ in _CLUSTER_CLIENTS
+               for klass in type(connection).__mro__)
+
+
+def is_cluster(connection):
+    """Returns whether DPQ should use the hash-tagged key layout for the
+    given connection.
+    """
+    cluster = getattr(connection, '_cluster', None)
+    if cluster is None:
+        return is_cluster_client(connection)
+    return cluster
+
+
+def enable_cluster_mode(connection):
+    """Forces the hash-tagged key layout on the given connection, even if it
+    is not a cluster client (e.g. a single node that was migrated with
+    `dpqmigrate` and is about to be imported into a cluster).
+    """
+    connection._cluster = True
+    return connection
+
+
+def hash_tag(name):
+    return '{%s}' % name
+
+
+def strip_hash_tag(name):
+    if name.startswith('{') and name.endswith('}'):
+        return name[1:-1]
+    return name
+
+
+def crc16(data):
+    """CRC16/XMODEM, as used by Redis Cluster for key hashing."""
+    crc = 0
+    for char in bytearray(data):
+        crc ^= char << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xffff
+            else:
+                crc = (crc << 1) & 0xffff
+    return crc
+
+
+def key_slot(key):
+    """Returns the cluster slot of the given key, honouring hash tags."""
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    start = key.find('{')
+    if start > -1:
+        end = key.find('}', start + 1)
+        if end > start + 1:
+            key = key[start + 1:end]
+    return crc16(key) % CLUSTER_SLOTS
+
+
+def group_by_slot(keys):
+    """Splits the given keys into runs of keys sharing a slot, preserving
+    their order.
+    """
+    return [list(run) for _, run in groupby(keys, key_slot)]
+
+
+def pipeline_for(connection):
+    """Returns a pipeline that is safe to use on the given connection.
+
+    Cluster clients route every command of a pipeline to the node owning its
+    slot, which rules out MULTI/EXEC across keys, so in cluster mode the
+    pipeline is not transactional.
+
+    Pipelines always take the `StrictRedis` argument order, also on a
+    legacy `redis.Redis` connection (which swaps e.g. the score and the
+    member of ZADD, and the value and the time of SETEX).
+    """
+    transaction = not is_cluster(connection)
+    if isinstance(connection, Redis):
+        return StrictRedis.pipeline(connection, transaction=transaction)
+    return connection.pipeline(transaction=transaction)
@@ -6,9 +6,12 @@ from functools import partial
 from redis import StrictRedis, Redis
 
 from .local import LocalStack, release_local
+from .cluster import is_cluster
 
 
 _connection_stack = LocalStack()
+# The connection used outside of connection contexts, in all threads
+_default_connection = None
 
 
 class NoRedisConnectionException(Exception):
@@ -38,6 +41,7 @@ def patch_connection(connection):
         return connection
 
     connection._hset = partial(_hset, connection)
+    connection._cluster = is_cluster(connection)
 
     if isinstance(connection, Redis):
         connection._setex = partial(StrictRedis.setex, connection)
@@ -101,9 +105,38 @@ def use_connection(redis=None):
     push_connection(redis)
 
 
+def set_default_connection(connection=None, **kwargs):
+    """Sets the connection used by all threads (and greenlets) of the
+    process whenever no connection was pushed in the current one, and
+    returns it.
+
+    Pushed connections are local to the thread or greenlet that pushed
+    them, which does not suit threaded producers, e.g. web servers.  Redis
+    clients are safe to share instead: every command borrows a socket from
+    the client's connection pool.  Without a connection, creates a client
+    with its own pool from the given keyword arguments, e.g. `host`, `port`,
+    `db` or `max_connections`.
+    """
+    global _default_connection
+    if connection is None:
+        connection = StrictRedis(**kwargs)
+    _default_connection = patch_connection(connection)
+    return _default_connection
+
+
+def clear_default_connection():
+    global _default_connection
+    _default_connection = None
+
+
 def get_current_connection():
-    """Return the current Redis connection"""
-    return _connection_stack.top
+    """Return the current Redis connection: the one pushed last in the
+    current thread, or else the default connection.
+    """
+    connection = _connection_stack.top
+    if connection is None:
+        return _default_connection
+    return connection
 
 
 def resolve_connection(connection=None):
@@ -116,4 +149,5 @@ def resolve_connection(connection=None):
     return connection
 
 __all__ = ['Connection', 'get_current_connection', 'push_connection',
-           'pop_connection', 'use_connection', 'resolve_connection']
+           'pop_connection', 'use_connection', 'resolve_connection',
+           'set_default_connection', 'clear_default_connection']
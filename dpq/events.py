@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""
+A capped Redis Stream of job and worker lifecycle events, for monitors to
+follow instead of polling snapshots.
+
+Workers publish events only when asked to (`Worker(..., events=True)` or
+`dpqworker --events`), buffering them and writing them in pipelines.
+Needs Redis >= 5.0.
+"""
+
+import time
+from collections import defaultdict
+
+from .connections import resolve_connection
+from .cluster import pipeline_for
+
+
+class EventLog(object):
+    """Publishes and reads lifecycle events.
+
+    Published events are buffered, and written with one pipeline once
+    `max_buffered` of them are waiting, once the oldest of them has waited
+    for `flush_interval` seconds, or on `flush()`.  The stream is trimmed to
+    about `max_length` events.
+    """
+    key = 'dpq:events'
+    max_length = 10000
+    max_buffered = 100
+    flush_interval = 1
+
+    def __init__(self, connection=None):
+        self.connection = resolve_connection(connection)
+        self._buffer = []
+        self._buffered_since = None
+
+    @property
+    def pending(self):
+        """The number of buffered events."""
+        return len(self._buffer)
+
+    def emit(self, event, **fields):
+        """Publishes an event with the given (flat) fields."""
+        now = time.time()
+        fields['event'] = event
+        fields['time'] = '%.6f' % now
+        self._buffer.append(fields)
+        if self._buffered_since is None:
+            self._buffered_since = now
+        if len(self._buffer) >= self.max_buffered or \
+                now - self._buffered_since >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered events, in a single round trip."""
+        if not self._buffer:
+            return
+        p = pipeline_for(self.connection)
+        for fields in self._buffer:
+            args = ['XADD', self.key, 'MAXLEN', '~', self.max_length, '*']
+            for name, value in fields.items():
+                if value is not None:
+                    args.extend([name, value])
+            p.execute_command(*args)
+        p.execute()
+        self.reset()
+
+    def reset(self):
+        """Drops the buffered events, e.g. the copy a work horse inherits
+        from its worker.
+        """
+        self._buffer = []
+        self._buffered_since = None
+
+    def read(self, last_id='$', count=100, block=None):
+        """Returns the events published after the one with the given id, as
+        a list of `(event id, fields)` pairs.  Waits up to `block`
+        milliseconds for new ones, if given.  The default `last_id` only
+        returns events published from now on.
+        """
+        args = ['XREAD', 'COUNT', count]
+        if block is not None:
+            args.extend(['BLOCK', block])
+        args.extend(['STREAMS', self.key, last_id])
+        reply = self.connection.execute_command(*args)
+        if not reply:
+            return []
+        _, entries = reply[0]
+        return [(entry_id, dict(zip(fields[::2], fields[1::2])))
+                for entry_id, fields in entries]
+
+    def empty(self):
+        self.connection.delete(self.key)
+
+
+class EventStats(object):
+    """Aggregates followed job events by function: how many jobs started,
+    finished, failed or will be retried, and how long they ran.
+    """
+
+    def __init__(self):
+        self.counts = defaultdict(lambda: defaultdict(int))
+        self.durations = defaultdict(float)
+
+    def add(self, fields):
+        func_name = fields.get('func')
+        event = fields.get('event', '')
+        if func_name is None or not event.startswith('job_'):
+            return
+        self.counts[func_name][event[len('job_'):]] += 1
+        if 'duration' in fields and event != 'job_started':
+            self.durations[func_name] += float(fields['duration'])
+
+    def mean_duration(self, func_name):
+        counts = self.counts[func_name]
+        ended = counts['finished'] + counts['failed'] + counts['retrying']
+        if not ended:
+            return None
+        return self.durations[func_name] / ended
@@ -5,6 +5,10 @@ class NoSuchJobError(Exception):
     pass
 
 
+class JobExpiredError(NoSuchJobError):
+    pass
+
+
 class InvalidJobOperationError(Exception):
     pass
 
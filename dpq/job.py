@@ -1,12 +1,18 @@
 # -*- coding: utf-8 -*-
 
+import time
 import times
+import hashlib
+import datetime
 import importlib
 from uuid import uuid4
-from cPickle import loads, dumps, UnpicklingError
+from cPickle import loads, dumps, UnpicklingError, HIGHEST_PROTOCOL
 
 from .connections import resolve_connection
-from .exceptions import NoSuchJobError, UnpickleError
+from .cluster import pipeline_for, is_cluster, hash_tag
+from .local import LocalStack
+from .scripts import compare_and_delete, compare_and_expire
+from .exceptions import NoSuchJobError, JobExpiredError, UnpickleError
 
 
 def unpickle(pickled_string):
@@ -24,11 +30,109 @@ def unpickle(pickled_string):
     return obj
 
 
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def to_timestamp(dt):
+    """Returns the given (naive, UTC) datetime as seconds since the epoch,
+    the way dates are stored in job hashes.
+    """
+    return (dt - EPOCH).total_seconds()
+
+
+def from_timestamp(value):
+    """Returns the (naive, UTC) datetime stored in a job hash field, or
+    None.  Reads the `times` formatted strings written by older versions as
+    well.
+    """
+    if value is None:
+        return None
+    try:
+        return datetime.datetime.utcfromtimestamp(float(value))
+    except ValueError:
+        return times.to_universal(value)
+
+
+def import_func(func_name):
+    """Returns the function with the given dotted name."""
+    module_name, func_name = func_name.rsplit('.', 1)
+    module = importlib.import_module(module_name)
+    return getattr(module, func_name)
+
+
 def cancel_job(job_id, connection=None):
-    Job(job_id, connection=connection).cancel()
+    Job.cancel_many([job_id], connection=connection)
+
+
+_job_stack = LocalStack()
+
+
+def get_current_job():
+    """Returns the job being performed, when called from inside of it, or
+    None.
+    """
+    return _job_stack.top
+
+
+def parse_progress(value):
+    if value is None:
+        return None
+    return float(value)
+
+
+def parse_meta(value):
+    if value is None:
+        return {}
+    return unpickle(value)
 
 
 class Job(object):
+    __slots__ = [
+        'connection', '_id', 'created_at', '_func_name', '_args', '_kwargs',
+        '_description', 'origin', 'enqueued_at', 'ended_at', '_result',
+        'exc_info', 'failure_reason', 'timeout', 'unique_lock', 'cache_ttl',
+        'batch', 'expires_at', 'retries', 'backoff', 'attempts', 'packed',
+        'progress', 'meta', '_meta_saved_at', 'indexed', 'tags', 'peak_rss',
+        'cpu_time', 'chain', 'checkpoint', 'chain_next']
+
+    # The hash fields read by `refresh`
+    properties = [
+        'data', 'created_at', 'origin', 'description', 'enqueued_at',
+        'ended_at', 'result', 'exc_info', 'failure_reason', 'timeout',
+        'unique_lock', 'cache_ttl', 'batch', 'expires_at', 'retries',
+        'backoff', 'attempts', 'progress', 'meta', 'indexed', 'tags',
+        'peak_rss', 'cpu_time', 'chain', 'checkpoint', 'chain_next',
+        'packed']
+    # The fields written on their own, besides the rest of the job
+    meta_properties = ['progress', 'meta']
+    usage_properties = ['peak_rss', 'cpu_time']
+    chain_properties = ['checkpoint', 'chain_next']
+    separate_properties = ['result'] + meta_properties + usage_properties + \
+        chain_properties
+    # The fields a packed job keeps in its single `packed` field, in order.
+    # Only ever append to this list, so older packed jobs stay readable.
+    packed_properties = [
+        'data', 'created_at', 'origin', 'enqueued_at', 'ended_at',
+        'exc_info', 'failure_reason', 'timeout', 'unique_lock', 'cache_ttl',
+        'batch', 'expires_at', 'retries', 'backoff', 'attempts', 'indexed',
+        'tags', 'chain']
+    # Hash of expired job counts, by queue name
+    expired_key = 'dpq:expired'
+    # Hash of cancelled job counts, by queue name
+    cancelled_key = 'dpq:cancelled'
+    # The number of jobs `cancel_many` reads and deletes per round trip
+    cancel_batch_size = 1000
+    # Prefix of the per-queue indexes of jobs by function and tag
+    index_prefix = 'dpq:index:'
+    # The minimum number of seconds between two writes of the progress and
+    # meta of a running job
+    meta_flush_interval = 0.25
+    # The number of seconds the unique lock of a job waiting in a queue
+    # outlives its last (re)enqueue, in case the job gets lost
+    unique_lock_ttl = 24 * 3600
+    # The number of seconds the unique lock of a running job outlives its
+    # timeout, in case its worker dies
+    unique_lock_grace = 60
 
     @classmethod
     def create(cls, func, *args, **kwargs):
@@ -42,7 +146,6 @@ class Job(object):
         job._func_name = '%s.%s' % (func.__module__, func.__name__)
         job._args = args
         job._kwargs = kwargs
-        job.description = job.get_call_string()
         return job
 
     @property
@@ -55,9 +158,7 @@ class Job(object):
         if func_name is None:
             return None
 
-        module_name, func_name = func_name.rsplit('.', 1)
-        module = importlib.import_module(module_name)
-        return getattr(module, func_name)
+        return import_func(func_name)
 
     @property
     def args(self):
@@ -68,8 +169,8 @@ class Job(object):
         return self._kwargs
 
     @classmethod
-    def exists(cls, job_id):
-        conn = resolve_connection()
+    def exists(cls, job_id, connection=None):
+        conn = resolve_connection(connection)
         return conn.exists(cls.key_for(job_id))
 
     @classmethod
@@ -78,22 +179,82 @@ class Job(object):
         job.refresh()
         return job
 
+    @classmethod
+    def fetch_many(cls, ids, connection=None, check_expiry=False):
+        """Fetches the jobs with the given ids in a single round trip.
+        Returns a list aligned with `ids`, holding None for jobs that do not
+        exist (anymore) or cannot be unpickled.  With `check_expiry`, e.g.
+        when the jobs are about to be performed, expired jobs are discarded
+        as well.
+        """
+        connection = resolve_connection(connection)
+        p = connection.pipeline(transaction=False)
+        for id in ids:
+            p.hmget(cls.key_for(id), cls.properties)
+        jobs = []
+        for id, values in zip(ids, p.execute()):
+            job = Job(id, connection=connection)
+            try:
+                job.load(values, check_expiry=check_expiry)
+            except JobExpiredError:
+                job.discard_expired()
+                job = None
+            except (NoSuchJobError, UnpickleError):
+                job = None
+            jobs.append(job)
+        return jobs
+
+    @classmethod
+    def fetch_progress(cls, ids, connection=None):
+        """Reads the progress and meta of the jobs with the given ids in a
+        single round trip.  Returns a list of `(progress, meta)` tuples
+        aligned with `ids`, holding `(None, {})` for jobs that did not
+        report any (or do not exist).
+        """
+        connection = resolve_connection(connection)
+        p = connection.pipeline(transaction=False)
+        for id in ids:
+            p.hmget(cls.key_for(id), cls.meta_properties)
+        return [(parse_progress(progress), parse_meta(meta))
+                for progress, meta in p.execute()]
+
     def __init__(self, id=None, connection=None):
         if connection is None:
+            # Only for jobs built by hand, queues and workers always pass
+            # their own connection
             connection = resolve_connection()
         self.connection = connection
         self._id = id
-        self.create_at = times.now()
+        self.created_at = times.now()
         self._func_name = None
         self._args = None
         self._kwargs = None
-        self.description = None
+        self._description = None
         self.origin = None
         self.enqueued_at = None
         self.ended_at = None
         self._result = None
         self.exc_info = None
+        self.failure_reason = None
         self.timeout = None
+        self.unique_lock = None
+        self.cache_ttl = None
+        self.batch = None
+        self.expires_at = None
+        self.retries = 0
+        self.backoff = None
+        self.attempts = 0
+        self.packed = False
+        self.progress = None
+        self.meta = {}
+        self._meta_saved_at = 0
+        self.indexed = False
+        self.tags = ()
+        self.peak_rss = None
+        self.cpu_time = None
+        self.chain = ()
+        self.checkpoint = None
+        self.chain_next = None
 
     def get_id(self):
         if self._id is None:
@@ -113,6 +274,16 @@ class Job(object):
     def key(self):
         return self.key_for(self.id)
 
+    def get_description(self):
+        if self._description is None:
+            return self.get_call_string()
+        return self._description
+
+    def set_description(self, value):
+        self._description = value
+
+    description = property(get_description, set_description)
+
     @property
     def job_tuple(self):
         return (self.func_name, self.args, self.kwargs)
@@ -122,81 +293,448 @@ class Job(object):
         if self._result is None:
             rv = self.connection.hget(self.key, 'result')
             if rv is not None:
-                self._result = loads(rv)
+                self._result = unpickle(rv)
         return self._result
 
     result = return_value
 
-    def refresh(self):  # noqa
+    def wait_for_result(self, timeout=None, poll_interval=0.01,
+                        max_poll_interval=0.5):
+        """Waits for the job to be performed and returns its return value.
+
+        Returns None as soon as the job turns out to have returned None (its
+        hash is deleted then), to have failed for good, or when `timeout`
+        seconds have passed.  Polls with one round trip, starting every
+        `poll_interval` seconds and backing off up to `max_poll_interval`.
+
+        Blocks the calling thread until then.  Do not call it from an event
+        loop, but from a thread pool executor.
+        """
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            result, ended_at, created_at, packed = self.connection.hmget(
+                self.key, ['result', 'ended_at', 'created_at', 'packed'])
+            if result is not None:
+                self._result = unpickle(result)
+                return self._result
+            if created_at is None and packed is None:
+                return None
+            if packed is not None:
+                fields = dict(zip(self.packed_properties, unpickle(packed)))
+                ended_at = fields.get('ended_at')
+            if ended_at is not None:
+                # Quarantined in the failed queue
+                return None
+            if timeout is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                poll_interval = min(poll_interval, remaining)
+            time.sleep(poll_interval)
+            poll_interval = min(poll_interval * 2, max_poll_interval)
+
+    def refresh(self, check_expiry=False):  # noqa
         """Overwrite the current instance's properties with the values in the
         corresponding Redis key.
 
         Will raise a NoSuchJobError if no corresponding Redis key exists.
         """
-        key = self.key
-        properties = [
-            'data', 'created_at', 'origin', 'description', 'enqueued_at',
-            'ended_at', 'result', 'exc_info', 'timeout']
+        self.load(self.connection.hmget(self.key, self.properties),
+                  check_expiry=check_expiry)
+
+    def load(self, values, check_expiry=False):
+        """Sets the instance's properties from the values of the hash fields
+        listed in `properties`, as returned by HMGET.
+
+        With `check_expiry`, raises a JobExpiredError, before unpickling the
+        job's data, if the job expired.  Only the dequeueing side checks it:
+        the expiry is a deadline to start the job, and the results and
+        failures of jobs remain readable past it.
+        """
+        packed = values[-1]
+        self.packed = packed is not None
+        if self.packed:
+            values = self.unpack(packed, values)
         data, created_at, origin, description, \
             enqueued_at, ended_at, result, \
-            exc_info, timeout = self.connection.hmget(key, properties)
+            exc_info, failure_reason, \
+            timeout, unique_lock, \
+            cache_ttl, batch, expires_at, \
+            retries, backoff, attempts, \
+            progress, meta, indexed, tags, \
+            peak_rss, cpu_time, chain, checkpoint, chain_next, _ = values
         if data is None:
-            raise NoSuchJobError('No such job: %s' % (key,))
+            raise NoSuchJobError('No such job: %s' % (self.key,))
 
-        def to_date(date_str):
-            if date_str is None:
-                return None
-            else:
-                return times.to_universal(date_str)
+        self.origin = origin
+        self.unique_lock = unique_lock
+        self.indexed = bool(indexed)
+        self.tags = tuple(tags.split(',')) if tags else ()
+        self.expires_at = from_timestamp(expires_at)
+        if check_expiry and self.is_expired():
+            if self.indexed:
+                # Needed to remove the job from the indexes
+                self._func_name = unpickle(data)[0]
+            raise JobExpiredError('Job expired: %s' % (self.key,))
 
         self._func_name, self._args, self._kwargs = unpickle(data)
-        self.created_at = to_date(created_at)
-        self.origin = origin
-        self.description = description
-        self.enqueued_at = to_date(enqueued_at)
-        self.ended_at = to_date(ended_at)
-        self._result = result
+        self.created_at = from_timestamp(created_at)
+        self._description = description
+        self.enqueued_at = from_timestamp(enqueued_at)
+        self.ended_at = from_timestamp(ended_at)
+        if result is None:
+            self._result = None
+        else:
+            self._result = unpickle(result)
         self.exc_info = exc_info
+        self.failure_reason = failure_reason
         if timeout is None:
             self.timeout = None
         else:
-            self.timeout = int(timeout)
+            self.timeout = float(timeout)
+        if cache_ttl is None:
+            self.cache_ttl = None
+        else:
+            self.cache_ttl = int(cache_ttl)
+        if batch is None:
+            self.batch = None
+        else:
+            self.batch = tuple(map(int, batch.split(',')))
+        self.retries = int(retries or 0)
+        if backoff is None:
+            self.backoff = None
+        else:
+            self.backoff = float(backoff)
+        self.attempts = int(attempts or 0)
+        self.progress = parse_progress(progress)
+        self.meta = parse_meta(meta)
+        if peak_rss is None:
+            self.peak_rss = None
+        else:
+            self.peak_rss = int(peak_rss)
+        if cpu_time is None:
+            self.cpu_time = None
+        else:
+            self.cpu_time = float(cpu_time)
+        self.chain = unpickle(chain) if chain is not None else ()
+        if checkpoint is None:
+            self.checkpoint = None
+        else:
+            self.checkpoint = unpickle(checkpoint)
+        self.chain_next = chain_next
+
+    def unpack(self, packed, values):
+        """Returns the given HMGET values of a packed job, with the fields
+        from its `packed` field filled in.
+        """
+        fields = dict(zip(self.packed_properties, unpickle(packed)))
+        for name in self.separate_properties:
+            fields[name] = values[self.properties.index(name)]
+        return [fields.get(name) for name in self.properties]
 
     def save(self):
-        key = self.key
+        self.connection.hmset(self.key, self.dump())
+
+    def dump(self):
+        """Returns the hash fields representing this job.
 
+        Packed jobs keep all of their fields but the separately written
+        ones (the result, progress, meta, usage and chain checkpoint) in a
+        single pickled
+        `packed` field, and do not store their description, which
+        is derived from the call instead.  This saves a lot of Redis memory
+        per job.
+        """
+        obj = self.dump_fields()
+        if not self.packed:
+            return obj
+        values = [obj.get(name) for name in self.packed_properties]
+        while values[-1] is None:
+            values.pop()
+        packed = dumps(tuple(values), HIGHEST_PROTOCOL)
+        result = {'packed': packed}
+        for name in self.separate_properties:
+            if name in obj:
+                result[name] = obj[name]
+        return result
+
+    def dump_fields(self):
         obj = {}
-        obj['create_at'] = times.format(self.create_at, 'UTC')
+        obj['created_at'] = to_timestamp(self.created_at)
 
         if self.func_name is not None:
-            obj['data'] = dumps(self.job_tuple)
+            if self.packed:
+                obj['data'] = dumps(self.job_tuple, HIGHEST_PROTOCOL)
+            else:
+                obj['data'] = dumps(self.job_tuple)
         if self.origin is not None:
             obj['origin'] = self.origin
-        if self.description is not None:
+        if self.func_name is not None and not self.packed:
             obj['description'] = self.description
         if self.enqueued_at is not None:
-            obj['enqueued_at'] = times.format(self.enqueued_at, 'UTC')
+            obj['enqueued_at'] = to_timestamp(self.enqueued_at)
         if self.ended_at is not None:
-            obj['ended_at'] = times.format(self.ended_at, 'UTC')
+            obj['ended_at'] = to_timestamp(self.ended_at)
         if self._result is not None:
-            obj['result'] = self._result
+            obj['result'] = dumps(self._result)
         if self.exc_info is not None:
             obj['exc_info'] = self.exc_info
+        if self.failure_reason is not None:
+            obj['failure_reason'] = self.failure_reason
         if self.timeout is not None:
             obj['timeout'] = self.timeout
+        if self.unique_lock is not None:
+            obj['unique_lock'] = self.unique_lock
+        if self.cache_ttl is not None:
+            obj['cache_ttl'] = self.cache_ttl
+        if self.batch is not None:
+            obj['batch'] = '%d,%d' % self.batch
+        if self.expires_at is not None:
+            obj['expires_at'] = to_timestamp(self.expires_at)
+        if self.retries:
+            obj['retries'] = self.retries
+        if self.backoff is not None:
+            obj['backoff'] = self.backoff
+        if self.attempts:
+            obj['attempts'] = self.attempts
+        if self.indexed:
+            obj['indexed'] = 1
+        if self.tags:
+            obj['tags'] = ','.join(self.tags)
+        if self.chain:
+            obj['chain'] = dumps(self.chain)
+        if self.checkpoint is not None:
+            obj['checkpoint'] = dumps(self.checkpoint)
+        if self.chain_next is not None:
+            obj['chain_next'] = self.chain_next
+        obj.update(self.dump_meta())
+        obj.update(self.dump_usage())
+        return obj
+
+    def dump_usage(self):
+        """Returns the hash fields holding the resources the job used, as
+        measured by the worker.
+        """
+        obj = {}
+        if self.peak_rss is not None:
+            obj['peak_rss'] = self.peak_rss
+        if self.cpu_time is not None:
+            obj['cpu_time'] = self.cpu_time
+        return obj
+
+    def dump_meta(self):
+        """Returns the hash fields holding the job's progress and meta."""
+        obj = {}
+        if self.progress is not None:
+            obj['progress'] = self.progress
+        if self.meta:
+            obj['meta'] = dumps(self.meta)
+        return obj
+
+    def update_progress(self, progress, **meta):
+        """Sets the progress of the running job, and optionally updates its
+        meta, and saves them.
+
+        Meant to be called from tight loops: writes are coalesced, so that
+        Redis is written to at most every `meta_flush_interval` seconds.
+        Whatever is not written yet is written along with the job's result.
+        """
+        self.progress = progress
+        self.meta.update(meta)
+        self.save_meta(force=False)
+
+    def save_meta(self, force=True):
+        """Writes the job's progress and meta in one round trip.  Unless
+        forced, does nothing if they were written less than
+        `meta_flush_interval` seconds ago.  Returns whether they were
+        written.
+        """
+        now = time.time()
+        if not force and now - self._meta_saved_at < self.meta_flush_interval:
+            return False
+        fields = self.dump_meta()
+        if fields:
+            self.connection.hmset(self.key, fields)
+        self._meta_saved_at = now
+        return True
+
+    def is_expired(self):
+        return self.expires_at is not None and \
+            self.expires_at <= times.now()
+
+    def discard_expired(self):
+        """Deletes the expired job and counts it as expired on its queue."""
+        self.release_unique_lock()
+        p = self.connection.pipeline(transaction=False)
+        p.delete(self.key)
+        p.hincrby(self.expired_key, self.origin, 1)
+        self.unindex(pipeline=p)
+        p.execute()
 
-        self.connection.hmset(key, obj)
+    @classmethod
+    def index_key(cls, origin, cluster, *parts):
+        """Return the redis key of an index of the given queue.  In cluster
+        mode the queue name is used as hash tag, like for the queue.
+        """
+        if cluster:
+            origin = hash_tag(origin)
+        return cls.index_prefix + ':'.join((origin,) + parts)
+
+    def index_keys(self):
+        """Returns the keys of the id sets of the indexes the job belongs
+        to, along with the sets listing the indexed names.
+        """
+        cluster = is_cluster(self.connection)
+        keys = [(self.index_key(self.origin, cluster, 'funcs'),
+                 self.func_name,
+                 self.index_key(self.origin, cluster, 'func',
+                                self.func_name))]
+        for tag in self.tags:
+            keys.append((self.index_key(self.origin, cluster, 'tags'), tag,
+                         self.index_key(self.origin, cluster, 'tag', tag)))
+        return keys
+
+    def index_entry(self):
+        """Returns what the `jobs` hash of the indexes of its queue records
+        about the job, so that it can be taken out of them by its id alone:
+        the keys of its id sets past the queue's index prefix, separated by
+        commas.
+        """
+        prefix = self.index_key(self.origin, is_cluster(self.connection), '')
+        return ','.join(key[len(prefix):] for _, _, key in self.index_keys())
+
+    def index(self, pipeline):
+        """Adds an indexed job to the indexes of its queue, on the given
+        pipeline.
+        """
+        if not self.indexed:
+            return
+        for names_key, name, key in self.index_keys():
+            pipeline.sadd(names_key, name)
+            pipeline.sadd(key, self.id)
+        jobs_key = self.index_key(self.origin, is_cluster(self.connection),
+                                  'jobs')
+        pipeline.hset(jobs_key, self.id, self.index_entry())
+
+    def unindex(self, pipeline=None):
+        """Removes an indexed job from the indexes of its queue, on the
+        given pipeline, or right away.
+        """
+        if not self.indexed:
+            return
+        p = pipeline
+        if p is None:
+            p = pipeline_for(self.connection)
+        for _, _, key in self.index_keys():
+            p.srem(key, self.id)
+        p.hdel(self.index_key(self.origin, is_cluster(self.connection),
+                              'jobs'), self.id)
+        if pipeline is None:
+            p.execute()
+
+    @classmethod
+    def cancel_many(cls, ids, connection=None):
+        """Cancels the jobs with the given ids, `cancel_batch_size` at a
+        time, and counts them as cancelled on their queues.  Returns the
+        number of jobs cancelled.
+
+        The job hashes are deleted, their ids stay in the queues and are
+        skipped by the workers.
+        """
+        connection = resolve_connection(connection)
+        cancelled = 0
+        for start in range(0, len(ids), cls.cancel_batch_size):
+            batch_ids = ids[start:start + cls.cancel_batch_size]
+            jobs = cls.fetch_many(batch_ids, connection=connection)
+            p = pipeline_for(connection)
+            for id, job in zip(batch_ids, jobs):
+                # Also deletes the jobs that cannot be unpickled
+                p.delete(cls.key_for(id))
+                if job is not None:
+                    p.hincrby(cls.cancelled_key, job.origin, 1)
+                    job.unindex(pipeline=p)
+            p.execute()
+            for job in jobs:
+                if job is not None:
+                    job.release_unique_lock()
+                    cancelled += 1
+        return cancelled
 
     def cancel(self):
-        self.delete()
+        self.cancel_many([self.id], connection=self.connection)
 
     def delete(self):
         self.connection.delete(self.key)
 
     def perform(self):
-        """Invoke the job function with arguments"""
-        self._result = self.func(*self.args, **self.kwargs)
-        return self._result
+        """Invoke the job function with arguments, and then the steps chained
+        to it (see `dpq.chains`), up to the first one running on another
+        queue.  Resumes after the last checkpointed step.
+        """
+        if self.checkpoint is None:
+            rv = self.func(*self.args, **self.kwargs)
+            done = 0
+        else:
+            done, rv = self.checkpoint
+        while done < len(self.chain) and \
+                self.chain[done][1] in (None, self.origin):
+            self.save_checkpoint(done, rv)
+            rv = import_func(self.chain[done][0])(rv)
+            done += 1
+        self.checkpoint = (done, rv)
+        self._result = rv
+        return rv
+
+    @property
+    def remaining_steps(self):
+        """The `(function name, queue name)` pairs of the chained steps that
+        did not run yet.
+        """
+        done = self.checkpoint[0] if self.checkpoint is not None else 0
+        return self.chain[done:]
+
+    def save_checkpoint(self, done, rv):
+        """Records that the first `done` chained steps ran, and `rv` is
+        what the next one is called with.
+        """
+        self.checkpoint = (done, rv)
+        self.connection.hset(self.key, 'checkpoint', dumps(self.checkpoint))
+
+    def chain_end(self):
+        """Returns the job the chain of this job was handed over to last,
+        across queues, i.e. the one holding its final result once it ran.
+        """
+        job = self
+        while job.chain_next is not None:
+            job = Job.fetch(job.chain_next, connection=self.connection)
+        return job
+
+    def get_unique_key(self):
+        """Returns a key identifying equivalent jobs, i.e. calls of the same
+        function with equal arguments.
+        """
+        call = '%s(%r, %r)' % (self.func_name, self.args,
+                               sorted(self.kwargs.items()))
+        return hashlib.sha1(call).hexdigest()
+
+    def release_unique_lock(self, pipeline=None):
+        """Allows equivalent jobs to be enqueued again, if this job holds
+        the unique lock.
+        """
+        if self.unique_lock is None:
+            return
+        compare_and_delete([self.unique_lock], [self.id],
+                           pipeline or self.connection)
+
+    def refresh_unique_lock(self, ttl, pipeline=None):
+        """Lets the unique lock expire in `ttl` seconds, if this job holds
+        it.
+        """
+        if self.unique_lock is None:
+            return
+        compare_and_expire([self.unique_lock], [self.id, int(ttl)],
+                           pipeline or self.connection)
 
     def get_call_string(self):
         if self.func_name is None:
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+"""
+Memory and CPU limits of work horses, and their resource usage.
+"""
+
+import os
+import math
+import signal
+import resource
+
+
+class CPULimitExceeded(Exception):
+    """Raised in a work horse that used up its CPU time limit."""
+    pass
+
+
+def _set_limit(kind, soft, hard):
+    """Lowers the given resource limit, staying within the current hard
+    limit, which an unprivileged process cannot raise.
+    """
+    _, current_hard = resource.getrlimit(kind)
+    if current_hard != resource.RLIM_INFINITY:
+        hard = min(hard, current_hard)
+        soft = min(soft, hard)
+    resource.setrlimit(kind, (soft, hard))
+
+
+def limit_resources(memory_limit=None, cpu_limit=None, grace=1):
+    """Limits the address space of the current process to `memory_limit`
+    bytes, where allocations beyond it raise MemoryError, and its CPU time
+    to `cpu_limit` seconds, after which a CPULimitExceeded is raised.  The
+    kernel kills the process if it runs on for `grace` more seconds.
+    """
+    if memory_limit is not None:
+        _set_limit(resource.RLIMIT_AS, memory_limit, memory_limit)
+    if cpu_limit is not None:
+        soft = int(math.ceil(cpu_limit))
+
+        def handle_cpu_limit(signum, frame):
+            raise CPULimitExceeded('Job exceeded its CPU time limit (%s '
+                                   'seconds).' % cpu_limit)
+
+        signal.signal(signal.SIGXCPU, handle_cpu_limit)
+        _set_limit(resource.RLIMIT_CPU, soft,
+                   soft + int(math.ceil(grace)))
+
+
+def process_rss(pid):
+    """Returns the resident set size of the given process in bytes, or None
+    where it is not available (outside of Linux, or once it ended).
+    """
+    try:
+        with open('/proc/%d/statm' % pid) as f:
+            pages = int(f.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+    return pages * resource.getpagesize()
+
+
+def usage(rusage):
+    """Returns the peak RSS in bytes and the CPU time in seconds from the
+    given `resource.struct_rusage`.
+    """
+    # Linux reports ru_maxrss in kilobytes, OS X in bytes
+    peak_rss = rusage.ru_maxrss
+    if os.uname()[0] != 'Darwin':
+        peak_rss *= 1024
+    return peak_rss, rusage.ru_utime + rusage.ru_stime
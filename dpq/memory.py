@@ -0,0 +1,555 @@
+# -*- coding: utf-8 -*-
+
+"""
+An in-process stand-in for a Redis connection.
+
+`MemoryRedis` implements the subset of the redis-py API DPQ uses (keys,
+strings, lists, hashes, sets, sorted sets, pipelines and blocking pops), with
+the same return values as `StrictRedis`, and runs DPQ's scripts (see
+`dpq.scripts`).  All state lives in the current process and every operation
+is guarded by a single lock, so a `Queue` and a `ThreadWorker` running in
+different threads can share one instance without a network hop.
+
+Since the data is not shared with other processes, use it with the
+`ThreadWorker`, not with the forking `Worker`.
+"""
+
+import time
+import threading
+from fnmatch import fnmatch
+from functools import wraps
+
+from redis.exceptions import ResponseError
+
+
+WRONGTYPE = 'WRONGTYPE Operation against a key holding the wrong kind of value'
+
+
+def _encode(value):
+    """Converts a value the way redis-py does before sending it."""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _locked(func):
+    @wraps(func)
+    def _inner(self, *args, **kwargs):
+        with self._lock:
+            return func(self, *args, **kwargs)
+    return _inner
+
+
+class MemoryRedis(object):
+
+    def __init__(self):
+        self._lock = threading.Condition(threading.RLock())
+        self._data = {}
+        self._expires = {}
+
+    def _expire_if_needed(self, name):
+        expires = self._expires.get(name)
+        if expires is not None and expires <= time.time():
+            del self._expires[name]
+            self._data.pop(name, None)
+
+    def _get(self, name, kind, create=False):
+        self._expire_if_needed(name)
+        value = self._data.get(name)
+        if value is None:
+            if not create:
+                return None
+            value = self._data[name] = kind()
+        elif type(value) is not kind:
+            raise ResponseError(WRONGTYPE)
+        return value
+
+    def _cleanup(self, name):
+        """Removes emptied containers, like Redis does."""
+        if not self._data.get(name):
+            self._data.pop(name, None)
+            self._expires.pop(name, None)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return MemoryPipeline(self)
+
+    @_locked
+    def run_script(self, script, keys, args):
+        """Runs the Python equivalent of a `dpq.scripts.Script`."""
+        return script.fallback(self, keys, args)
+
+    # Keys
+
+    @_locked
+    def delete(self, *names):
+        deleted = 0
+        for name in names:
+            self._expire_if_needed(name)
+            if name in self._data:
+                del self._data[name]
+                deleted += 1
+            self._expires.pop(name, None)
+        return deleted
+
+    @_locked
+    def exists(self, name):
+        self._expire_if_needed(name)
+        return name in self._data
+
+    @_locked
+    def keys(self, pattern='*'):
+        for name in list(self._data):
+            self._expire_if_needed(name)
+        return [name for name in self._data if fnmatch(name, pattern)]
+
+    @_locked
+    def rename(self, src, dst):
+        self._expire_if_needed(src)
+        if src not in self._data:
+            raise ResponseError('no such key')
+        self._data[dst] = self._data.pop(src)
+        self._expires.pop(dst, None)
+        if src in self._expires:
+            self._expires[dst] = self._expires.pop(src)
+        return True
+
+    @_locked
+    def expire(self, name, time_):
+        self._expire_if_needed(name)
+        if name not in self._data:
+            return False
+        self._expires[name] = time.time() + int(time_)
+        return True
+
+    @_locked
+    def pexpire(self, name, time_):
+        self._expire_if_needed(name)
+        if name not in self._data:
+            return False
+        self._expires[name] = time.time() + int(time_) / 1000.0
+        return True
+
+    @_locked
+    def persist(self, name):
+        return self._expires.pop(name, None) is not None
+
+    @_locked
+    def pttl(self, name):
+        self._expire_if_needed(name)
+        if name not in self._data:
+            return -2
+        if name not in self._expires:
+            return -1
+        return int((self._expires[name] - time.time()) * 1000)
+
+    def ttl(self, name):
+        pttl = self.pttl(name)
+        if pttl < 0:
+            return pttl
+        return int(round(pttl / 1000.0))
+
+    @_locked
+    def type(self, name):
+        self._expire_if_needed(name)
+        value = self._data.get(name)
+        if value is None:
+            return 'none'
+        return {str: 'string', list: 'list', dict: 'hash', set: 'set',
+                ZSet: 'zset'}[type(value)]
+
+    @_locked
+    def flushdb(self):
+        self._data.clear()
+        self._expires.clear()
+        return True
+
+    @_locked
+    def dbsize(self):
+        return len(self.keys())
+
+    # Strings
+
+    @_locked
+    def get(self, name):
+        return self._get(name, str)
+
+    @_locked
+    def set(self, name, value, ex=None, px=None, nx=False, xx=False):
+        self._expire_if_needed(name)
+        if nx and name in self._data or xx and name not in self._data:
+            return None
+        self._data[name] = _encode(value)
+        self._expires.pop(name, None)
+        if ex is not None:
+            self.expire(name, ex)
+        if px is not None:
+            self.pexpire(name, px)
+        return True
+
+    def setex(self, name, time_, value):
+        return self.set(name, value, ex=time_)
+
+    @_locked
+    def incrby(self, name, amount=1):
+        value = int(self._get(name, str) or 0) + amount
+        self._data[name] = str(value)
+        return value
+
+    incr = incrby
+
+    # Lists
+
+    @_locked
+    def rpush(self, name, *values):
+        lst = self._get(name, list, create=True)
+        lst.extend(_encode(v) for v in values)
+        self._lock.notify_all()
+        return len(lst)
+
+    @_locked
+    def lpush(self, name, *values):
+        lst = self._get(name, list, create=True)
+        for value in values:
+            lst.insert(0, _encode(value))
+        self._lock.notify_all()
+        return len(lst)
+
+    @_locked
+    def lpop(self, name):
+        lst = self._get(name, list)
+        if not lst:
+            return None
+        value = lst.pop(0)
+        self._cleanup(name)
+        return value
+
+    @_locked
+    def rpop(self, name):
+        lst = self._get(name, list)
+        if not lst:
+            return None
+        value = lst.pop()
+        self._cleanup(name)
+        return value
+
+    @_locked
+    def llen(self, name):
+        return len(self._get(name, list) or [])
+
+    @_locked
+    def lindex(self, name, index):
+        lst = self._get(name, list) or []
+        try:
+            return lst[index]
+        except IndexError:
+            return None
+
+    @_locked
+    def lrange(self, name, start, end):
+        lst = self._get(name, list) or []
+        if end == -1:
+            return lst[start:]
+        return lst[start:end + 1]
+
+    @_locked
+    def ltrim(self, name, start, end):
+        lst = self._get(name, list)
+        if lst is not None:
+            lst[:] = lst[start:] if end == -1 else lst[start:end + 1]
+            self._cleanup(name)
+        return True
+
+    @_locked
+    def lrem(self, name, count, value=None):
+        """Removes occurrences of `value`, following the `StrictRedis`
+        argument order.  Also accepts the `Redis` style `lrem(name, value)`.
+        """
+        if value is None:
+            count, value = 0, count
+        lst = self._get(name, list)
+        if not lst:
+            return 0
+        value = _encode(value)
+        indexes = [i for i, v in enumerate(lst) if v == value]
+        if count < 0:
+            indexes = indexes[::-1][:-count]
+        elif count > 0:
+            indexes = indexes[:count]
+        for i in sorted(indexes, reverse=True):
+            del lst[i]
+        self._cleanup(name)
+        return len(indexes)
+
+    def blpop(self, keys, timeout=0):
+        """Pops from the first non-empty list of `keys`, waiting up to
+        `timeout` seconds (forever if 0) for a push from another thread.
+        """
+        if isinstance(keys, basestring):
+            keys = [keys]
+        deadline = time.time() + timeout if timeout else None
+        with self._lock:
+            while True:
+                for key in keys:
+                    value = self.lpop(key)
+                    if value is not None:
+                        return key, value
+                if deadline is None:
+                    self._lock.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    self._lock.wait(remaining)
+
+    # Hashes
+
+    @_locked
+    def hset(self, name, key, value):
+        h = self._get(name, dict, create=True)
+        created = key not in h
+        h[key] = _encode(value)
+        return int(created)
+
+    @_locked
+    def hsetnx(self, name, key, value):
+        h = self._get(name, dict, create=True)
+        if key in h:
+            return 0
+        h[key] = _encode(value)
+        return 1
+
+    @_locked
+    def hmset(self, name, mapping):
+        h = self._get(name, dict, create=True)
+        for key, value in mapping.items():
+            h[key] = _encode(value)
+        return True
+
+    @_locked
+    def hget(self, name, key):
+        return (self._get(name, dict) or {}).get(key)
+
+    @_locked
+    def hmget(self, name, keys, *args):
+        if isinstance(keys, basestring):
+            keys = [keys]
+        h = self._get(name, dict) or {}
+        return [h.get(key) for key in list(keys) + list(args)]
+
+    @_locked
+    def hgetall(self, name):
+        return dict(self._get(name, dict) or {})
+
+    @_locked
+    def hkeys(self, name):
+        return list(self._get(name, dict) or {})
+
+    @_locked
+    def hlen(self, name):
+        return len(self._get(name, dict) or {})
+
+    @_locked
+    def hexists(self, name, key):
+        return key in (self._get(name, dict) or {})
+
+    @_locked
+    def hdel(self, name, *keys):
+        h = self._get(name, dict)
+        if not h:
+            return 0
+        deleted = 0
+        for key in keys:
+            if h.pop(key, None) is not None:
+                deleted += 1
+        self._cleanup(name)
+        return deleted
+
+    @_locked
+    def hincrby(self, name, key, amount=1):
+        h = self._get(name, dict, create=True)
+        value = int(h.get(key, 0)) + amount
+        h[key] = str(value)
+        return value
+
+    # Sets
+
+    @_locked
+    def sadd(self, name, *values):
+        s = self._get(name, set, create=True)
+        before = len(s)
+        s.update(_encode(v) for v in values)
+        return len(s) - before
+
+    @_locked
+    def srem(self, name, *values):
+        s = self._get(name, set)
+        if not s:
+            return 0
+        before = len(s)
+        s.difference_update(_encode(v) for v in values)
+        removed = before - len(s)
+        self._cleanup(name)
+        return removed
+
+    @_locked
+    def smembers(self, name):
+        return set(self._get(name, set) or ())
+
+    @_locked
+    def sismember(self, name, value):
+        return _encode(value) in (self._get(name, set) or ())
+
+    @_locked
+    def scard(self, name):
+        return len(self._get(name, set) or ())
+
+    @_locked
+    def sinter(self, keys, *args):
+        names = (keys if isinstance(keys, (list, tuple)) else [keys]) + \
+            list(args)
+        sets = [self._get(name, set) or set() for name in names]
+        return set.intersection(*sets)
+
+    # Sorted sets
+
+    @_locked
+    def zadd(self, name, *args, **kwargs):
+        """Follows the `StrictRedis` argument order: score1, name1, ..."""
+        z = self._get(name, ZSet, create=True)
+        pairs = zip(args[1::2], args[::2]) + kwargs.items()
+        added = 0
+        for member, score in pairs:
+            member = _encode(member)
+            if member not in z:
+                added += 1
+            z[member] = float(score)
+        return added
+
+    @_locked
+    def zincrby(self, name, value, amount=1):
+        z = self._get(name, ZSet, create=True)
+        value = _encode(value)
+        z[value] = z.get(value, 0.0) + amount
+        return z[value]
+
+    @_locked
+    def zrem(self, name, *values):
+        z = self._get(name, ZSet)
+        if not z:
+            return 0
+        removed = 0
+        for value in values:
+            if z.pop(_encode(value), None) is not None:
+                removed += 1
+        self._cleanup(name)
+        return removed
+
+    @_locked
+    def zcard(self, name):
+        return len(self._get(name, ZSet) or ())
+
+    @_locked
+    def zscore(self, name, value):
+        return (self._get(name, ZSet) or {}).get(_encode(value))
+
+    @_locked
+    def zrange(self, name, start, end, desc=False, withscores=False):
+        items = (self._get(name, ZSet) or ZSet()).sorted_items(desc)
+        items = items[start:] if end == -1 else items[start:end + 1]
+        if withscores:
+            return items
+        return [member for member, _ in items]
+
+    @_locked
+    def zrevrange(self, name, start, end, withscores=False):
+        return self.zrange(name, start, end, desc=True,
+                           withscores=withscores)
+
+    @_locked
+    def zrangebyscore(self, name, min, max, start=None, num=None,
+                      withscores=False):
+        items = [(member, score) for member, score in
+                 (self._get(name, ZSet) or ZSet()).sorted_items()
+                 if in_score_range(score, min, max)]
+        if start is not None:
+            items = items[start:start + num]
+        if withscores:
+            return items
+        return [member for member, _ in items]
+
+    @_locked
+    def zremrangebyrank(self, name, min, max):
+        members = self.zrange(name, min, max)
+        return self.zrem(name, *members) if members else 0
+
+    @_locked
+    def zremrangebyscore(self, name, min, max):
+        members = self.zrangebyscore(name, min, max)
+        return self.zrem(name, *members) if members else 0
+
+    @_locked
+    def zcount(self, name, min, max):
+        return len(self.zrangebyscore(name, min, max))
+
+
+def in_score_range(score, min, max):
+    """Whether `score` lies between the ZRANGEBYSCORE style bounds `min`
+    and `max`, which are inclusive unless prefixed with '('.
+    """
+    for bound, above in ((min, True), (max, False)):
+        bound = _encode(bound)
+        exclusive = bound.startswith('(')
+        value = float(bound.lstrip('('))
+        if above and (score < value or exclusive and score == value):
+            return False
+        if not above and (score > value or exclusive and score == value):
+            return False
+    return True
+
+
+class ZSet(dict):
+    """Sorted set: a dict of member -> score, ordered like Redis on reads."""
+
+    def sorted_items(self, desc=False):
+        return sorted(self.items(), key=lambda item: (item[1], item[0]),
+                      reverse=desc)
+
+
+class MemoryPipeline(object):
+    """Buffers commands and runs them under the connection's lock when
+    executed, so a pipeline is applied atomically, like MULTI/EXEC.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.reset()
+
+    def __getattr__(self, name):
+        method = getattr(self._connection, name)
+
+        def buffered(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return buffered
+
+    def __len__(self):
+        return len(self._commands)
+
+    def reset(self):
+        self._commands = []
+
+    def execute(self, raise_on_error=True):
+        commands, self._commands = self._commands, []
+        with self._connection._lock:
+            return [method(*args, **kwargs)
+                    for method, args, kwargs in commands]
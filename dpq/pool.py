@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+
+"""
+A pool of worker processes that grows and shrinks with the queue backlog.
+"""
+
+import os
+import sys
+import math
+import time
+import errno
+import signal
+import importlib
+try:
+    from logbook import Logger
+    Logger = Logger   # Does nothing except it shuts up pyflakes annoying error
+except ImportError:
+    from logging import Logger
+from redis.exceptions import ConnectionError
+
+from .connections import resolve_connection
+from .affinity import placements
+
+
+class WorkerPool(object):
+    """Runs between `min_workers` and `max_workers` child processes, each
+    running a worker built by calling `worker_factory` in the child.
+
+    Every `interval` seconds the pool samples the backlog (the summed `count`
+    of its `queues`) and the dequeue latency (the longest wait of a job at
+    the front of a queue).  It wants one worker per `jobs_per_worker` queued
+    jobs, and one more than it has while the latency exceeds
+    `target_latency`.  To avoid flapping, it only grows once it wanted more
+    workers for `scale_up_samples` samples in a row, and only shrinks, one
+    worker at a time, once it wanted fewer for `scale_down_samples` samples
+    in a row.
+
+    Workers are retired with SIGTERM, i.e. the worker's warm shutdown: they
+    finish their current job and quit.  Children that die otherwise are
+    replaced as long as the pool is below `min_workers`.
+
+    On SIGHUP, the pool reloads its code without downtime (see `reload`).
+    The modules named in `preload` are imported once by the pool, so that
+    its children do not have to, and re-imported on reload, along with the
+    modules they imported.
+
+    With a `cpu_affinity` policy (see `affinity.placements`), each worker,
+    and the horses it forks, is pinned to a set of CPUs: new workers get
+    the set the fewest current workers are pinned to, i.e. round-robin
+    while the pool grows.
+    """
+    interval = 1
+    jobs_per_worker = 100
+    target_latency = 5
+    scale_up_samples = 2
+    scale_down_samples = 30
+    # The number of workers replaced at a time while reloading, and the
+    # seconds new workers get to start before the old ones are retired
+    reload_step = 1
+    reload_warmup = 1
+
+    def __init__(self, queues, worker_factory, min_workers=1, max_workers=4,
+                 connection=None, preload=(), cpu_affinity=None):
+        if not 1 <= min_workers <= max_workers:
+            raise ValueError('Expected 1 <= min_workers <= max_workers.')
+        self.connection = resolve_connection(connection)
+        self.queues = queues
+        self.worker_factory = worker_factory
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.workers = []
+        self.draining = []
+        self._wants_more = 0
+        self._wants_fewer = 0
+        self._stopped = False
+        self._reload_requested = False
+        self.preload = list(preload)
+        # The modules importing `preload` added, to be dropped on reload
+        self._preloaded = set()
+        if cpu_affinity is not None:
+            self.placements = placements(cpu_affinity)
+        else:
+            self.placements = []
+        self._placed = {}
+        self.log = Logger('pool')
+
+    @property
+    def size(self):
+        return len(self.workers)
+
+    def _install_signal_handlers(self):
+        def request_stop(signum, frame):
+            self._stopped = True
+
+        def request_reload(signum, frame):
+            self._reload_requested = True
+
+        signal.signal(signal.SIGINT, request_stop)
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGHUP, request_reload)
+
+    def run(self):
+        """Runs the pool until it receives SIGINT or SIGTERM, which it passes
+        on to its workers, and then waits for them to end.
+        """
+        self._install_signal_handlers()
+        self.import_modules()
+        while len(self.workers) < self.min_workers:
+            self.spawn()
+        try:
+            while not self._stopped:
+                time.sleep(self.interval)
+                self.reap()
+                if self._stopped:
+                    break
+                if self._reload_requested:
+                    self._reload_requested = False
+                    self.reload()
+                    continue
+                while len(self.workers) < self.min_workers:
+                    self.spawn()
+                backlog, latency = self.sample()
+                self.scale(self.desired_size(backlog, latency))
+        finally:
+            self.shutdown()
+
+    def sample(self):
+        """Returns the backlog and the dequeue latency of the queues."""
+        backlog = sum(q.count for q in self.queues)
+        latency = max([q.latency for q in self.queues] or [0])
+        return backlog, latency
+
+    def desired_size(self, backlog, latency):
+        size = int(math.ceil(backlog / float(self.jobs_per_worker)))
+        if latency > self.target_latency:
+            size = max(size, len(self.workers) + 1)
+        return min(max(size, self.min_workers), self.max_workers)
+
+    def scale(self, desired):
+        """Grows or shrinks the pool towards `desired` workers, with
+        hysteresis.
+        """
+        current = len(self.workers)
+        if desired > current:
+            self._wants_fewer = 0
+            self._wants_more += 1
+            if self._wants_more >= self.scale_up_samples:
+                self._wants_more = 0
+                self.log.info('Scaling up from %d to %d workers.' % (
+                    current, desired))
+                for _ in range(desired - current):
+                    self.spawn()
+        elif desired < current:
+            self._wants_more = 0
+            self._wants_fewer += 1
+            if self._wants_fewer >= self.scale_down_samples:
+                self._wants_fewer = 0
+                self.log.info('Scaling down from %d to %d workers.' % (
+                    current, current - 1))
+                self.retire(self.workers[-1])
+        else:
+            self._wants_more = 0
+            self._wants_fewer = 0
+
+    def import_modules(self, reload_modules=False):
+        """Imports the `preload` modules, or re-imports them.  Returns
+        whether all of them could be imported.
+
+        Re-importing drops every module that importing them added to
+        `sys.modules` first, so that submodules are imported anew as well,
+        instead of only reloading the `preload` modules themselves.
+        """
+        if reload_modules:
+            for name in self._preloaded:
+                sys.modules.pop(name, None)
+            self._preloaded = set()
+        imported = set(sys.modules)
+        try:
+            for name in self.preload:
+                try:
+                    importlib.import_module(name)
+                except Exception:
+                    self.log.exception('Could not import %s.' % name)
+                    return False
+        finally:
+            self._preloaded.update(set(sys.modules) - imported)
+        return True
+
+    def reload(self):
+        """Replaces all workers with new ones, running freshly imported
+        code, without dropping below the current number of workers.
+
+        Re-imports the `preload` modules first, and keeps the old workers
+        if that fails.  Then, `reload_step` workers at a time, starts new
+        workers and, once they had `reload_warmup` seconds to start,
+        retires as many old ones with a warm shutdown, so they finish their
+        current job first.  Modules the pool did not import are not in its
+        `sys.modules`, so the new workers import them anew anyway.
+        """
+        if not self.import_modules(reload_modules=True):
+            self.log.error('Not reloading, keeping the current workers.')
+            return
+        old = list(self.workers)
+        self.log.info('Reloading %d workers.' % len(old))
+        while old and not self._stopped:
+            step, old = old[:self.reload_step], old[self.reload_step:]
+            for _ in step:
+                self.spawn()
+            time.sleep(self.reload_warmup)
+            self.reap()
+            for pid in step:
+                if pid in self.workers:
+                    self.retire(pid)
+        self.log.info('Reloaded.')
+
+    def spawn(self):
+        """Forks a child process running a new worker."""
+        cpus = self.place()
+        child_pid = os.fork()
+        if child_pid == 0:
+            self.main_worker(cpus)
+        self.workers.append(child_pid)
+        if cpus is not None:
+            self._placed[child_pid] = cpus
+        return child_pid
+
+    def place(self):
+        """Returns the CPUs to pin a new worker to, or None."""
+        if not self.placements:
+            return None
+        used = [self._placed.get(pid) for pid in self.workers]
+        return min(self.placements, key=used.count)
+
+    def main_worker(self, cpus=None):
+        """This is the entry point of a newly spawned worker process."""
+        # Keep Ctrl+C in the terminal from reaching the workers directly, the
+        # pool passes it on
+        os.setpgrp()
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        status = 0
+        worker = self.worker_factory()
+        if cpus is not None:
+            # Pinned as it starts to work
+            worker.cpu_affinity = cpus
+        try:
+            worker.work()
+        except ConnectionError:
+            # A stop signal interrupts a blocking wait for jobs
+            if not worker.stopped:
+                self.log.exception('Worker lost its connection.')
+                status = 1
+        except SystemExit:
+            status = 1
+        except Exception:
+            self.log.exception('Worker crashed.')
+            status = 1
+        os._exit(status)
+
+    def retire(self, pid):
+        """Asks a worker to finish its current job and quit."""
+        self.workers.remove(pid)
+        self.draining.append(pid)
+        self.kill(pid, signal.SIGTERM)
+
+    def kill(self, pid, sig):
+        try:
+            os.kill(pid, sig)
+        except OSError as e:
+            # ESRCH ("No such process") means it ended in the meantime
+            if e.errno != errno.ESRCH:
+                raise
+
+    def reap(self, block=False):
+        """Collects the ended child processes."""
+        while self.workers or self.draining:
+            try:
+                pid, status = os.waitpid(-1, 0 if block else os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno != errno.ECHILD:
+                    raise
+                pid = 0
+            if pid == 0:
+                return
+            self._placed.pop(pid, None)
+            if pid in self.draining:
+                self.draining.remove(pid)
+            elif pid in self.workers:
+                self.workers.remove(pid)
+                self.log.warning('Worker %d ended unexpectedly (status '
+                                 '%d).' % (pid, status))
+
+    def shutdown(self):
+        """Warm shutdown of all workers.  A second SIGINT or SIGTERM to the
+        pool is passed on as well, making it a cold one.
+        """
+        def force_stop(signum, frame):
+            for pid in self.draining:
+                self.kill(pid, signal.SIGTERM)
+
+        signal.signal(signal.SIGINT, force_stop)
+        signal.signal(signal.SIGTERM, force_stop)
+        for pid in list(self.workers):
+            self.retire(pid)
+        self.reap(block=True)
@@ -1,10 +1,23 @@
 # -*- coding: utf-8 -*-
 
+import os
+import time
 import times
+import socket
+import hashlib
+import datetime
+from uuid import uuid4
+
+from redis.exceptions import ResponseError
 
 from .connections import resolve_connection
-from .exceptions import NoSuchJobError, UnpickleError, InvalidJobOperationError
+from .cluster import (is_cluster, hash_tag, strip_hash_tag, group_by_slot,
+                      pipeline_for)
+from .exceptions import (NoSuchJobError, JobExpiredError, UnpickleError,
+                         InvalidJobOperationError)
 from .job import Job
+from .scripts import Script, compare_and_delete
+from .chains import Chain
 
 
 def get_failed_queue(connection=None):
@@ -15,15 +28,158 @@ def compact(lst):
     return [item for item in lst if item is not None]
 
 
+def _save_if_unlocked(connection, keys, args):
+    holder_id = connection.get(keys[0])
+    if holder_id is not None and holder_id != str(args[0]):
+        return holder_id
+    connection.set(keys[0], args[0], ex=int(args[1]))
+    connection.hmset(keys[1], dict(zip(args[2::2], args[3::2])))
+    return 1
+
+
+# Takes a unique lock, unless another job holds it, and saves the job
+# holding it.  Otherwise returns the id of the holder of the lock
+save_if_unlocked = Script("""
+local holder_id = redis.call('GET', KEYS[1])
+if holder_id and holder_id ~= ARGV[1] then
+    return holder_id
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('HMSET', KEYS[2], unpack(ARGV, 3))
+return 1
+""", _save_if_unlocked)
+
+
+def _take_out_of_indexes(connection, keys, args):
+    entry = connection.hget(keys[0], args[1])
+    if entry is None:
+        return 0
+    connection.hdel(keys[0], args[1])
+    for part in entry.split(','):
+        connection.srem(args[0] + part, args[1])
+    return 1
+
+
+# Takes a popped job id out of the indexes of its queue, as recorded in the
+# `jobs` hash of the indexes (see `Job.index_entry`).  KEYS are that hash,
+# ARGV the prefix of the index keys of the queue and the job id.  The index
+# sets share the hash tag of the hash in cluster mode
+take_out_of_indexes = Script("""
+local entry = redis.call('HGET', KEYS[1], ARGV[2])
+if not entry then
+    return 0
+end
+redis.call('HDEL', KEYS[1], ARGV[2])
+for part in string.gmatch(entry, '[^,]+') do
+    redis.call('SREM', ARGV[1] .. part, ARGV[2])
+end
+return 1
+""", _take_out_of_indexes)
+
+
+def _pop_unindexed(connection, keys, args):
+    job_id = connection.lpop(keys[0])
+    if job_id is not None:
+        _take_out_of_indexes(connection, keys[1:], [args[0], job_id])
+    return job_id
+
+
+# Pops a job id off a queue and takes it out of the indexes of the queue in
+# the same step.  KEYS are the queue and the `jobs` hash of its indexes, ARGV
+# the prefix of its index keys
+pop_unindexed = Script("""
+local job_id = redis.call('LPOP', KEYS[1])
+if not job_id then
+    return false
+end
+local entry = redis.call('HGET', KEYS[2], job_id)
+if entry then
+    redis.call('HDEL', KEYS[2], job_id)
+    for part in string.gmatch(entry, '[^,]+') do
+        redis.call('SREM', ARGV[1] .. part, job_id)
+    end
+end
+return job_id
+""", _pop_unindexed)
+
+
+def _remove_from_list(connection, keys, args):
+    removed = set(args)
+    job_ids = connection.lrange(keys[0], 0, -1)
+    kept = [job_id for job_id in job_ids if job_id not in removed]
+    if len(kept) < len(job_ids):
+        connection.delete(keys[0])
+        if kept:
+            connection.rpush(keys[0], *kept)
+    return len(job_ids) - len(kept)
+
+
+# Rebuilds a queue without the given job ids, in a single pass over it, and
+# returns the number of ids removed
+remove_from_list = Script("""
+local removed = {}
+for _, job_id in ipairs(ARGV) do
+    removed[job_id] = true
+end
+local job_ids = redis.call('LRANGE', KEYS[1], 0, -1)
+local kept = {}
+for _, job_id in ipairs(job_ids) do
+    if not removed[job_id] then
+        table.insert(kept, job_id)
+    end
+end
+if #kept < #job_ids then
+    redis.call('DEL', KEYS[1])
+    for i = 1, #kept, 1000 do
+        redis.call('RPUSH', KEYS[1], unpack(kept, i, math.min(i + 999, #kept)))
+    end
+end
+return #job_ids - #kept
+""", _remove_from_list)
+
+
+def _drop_missing(connection, keys, args):
+    dropped = 0
+    while dropped < int(args[1]):
+        job_id = connection.lindex(keys[0], 0)
+        if job_id is None or connection.exists(args[0] + job_id):
+            break
+        connection.lpop(keys[0])
+        dropped += 1
+    return dropped
+
+
+# Pops the ids of jobs that do not exist anymore off the front of a queue,
+# up to the given number of them, and returns how many it popped.  ARGV are
+# the prefix of the job keys and that number.  The job hashes share the hash
+# tag of the queue in cluster mode
+drop_missing = Script("""
+local dropped = 0
+while dropped < tonumber(ARGV[2]) do
+    local job_id = redis.call('LINDEX', KEYS[1], 0)
+    if not job_id or redis.call('EXISTS', ARGV[1] .. job_id) == 1 then
+        break
+    end
+    redis.call('LPOP', KEYS[1])
+    dropped = dropped + 1
+end
+return dropped
+""", _drop_missing)
+
+
 class Queue(object):
     namespace_prefix = "dpq:queue:"
+    cluster_block_timeout = 1
+    # The most job ids dropped per round trip when skipping cancelled jobs
+    skip_batch_size = 1000
 
     @classmethod
     def all(cls, connection=None):
-        """Return an iterable of all Queues"""
+        """Return an iterable of all Queues, on the given connection, or the
+        current one.  The queues share it.
+        """
         prefix = cls.namespace_prefix
-        if connection is None:
-            connection = resolve_connection()
+        connection = resolve_connection(connection)
 
         def to_queue(queue_key):
             return cls.from_queue_key(queue_key, connection=connection)
@@ -38,20 +194,31 @@ class Queue(object):
         prefix = cls.namespace_prefix
         if not queue_key.startswith(prefix):
             raise ValueError('Not a valid DPQ queue key: %s' % queue_key)
-        name = queue_key[len(prefix):]
-        return Queue(name, connection=connection)
+        name = strip_hash_tag(queue_key[len(prefix):])
+        return cls(name, connection=connection)
+
+    @classmethod
+    def key_for(cls, name, cluster=False):
+        """Return the redis key for the queue with the given name.  In
+        cluster mode the name is used as hash tag, so the queue shares its
+        slot with the jobs enqueued on it.
+        """
+        if cluster:
+            name = hash_tag(name)
+        return '%s%s' % (cls.namespace_prefix, name)
 
     def __init__(self, name='default', default_timeout=None, connection=None,
-                 default_job_timeout=180):
-        if connection is None:
-            connection = resolve_connection()
+                 default_job_timeout=180, packed=False, indexed=False):
+        connection = resolve_connection(connection)
 
         self.connection = connection
-        prefix = self.namespace_prefix
+        self._cluster = is_cluster(connection)
         self.name = name
-        self._key = '%s%s' % (prefix, name)
+        self._key = self.key_for(name, self._cluster)
         self._default_timeout = default_timeout
         self.default_job_timeout = default_job_timeout
+        self.packed = packed
+        self.indexed = indexed
 
     @property
     def key(self):
@@ -59,8 +226,16 @@ class Queue(object):
         return self._key
 
     def empty(self):
-        """Remove all message on the Queue"""
-        self.connection.delete(self.key)
+        """Remove all message on the Queue, and its indexes"""
+        p = pipeline_for(self.connection)
+        p.delete(self.key)
+        p.delete(self.index_key('jobs'))
+        for kind in ['func', 'tag']:
+            names_key = self.index_key(kind + 's')
+            for name in self.connection.smembers(names_key):
+                p.delete(self.index_key(kind, name))
+            p.delete(names_key)
+        p.execute()
 
     def is_empty(self):
         """Return whether the current queue is empty"""
@@ -71,6 +246,12 @@ class Queue(object):
         """Return all job ids in the Queue"""
         return self.connection.lrange(self.key, 0, -1)
 
+    def waiting_job_ids(self):
+        """Return the ids of the jobs waiting for a worker, i.e. all job ids
+        in the Queue.
+        """
+        return self.job_ids
+
     @property
     def jobs(self):
         """Return all jobs in the Queue"""
@@ -89,104 +270,560 @@ class Queue(object):
         """Return a count of all message in the queue"""
         return self.connection.llen(self.key)
 
+    @property
+    def latency(self):
+        """Return how many seconds the job at the front of the queue has been
+        waiting, or 0 if the queue is empty.
+        """
+        job_id = self.connection.lindex(self.key, 0)
+        if job_id is None:
+            return 0
+        job = Job(job_id, connection=self.connection)
+        try:
+            job.refresh()
+        except (NoSuchJobError, UnpickleError):
+            return 0
+        if job.enqueued_at is None:
+            return 0
+        waited = times.now() - job.enqueued_at
+        return max(waited.total_seconds(), 0)
+
+    @property
+    def expired_count(self):
+        """Return how many jobs of this queue expired before a worker got to
+        them.
+        """
+        return int(self.connection.hget(Job.expired_key, self.name) or 0)
+
+    def index_key(self, *parts):
+        return Job.index_key(self.name, self._cluster, *parts)
+
+    def count_by(self, kind):
+        names = list(self.connection.smembers(self.index_key(kind + 's')))
+        p = self.connection.pipeline(transaction=False)
+        for name in names:
+            p.scard(self.index_key(kind, name))
+        return dict((name, count) for name, count in zip(names, p.execute())
+                    if count)
+
+    def count_by_func(self):
+        """Return how many indexed jobs of each function are queued, by
+        function name.  Takes one round trip, whatever the length of the
+        queue.
+        """
+        return self.count_by('func')
+
+    def count_by_tag(self):
+        """Return how many indexed jobs with each tag are queued, by
+        tag.
+        """
+        return self.count_by('tag')
+
+    def find(self, func_name=None, tag=None):
+        """Return the queued indexed jobs of the given function and/or with
+        the given tag, fetching only those.
+        """
+        keys = []
+        if func_name is not None:
+            keys.append(self.index_key('func', func_name))
+        if tag is not None:
+            keys.append(self.index_key('tag', tag))
+        if not keys:
+            raise ValueError('Expected a func_name or a tag.')
+        job_ids = self.find_job_ids(keys)
+        return compact(Job.fetch_many(job_ids, connection=self.connection))
+
+    def find_job_ids(self, index_keys):
+        """Return the ids in all the given index sets.
+
+        Job ids are taken out of the indexes in the same step as they are
+        popped off the queue (see `pop_from`), so the sets only hold queued
+        jobs, and looking them up does not depend on the queue's length.
+        """
+        return list(self.connection.sinter(index_keys))
+
+    @property
+    def cancelled_count(self):
+        """Return how many jobs of this queue were cancelled."""
+        return int(self.connection.hget(Job.cancelled_key, self.name) or 0)
+
+    def take_job_ids(self):
+        """Removes all job ids from the queue at once, and returns them."""
+        # Keeps the hash tag in cluster mode, RENAME needs both keys in the
+        # same slot.  Unique, so concurrent takes do not clobber each other
+        taken_key = 'dpq:taken:%s:%s' % (self.key[len(self.namespace_prefix):],
+                                         uuid4().hex)
+        try:
+            self.connection.rename(self.key, taken_key)
+        except ResponseError:
+            # No such key, the queue is empty
+            return []
+        p = pipeline_for(self.connection)
+        p.lrange(taken_key, 0, -1)
+        p.delete(taken_key)
+        return p.execute()[0]
+
+    def cancel_jobs(self, func_name=None):
+        """Cancels all jobs waiting in this queue, or only those of the
+        function with the given name.  Returns the number of jobs cancelled.
+
+        Cancelling all jobs empties the queue.  Jobs cancelled by function
+        are looked up in the function index on indexed queues, and read one
+        by one otherwise; their ids are then removed from the queue in a
+        single pass over it.
+        """
+        if func_name is None:
+            job_ids = self.take_job_ids()
+        elif self.indexed:
+            job_ids = list(self.connection.smembers(
+                self.index_key('func', func_name)))
+        else:
+            job_ids = []
+            all_ids = self.waiting_job_ids()
+            for start in range(0, len(all_ids), Job.cancel_batch_size):
+                batch_ids = all_ids[start:start + Job.cancel_batch_size]
+                for job in Job.fetch_many(batch_ids,
+                                          connection=self.connection):
+                    if job is not None and job.func_name == func_name:
+                        job_ids.append(job.id)
+        cancelled = Job.cancel_many(job_ids, connection=self.connection)
+        if func_name is not None:
+            self.remove_job_ids(job_ids)
+        return cancelled
+
+    def remove_job_ids(self, job_ids):
+        """Removes the given job ids from the queue, wherever they are.
+
+        The queue is rebuilt without them on the server, in one pass over
+        it whatever the number of ids, instead of scanning it once per id
+        with LREM.
+        """
+        if job_ids:
+            remove_from_list([self.key], job_ids, self.connection)
+
+    def drop_missing_jobs(self):
+        """Removes the ids of jobs that do not exist anymore, e.g. cancelled
+        ones, from the front of the queue, up to the first live one.
+        Returns the number of ids dropped.
+
+        The ids are checked and popped on the server, `skip_batch_size` per
+        round trip, so the ids of live jobs never leave the queue, even for
+        a moment.
+        """
+        dropped = 0
+        while True:
+            count = drop_missing([self.key],
+                                 [Job.key_for(''), self.skip_batch_size],
+                                 self.connection)
+            dropped += count
+            if count < self.skip_batch_size:
+                return dropped
+
+    def drop_stale_index_entries(self):
+        """Takes the ids of jobs that are not waiting in the queue anymore
+        out of its indexes, e.g. of jobs popped by a worker that died before
+        it could take them out.  Returns the number of ids taken out.
+
+        Reads the whole queue, so it is only done when a worker starts and
+        by `compat`, not while dequeueing.
+        """
+        jobs_key = self.index_key('jobs')
+        indexed = self.connection.hkeys(jobs_key)
+        if not indexed:
+            return 0
+        # Read after the indexes: jobs are queued before they are indexed,
+        # so an indexed job that is not found here has left the queue
+        waiting = set(self.waiting_job_ids())
+        stale = [job_id for job_id in indexed if job_id not in waiting]
+        p = pipeline_for(self.connection)
+        for job_id in stale:
+            take_out_of_indexes([jobs_key], [self.index_key(''), job_id], p)
+        p.execute()
+        return len(stale)
+
     def compat(self):
         """Remove all dead jobs from queue by cycling through it, while
-        guarantueeing FIFO semamtics.
+        guarantueeing FIFO semamtics.  Then takes the jobs that left the
+        queue out of its indexes.
         """
-        COMPAT_QUEUE = 'dpq:queue:_compat'
+        if self._cluster:
+            # RENAME needs both keys in the same slot
+            COMPAT_QUEUE = '%s:_compat' % self.key
+        else:
+            COMPAT_QUEUE = 'dpq:queue:_compat'
         self.connection.rename(self.key, COMPAT_QUEUE)
         while True:
             job_id = self.connection.lpop(COMPAT_QUEUE)
             if job_id is None:
                 break
-            if Job.exists(job_id):
+            if Job.exists(job_id, self.connection):
                 self.connection.rpush(self.key, job_id)
+        self.drop_stale_index_entries()
 
     def push_job_id(self, job_id):
         self.connection.rpush(self.key, job_id)
 
+    def push_job_ids(self, job_ids, pipeline=None):
+        """Pushes the given job ids, on the given pipeline if any."""
+        if pipeline is None:
+            self.connection.rpush(self.key, *job_ids)
+        else:
+            pipeline.rpush(self.key, *job_ids)
+
+    def ack(self, job):
+        """Acknowledges that the given job, taken from this queue, has been
+        handled.  List-based queues forget a job as soon as it is popped, so
+        there is nothing to do here.
+        """
+        pass
+
     def enqueue(self, func, *args, **kwargs):
+        """Creates a job calling `func(*args, **kwargs)` and enqueues it.
+
+        The keyword arguments `timeout`, `unique_key`, `cache_ttl`,
+        `expires_at`, `ttl`, `retry`, `backoff` and `tags` are reserved.  With
+        `unique_key`, the job is skipped while an equivalent job (one with
+        the same unique key) is queued or running on this queue, and that job
+        is returned instead.  Pass `unique_key=True` to derive the key from
+        the function and its arguments.
+
+        With `cache_ttl` (which defaults to the TTL given to the function's
+        `memoize` decorator), workers reuse the result of an earlier call
+        with equal arguments from the last `cache_ttl` seconds instead of
+        running the job.
+
+        Jobs of functions decorated with `batch` are performed together with
+        other queued jobs of the same function (see `dpq.batching`).
+
+        `func` may also be a `chain` of functions, called one after the
+        other by the same worker (see `dpq.chains`).  Chained jobs are not
+        cached.
+
+        A job enqueued with `expires_at` (a UTC datetime) or `ttl` (in
+        seconds from now) is discarded instead of performed if no worker
+        got to it in time.  Discarded jobs are counted in `expired_count`.
+
+        A job enqueued with `retry` (which defaults to the one given to the
+        function's `retry` decorator) is retried that many times when it
+        fails, after a jittered exponential delay starting at `backoff`
+        seconds, before it is moved to the failed queue (see `dpq.retries`).
+
+        Queues created with `packed=True` save their jobs in the compact
+        single-field format (see `Job.dump`).  Workers read both formats.
+
+        Jobs enqueued on queues created with `indexed=True`, or with `tags`
+        (a list of strings without commas), are indexed by function and tag
+        while they are queued (see `count_by_func` and `find`).
+        """
+        job = self.create_job(func, args, kwargs)
+        return self.enqueue_job(job)
+
+    def enqueue_many(self, calls):
+        """Enqueues a job for each of the given `(func, args, kwargs)`
+        tuples (`kwargs`, or both, may be left out), saving and pushing all
+        of them in a single round trip.  Returns the jobs.
+
+        Takes the same reserved keyword arguments as `enqueue`, except for
+        `unique_key`.
+        """
+        jobs = []
+        for call in calls:
+            func, args, kwargs = (tuple(call) + ((), {}))[:3]
+            job = self.create_job(func, args, dict(kwargs))
+            if job.unique_lock is not None:
+                raise ValueError('enqueue_many does not support unique_key.')
+            self.prepare_job(job)
+            jobs.append(job)
+        if not jobs:
+            return jobs
+        p = pipeline_for(self.connection)
+        for job in jobs:
+            p.hmset(job.key, job.dump())
+        # Pushed before being indexed, see `enqueue_job`
+        self.push_job_ids([job.id for job in jobs], pipeline=p)
+        for job in jobs:
+            job.index(p)
+        p.execute()
+        return jobs
+
+    def create_job(self, func, args, kwargs):
+        """Creates a job calling `func(*args, **kwargs)`, taking the
+        reserved keyword arguments described in `enqueue` out of `kwargs`.
+        """
+        steps = ()
+        if isinstance(func, Chain):
+            if 'cache_ttl' in kwargs:
+                raise ValueError('Chained jobs cannot be cached.')
+            func, steps = func.first, func.rest
+            kwargs['cache_ttl'] = None
         if func.__module__ == '__main__':
             raise ValueError("Functions from __main__ module cannot be "
                              "processed by workers.")
         timeout = kwargs.pop('timeout', None)
+        unique_key = kwargs.pop('unique_key', None)
+        cache_ttl = kwargs.pop('cache_ttl',
+                               getattr(func, '_dpq_cache_ttl', None))
+        expires_at = kwargs.pop('expires_at', None)
+        ttl = kwargs.pop('ttl', None)
+        if ttl is not None:
+            expires_at = times.now() + datetime.timedelta(seconds=ttl)
+        retries, backoff = getattr(func, '_dpq_retry', (0, None))
+        retries = kwargs.pop('retry', retries)
+        backoff = kwargs.pop('backoff', backoff)
+        tags = tuple(kwargs.pop('tags', ()))
+        if any(',' in tag for tag in tags):
+            raise ValueError('Tags cannot contain commas.')
+        batch = getattr(func, '_dpq_batch', None)
+        if batch is not None and kwargs:
+            raise ValueError("Batch functions cannot take keyword "
+                             "arguments.")
         job = Job.create(func, *args, connection=self.connection, **kwargs)
-        return self.enqueue_job(job, timeout=timeout)
+        job.timeout = timeout
+        job.cache_ttl = cache_ttl
+        job.batch = batch
+        job.expires_at = expires_at
+        job.retries = retries
+        job.backoff = backoff
+        job.tags = tags
+        job.chain = steps
+        if unique_key is True:
+            unique_key = job.get_unique_key()
+        if unique_key is not None:
+            job.unique_lock = self.unique_lock_key(unique_key)
+        return job
+
+    def unique_lock_key(self, unique_key):
+        """Return the redis key of the lock held by the queued or running
+        job with the given unique key.
+        """
+        name = hash_tag(self.name) if self._cluster else self.name
+        return 'dpq:unique:%s:%s' % (name, unique_key)
+
+    def lock_unique(self, job):
+        """Takes the unique lock of the given job and saves the job, both
+        at once.  Returns None on success (also when the job already held
+        the lock), or the equivalent job currently holding the lock, in
+        which case the job is not saved.
+
+        The lock expires after `Job.unique_lock_ttl` seconds, unless the
+        job is started (or retried) before.
+        """
+        lock = job.unique_lock
+        args = [job.id, Job.unique_lock_ttl]
+        for item in job.dump().items():
+            args.extend(item)
+        while True:
+            holder_id = save_if_unlocked([lock, job.key], args,
+                                         self.connection)
+            if holder_id == 1:
+                return None
+            try:
+                return Job.fetch(holder_id, connection=self.connection)
+            except NoSuchJobError:
+                # The holder is gone (e.g. cancelled), so the lock is stale
+                compare_and_delete([lock], [holder_id], self.connection)
 
     def enqueue_job(self, job, timeout=None, set_meta_data=True):
+        """Saves the job and pushes it onto the queue.
+
+        If the job carries a unique lock (see `enqueue`'s `unique_key`) that
+        is held by an equivalent queued or running job, nothing is saved or
+        enqueued and that job is returned instead.  Jobs moved here from
+        another queue without `set_meta_data` (e.g. quarantined ones) do not
+        take the lock.
+        """
+        self.prepare_job(job, timeout=timeout, set_meta_data=set_meta_data)
+        if job.unique_lock is not None and set_meta_data:
+            holder = self.lock_unique(job)
+            if holder is not None:
+                return holder
+        else:
+            job.save()
+        if job.indexed and job.origin == self.name:
+            # Index the job in the same round trip as pushing it, but not
+            # in other queues, e.g. the failed one.  Pushed first, so that
+            # `find` never sees it indexed but not queued when the pipeline
+            # is not transactional (in cluster mode)
+            p = pipeline_for(self.connection)
+            self.push_job_ids([job.id], pipeline=p)
+            job.index(p)
+            p.execute()
+        else:
+            self.push_job_id(job.id)
+        return job
+
+    def prepare_job(self, job, timeout=None, set_meta_data=True):
+        """Sets what a job needs to know about this queue before it is
+        saved.
+        """
+        if self.packed:
+            job.packed = True
+        if self.indexed or job.tags:
+            job.indexed = True
         if set_meta_data:
             job.origin = self.name
-            job.enqueue_at = times.now()
+            job.enqueued_at = times.now()
 
         if timeout is None:
-            timeout = self.default_job_timeout
+            timeout = job.timeout or self.default_job_timeout
         job.timeout = timeout
 
-        job.save()
-        self.push_job_id(job.id)
-        return job
+        if self._cluster and not job.id.startswith('{'):
+            # Co-locate the job hash with its queue
+            job.id = hash_tag(self.name) + job.id
+
+    @classmethod
+    def index_args(cls, queue_key, connection):
+        """Returns the key of the `jobs` hash of the indexes of the queue
+        with the given key, and the prefix of its index keys.
+        """
+        name = strip_hash_tag(queue_key[len(cls.namespace_prefix):])
+        cluster = is_cluster(connection)
+        return (Job.index_key(name, cluster, 'jobs'),
+                Job.index_key(name, cluster, ''))
+
+    @classmethod
+    def pop_from(cls, queue_key, connection, pipeline=None):
+        """Pops a job id off the queue with the given key, on the given
+        pipeline if any, and takes it out of the indexes of the queue at
+        the same time.
+        """
+        jobs_key, prefix = cls.index_args(queue_key, connection)
+        if pipeline is None:
+            pipeline = connection
+        return pop_unindexed([queue_key, jobs_key], [prefix], pipeline)
 
     def pop_job_id(self):
-        return self.connection.lpop(self.key)
+        return self.pop_from(self.key, self.connection)
+
+    def pop_job_ids(self, count):
+        """Pops up to `count` job ids off the front of the queue, without
+        blocking, in a single round trip.
+        """
+        p = pipeline_for(self.connection)
+        for _ in range(count):
+            self.pop_from(self.key, self.connection, pipeline=p)
+        return [job_id for job_id in p.execute() if job_id is not None]
+
+    def return_job_ids(self, job_ids):
+        """Puts job ids popped off this queue, but not handled, back at its
+        front, keeping their order.  Indexed jobs have to be indexed again.
+        """
+        if job_ids:
+            self.connection.lpush(self.key, *reversed(job_ids))
 
     @classmethod
-    def lpop(cls, queue_keys, blocking):
-        conn = resolve_connection()
+    def lpop(cls, queue_keys, blocking, connection=None, timeout=None):
+        """Pops a job id off the first non-empty queue of `queue_keys`.
+
+        When blocking, waits up to `timeout` seconds (forever if None) and
+        returns None once it is exceeded.
+
+        The job id is taken out of the indexes of its queue in the same step
+        as it is popped, except when it was waited for with BLPOP, which
+        cannot run along with anything.  Indexed jobs are then taken out of
+        the indexes by `dequeue_any`, once they are fetched.
+        """
+        conn = resolve_connection(connection)
+        if blocking and is_cluster(conn):
+            slots = group_by_slot(queue_keys)
+            if len(slots) > 1:
+                return cls.lpop_across_slots(slots, conn, timeout)
         if blocking:
-            queue_key, job_id = conn.blpop(queue_keys)
-            return queue_key, job_id
+            return conn.blpop(queue_keys, timeout or 0)
         else:
             for queue_key in queue_keys:
-                blob = conn.lpop(queue_key)
+                blob = cls.pop_from(queue_key, conn)
                 if blob is not None:
                     return queue_key, blob
             return None
 
+    @classmethod
+    def lpop_across_slots(cls, slots, connection, timeout=None):
+        """Blocking pop over queue keys living in different cluster slots.
+
+        A single BLPOP cannot span slots, so this first tries a non-blocking
+        pop over all keys (keeping their priority order), and then waits on
+        each group of same-slot keys in turn for `cluster_block_timeout`
+        seconds until a job arrives or `timeout` is exceeded.
+        """
+        queue_keys = [key for keys in slots for key in keys]
+        if timeout:
+            deadline = time.time() + timeout
+        while True:
+            result = cls.lpop(queue_keys, False, connection)
+            if result is not None:
+                return result
+            for keys in slots:
+                result = connection.blpop(keys, cls.cluster_block_timeout)
+                if result is not None:
+                    return result
+            if timeout and time.time() >= deadline:
+                return None
+
     def dequeue(self):
         """Dequeue the front-most job from this queue.
 
         Return a Job instance, which can be executed or inspected.
         """
-        job_id = self.pop_job_id()
-        if job_id is None:
-            return None
-        try:
-            job = Job.fetch(job_id, self.connection)
-        except NoSuchJobError as e:
-            return self.dequeue()
-        except UnpickleError as e:
-            e.queue = self
-            raise e
-        return job
+        while True:
+            job_id = self.pop_job_id()
+            if job_id is None:
+                return None
+            job = Job(job_id, connection=self.connection)
+            try:
+                job.refresh(check_expiry=True)
+            except JobExpiredError:
+                job.discard_expired()
+                continue
+            except NoSuchJobError as e:
+                self.drop_missing_jobs()
+                continue
+            except UnpickleError as e:
+                e.queue = self
+                raise e
+            return job
 
     @classmethod
-    def dequeue_any(cls, queues, blocking, connection=None):
+    def dequeue_any(cls, queues, blocking, connection=None, timeout=None):
         """Class method returning the Job instance at the front of the given
         set of Queues, where the order of the queues is important.
 
         When all of the Queues are empty, depending on the `blocking` argument,
         either blocks execution of this function until new messages arrive on
-        any of the queues, or returns None.
+        any of the queues (or `timeout` seconds have passed), or returns None.
         """
-        queue_keys = [q.key for q in queues]
-        result = cls.lpop(queue_keys, blocking)
-        if result is None:
-            return None
-        queue_key, job_id = result
-        queue = Queue.from_queue_key(queue_key, connection=connection)
-        try:
-            job = Job.fetch(job_id, connection=connection)
-        except NoSuchJobError:
-            # Silently pass on jobs that don't exist (anymore),
-            # and continue by reinvoking the same function recursively
-            return cls.dequeue_any(queues, blocking, connection=connection)
-        except UnpickleError as e:
-            # Attach queue information on the exception for improved error
-            # reporting
-            e.job_id = job_id
-            e.queue = queue
-            raise e
-        return job, queue
+        by_key = dict((q.key, q) for q in queues)
+        if connection is None and queues:
+            connection = queues[0].connection
+        while True:
+            result = cls.lpop([q.key for q in queues], blocking,
+                              connection=connection, timeout=timeout)
+            if result is None:
+                return None
+            queue_key, job_id = result
+            queue = by_key[queue_key]
+            job = Job(job_id, connection=queue.connection)
+            try:
+                job.refresh(check_expiry=True)
+            except JobExpiredError:
+                job.discard_expired()
+                continue
+            except NoSuchJobError:
+                # Silently pass on jobs that don't exist (anymore), and on
+                # the ones cancelled along with them
+                queue.drop_missing_jobs()
+                continue
+            except UnpickleError as e:
+                # Attach queue information on the exception for improved
+                # error reporting
+                e.job_id = job_id
+                e.queue = queue
+                raise e
+            if job.indexed:
+                # In case it was popped by BLPOP, see `lpop`
+                job.unindex()
+            return job, queue
 
     def __hash__(self):
         return hash(self.name)
@@ -198,35 +835,681 @@ class Queue(object):
         return '<Queue \'%s\'>' % (self.name,)
 
 
+def fingerprint(func_name, exc_info, reason=None):
+    """Returns a fingerprint identifying failures of the given function with
+    the same exception type, raised from the same code path.  Exception
+    messages are left out, as they tend to contain ids and such.
+    """
+    lines = (exc_info or '').strip().splitlines()
+    frames = [line.strip() for line in lines if line.startswith('  File ')]
+    if frames or not reason:
+        exception = lines[-1].split(':', 1)[0] if lines else ''
+    else:
+        # E.g. a timeout, whose message names the killed work horse
+        exception = reason
+    signature = '\n'.join([func_name or '', exception] + frames)
+    if isinstance(signature, unicode):
+        signature = signature.encode('utf-8')
+    return hashlib.sha1(signature).hexdigest()
+
+
 class FailedQueue(Queue):
-    def __init__(self, connection=None):
+    """The queue of jobs that failed, with statistics about the failures.
+
+    Failures are grouped by `fingerprint`, counting them and keeping a
+    sample traceback per group, and the failed jobs are indexed by their
+    origin queue and function.  None of this requires to scan the queue.
+
+    With `max_length` and/or `max_age` (in seconds), the oldest failed jobs
+    are deleted once there are more of them, or once they are older.
+    Groups are dropped once they have not been seen for `max_age` seconds.
+    """
+    times_key = 'dpq:failed:times'
+    indexes_key = 'dpq:failed:indexes'
+    groups_key = 'dpq:failures'
+    seen_key = 'dpq:failures:seen'
+    group_prefix = 'dpq:failure:'
+    max_length = None
+    max_age = None
+    trim_interval = 60
+
+    def __init__(self, connection=None, max_length=None, max_age=None):
         super(FailedQueue, self).__init__('filed', connection=connection)
+        if max_length is not None:
+            self.max_length = max_length
+        if max_age is not None:
+            self.max_age = max_age
+        self._last_trim = 0
+
+    def index_key(self, field, value):
+        return 'dpq:failed:%s:%s' % (field, value)
 
-    def quarantine(self, job, exc_info):
+    def group_key(self, fingerprint):
+        return self.group_prefix + fingerprint
+
+    def empty(self):
+        """Remove all failed jobs from the queue, and their indexes.  The
+        failure groups are kept.
+        """
+        p = pipeline_for(self.connection)
+        p.delete(self.key)
+        p.delete(self.times_key)
+        for index_key in self.connection.smembers(self.indexes_key):
+            p.delete(index_key)
+        p.delete(self.indexes_key)
+        p.execute()
+
+    def push_job_id(self, job_id):
+        p = pipeline_for(self.connection)
+        p.rpush(self.key, job_id)
+        p.zadd(self.times_key, time.time(), job_id)
+        length = p.execute()[0]
+        if self.max_length is not None and length > self.max_length:
+            self.trim()
+
+    def quarantine(self, job, exc_info, reason=None):
         """Puts the given Job in quarantine (i.e. put it on the failed
         queue).
 
         This is different from normal job enqueueing, since certain meta data
         must not be overridden (e.g. `origin` or `enqueued_at`) and other meta
-        data must be inserted (`ended_at` and `exc_info`).
+        data must be inserted (`ended_at`, `exc_info` and, for jobs that did
+        not fail by raising, the `reason`, e.g. 'timeout').
         """
         job.ended_at = times.now()
         job.exc_info = exc_info
-        return self.enqueue_job(job, set_meta_data=False)
+        job.failure_reason = reason
+        job = self.enqueue_job(job, set_meta_data=False)
+        self.record(job)
+        if self.max_age is not None and \
+                time.time() - self._last_trim >= self.trim_interval:
+            self.trim()
+        return job
+
+    def record(self, job):
+        """Counts the failure of the given job in its group and indexes
+        the job.
+        """
+        now = time.time()
+        digest = fingerprint(job.func_name, job.exc_info, job.failure_reason)
+        group_key = self.group_key(digest)
+        lines = (job.exc_info or '').strip().splitlines()
+        p = pipeline_for(self.connection)
+        p.zincrby(self.groups_key, digest, 1)
+        p.zadd(self.seen_key, now, digest)
+        p.hsetnx(group_key, 'first_seen', now)
+        p.hsetnx(group_key, 'func_name', job.func_name or '')
+        p.hsetnx(group_key, 'origin', job.origin or '')
+        p.hsetnx(group_key, 'exception',
+                 job.failure_reason or (lines[-1] if lines else ''))
+        p.hsetnx(group_key, 'sample', job.exc_info or '')
+        p.hset(group_key, 'last_seen', now)
+        for field, value in (('origin', job.origin),
+                             ('func', job.func_name)):
+            if value is None:
+                continue
+            index_key = self.index_key(field, value)
+            p.zadd(index_key, now, job.id)
+            p.sadd(self.indexes_key, index_key)
+        p.execute()
+
+    def trim(self):
+        """Deletes the failed jobs beyond `max_length`, or older than
+        `max_age`, and the groups not seen for `max_age`.
+        """
+        self._last_trim = time.time()
+        drop = 0
+        if self.max_length is not None:
+            drop = max(self.count - self.max_length, 0)
+        if self.max_age is not None:
+            cutoff = time.time() - self.max_age
+            drop = max(drop, self.connection.zcount(self.times_key, '-inf',
+                                                    cutoff))
+            self.trim_groups(cutoff)
+        if not drop:
+            return
+        # The queue is in the order of the scores in `times_key`
+        job_ids = self.connection.lrange(self.key, 0, drop - 1)
+        p = pipeline_for(self.connection)
+        p.ltrim(self.key, drop, -1)
+        if job_ids:
+            p.zrem(self.times_key, *job_ids)
+        for job_id in job_ids:
+            p.delete(Job.key_for(job_id))
+        p.zrange(self.times_key, 0, 0, withscores=True)
+        oldest = p.execute()[-1]
+        if oldest:
+            below = '(%r' % oldest[0][1]
+        else:
+            below = '+inf'
+        p = pipeline_for(self.connection)
+        for index_key in self.connection.smembers(self.indexes_key):
+            p.zremrangebyscore(index_key, '-inf', below)
+        p.execute()
+
+    def trim_groups(self, cutoff):
+        digests = self.connection.zrangebyscore(self.seen_key, '-inf',
+                                                cutoff)
+        if not digests:
+            return
+        p = pipeline_for(self.connection)
+        for digest in digests:
+            p.delete(self.group_key(digest))
+        p.zrem(self.groups_key, *digests)
+        p.zrem(self.seen_key, *digests)
+        p.execute()
+
+    def groups(self, limit=10):
+        """Returns the `limit` most frequent failure groups, as dicts."""
+        digests = self.connection.zrevrange(self.groups_key, 0, limit - 1,
+                                            withscores=True)
+        p = pipeline_for(self.connection)
+        for digest, _ in digests:
+            p.hgetall(self.group_key(digest))
+        groups = []
+        for (digest, count), group in zip(digests, p.execute()):
+            group['fingerprint'] = digest
+            group['count'] = int(count)
+            for name in ('first_seen', 'last_seen'):
+                if name in group:
+                    group[name] = float(group[name])
+            groups.append(group)
+        return groups
+
+    def counts_by(self, field):
+        """Returns the number of failed jobs by origin queue (`field` is
+        'origin') or by function (`field` is 'func').
+        """
+        prefix = self.index_key(field, '')
+        index_keys = [key for key in self.connection.smembers(
+            self.indexes_key) if key.startswith(prefix)]
+        p = pipeline_for(self.connection)
+        for index_key in index_keys:
+            p.zcard(index_key)
+        return dict((key[len(prefix):], count)
+                    for key, count in zip(index_keys, p.execute())
+                    if count)
+
+    def job_ids_by(self, origin=None, func_name=None, limit=100):
+        """Returns the ids of the most recently failed jobs from the given
+        origin queue or of the given function.
+        """
+        if origin is not None:
+            index_key = self.index_key('origin', origin)
+        elif func_name is not None:
+            index_key = self.index_key('func', func_name)
+        else:
+            raise ValueError('Expected an origin or a func_name.')
+        return self.connection.zrevrange(index_key, 0, limit - 1)
 
     def requeue(self, job_id):
-        """Requeues the job with the given job ID."""
+        """Requeues the job with the given job ID.
+
+        A job enqueued with a unique key takes its lock first.  While an
+        equivalent job holds it, an InvalidJobOperationError is raised and
+        the job stays in the failed queue.
+        """
         try:
             job = Job.fetch(job_id, connection=self.connection)
         except NoSuchJobError:
             # Silently ignore/remove this job and return (i.e. do nothing)
-            self.connection.lrem(self.key, job_id)
+            self.connection._lrem(self.key, 0, job_id)
+            self.connection.zrem(self.times_key, job_id)
             return
 
+        queue = origin_queue(job.origin, self.connection)
+        if job.unique_lock is not None:
+            holder = queue.lock_unique(job)
+            if holder is not None:
+                raise InvalidJobOperationError(
+                    'Cannot requeue %s while the equivalent job %s is queued '
+                    'or running.' % (job.id, holder.id))
+
         # Delete it from the failed queue (raise an error if that failed)
-        if self.connection.lrem(self.key, job.id) == 0:
+        if self.connection._lrem(self.key, 0, job.id) == 0:
+            job.release_unique_lock()
             raise InvalidJobOperationError('Cannot requeue non-failed jobs.')
+        p = pipeline_for(self.connection)
+        p.zrem(self.times_key, job.id)
+        p.zrem(self.index_key('origin', job.origin), job.id)
+        p.zrem(self.index_key('func', job.func_name), job.id)
+        p.hdel(job.key, 'ended_at', 'exc_info', 'failure_reason', 'attempts')
+        p.execute()
 
+        job.ended_at = None
         job.exc_info = None
-        q = Queue(job.origin, connection=self.connection)
-        q.enqueue_job(job)
+        job.failure_reason = None
+        job.attempts = 0
+        # Already holds its unique lock, if any
+        queue.enqueue_job(job)
+
+
+def parse_entries(entries):
+    """Turns raw stream entries into (entry id, job id) pairs.  Entries that
+    were deleted while pending come back without fields; their job id is None.
+    """
+    pairs = []
+    for entry_id, fields in entries or []:
+        job_id = None
+        if fields:
+            job_id = dict(zip(fields[::2], fields[1::2])).get('job_id')
+        pairs.append((entry_id, job_id))
+    return pairs
+
+
+class StreamQueue(Queue):
+    """A queue backed by a Redis Stream (Redis >= 6.2) instead of a list.
+
+    Workers read jobs through the consumer group `group_name`, `batch_size`
+    entries at a time, and acknowledge an entry only once its job has been
+    handled.  Entries of a worker that died while holding them stay pending
+    and are claimed by another worker once they have been idle for
+    `claim_after` seconds, which therefore has to exceed the job timeouts
+    used on the queue.  By default it is `claim_grace` seconds more than
+    the longest timeout of the jobs ever enqueued on the queue.  This gives
+    at-least-once delivery.  Entries still buffered when a worker stops are
+    taken over the same way.
+    """
+    namespace_prefix = "dpq:stream:"
+    group_name = 'dpq'
+    claim_interval = 5
+    claim_grace = 60
+    # Sorted set of the longest job timeout used on each stream, by name
+    timeouts_key = 'dpq:stream-timeouts'
+
+    def __init__(self, name='default', default_timeout=None, connection=None,
+                 default_job_timeout=180, packed=False, consumer=None,
+                 batch_size=10, claim_after=None):
+        super(StreamQueue, self).__init__(
+            name, default_timeout=default_timeout, connection=connection,
+            default_job_timeout=default_job_timeout, packed=packed)
+        if consumer is None:
+            hostname = socket.gethostname()
+            shortname, _, _ = hostname.partition('.')
+            consumer = '%s.%s' % (shortname, os.getpid())
+        self.consumer = consumer
+        self.batch_size = batch_size
+        self.claim_after = claim_after
+        self._buffer = []
+        self._in_flight = {}
+        self._has_group = False
+        self._claim_cursor = '0-0'
+        self._last_claim = 0
+        self._max_timeout = 0
+
+    @property
+    def job_ids(self):
+        """Return the ids of all jobs in the stream, including the ones
+        handed out to workers but not yet acknowledged.
+        """
+        entries = self.connection.execute_command('XRANGE', self.key,
+                                                  '-', '+')
+        return [job_id for _, job_id in parse_entries(entries)]
+
+    def last_delivered_id(self):
+        """Return the id of the last entry handed out to the consumer
+        group, or None if the group does not exist (yet).
+        """
+        try:
+            groups = self.connection.execute_command('XINFO', 'GROUPS',
+                                                     self.key)
+        except ResponseError:
+            # No such stream (yet)
+            return None
+        for group in groups:
+            info = dict(zip(group[::2], group[1::2]))
+            if info['name'] == self.group_name:
+                return info['last-delivered-id']
+        return None
+
+    def waiting_job_ids(self):
+        """Return the ids of the jobs in the stream that were not handed out
+        to a worker yet, leaving out the pending ones, which may be running.
+        """
+        last_id = self.last_delivered_id()
+        start = '-' if last_id is None else '(' + last_id
+        entries = self.connection.execute_command('XRANGE', self.key,
+                                                  start, '+')
+        return [job_id for _, job_id in parse_entries(entries)]
+
+    def take_job_ids(self):
+        """Returns the ids of the jobs in the stream that were not handed
+        out to a worker yet.  Unlike with lists, they stay in the stream,
+        the workers skip them once their jobs are gone.
+        """
+        return self.waiting_job_ids()
+
+    @property
+    def count(self):
+        """Return a count of all unacknowledged jobs in the stream"""
+        return self.connection.execute_command('XLEN', self.key)
+
+    @property
+    def latency(self):
+        """Return how many seconds the oldest entry not yet handed out to a
+        worker has been waiting, or 0 if there is none.
+        """
+        last_id = self.last_delivered_id()
+        start = '-' if last_id is None else '(' + last_id
+        entries = self.connection.execute_command('XRANGE', self.key, start,
+                                                  '+', 'COUNT', 1)
+        if not entries:
+            return 0
+        millis = int(entries[0][0].split('-')[0])
+        return max(time.time() - millis / 1000.0, 0)
+
+    def empty(self):
+        """Remove the stream, including its consumer group"""
+        super(StreamQueue, self).empty()
+        self._buffer = []
+        self._in_flight = {}
+        self._has_group = False
+
+    def compat(self):
+        """Remove all dead jobs from the stream."""
+        entries = self.connection.execute_command('XRANGE', self.key,
+                                                  '-', '+')
+        for entry_id, job_id in parse_entries(entries):
+            if not Job.exists(job_id, self.connection):
+                self.remove_entry(entry_id)
+
+    def prepare_job(self, job, timeout=None, set_meta_data=True):
+        """Also records the job's timeout, when it is the longest one yet,
+        for `claim_idle`.
+        """
+        super(StreamQueue, self).prepare_job(job, timeout=timeout,
+                                             set_meta_data=set_meta_data)
+        if job.timeout > self._max_timeout:
+            self.connection.execute_command('ZADD', self.timeouts_key, 'GT',
+                                            job.timeout, self.name)
+            self._max_timeout = job.timeout
+
+    def claim_idle(self):
+        """Returns the number of seconds after which entries held by
+        another consumer are claimed: `claim_after`, unless it is None.
+        """
+        if self.claim_after is not None:
+            return self.claim_after
+        timeout = self.connection.zscore(self.timeouts_key, self.name)
+        return max(timeout or 0, self.default_job_timeout) + self.claim_grace
+
+    def remove_job_ids(self, job_ids):
+        """Removes the entries of the given job ids from the stream."""
+        job_ids = set(job_ids)
+        if not job_ids:
+            return
+        entries = self.connection.execute_command('XRANGE', self.key,
+                                                  '-', '+')
+        entry_ids = [entry_id for entry_id, job_id in parse_entries(entries)
+                     if job_id in job_ids]
+        if entry_ids:
+            p = pipeline_for(self.connection)
+            p.execute_command('XACK', self.key, self.group_name, *entry_ids)
+            p.execute_command('XDEL', self.key, *entry_ids)
+            p.execute()
+
+    def push_job_id(self, job_id):
+        self.connection.execute_command('XADD', self.key, '*',
+                                        'job_id', job_id)
+
+    def push_job_ids(self, job_ids, pipeline=None):
+        p = pipeline
+        if p is None:
+            p = pipeline_for(self.connection)
+        for job_id in job_ids:
+            p.execute_command('XADD', self.key, '*', 'job_id', job_id)
+        if pipeline is None:
+            p.execute()
+
+    def ensure_group(self):
+        if self._has_group:
+            return
+        try:
+            self.connection.execute_command('XGROUP', 'CREATE', self.key,
+                                            self.group_name, '0',
+                                            'MKSTREAM')
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+        self._has_group = True
+
+    def remove_entry(self, entry_id):
+        p = pipeline_for(self.connection)
+        p.execute_command('XACK', self.key, self.group_name, entry_id)
+        p.execute_command('XDEL', self.key, entry_id)
+        p.execute()
+
+    def ack(self, job):
+        entry_id = self._in_flight.pop(job.id, None)
+        if entry_id is not None:
+            self.remove_entry(entry_id)
+
+    def claim_stuck(self):
+        """Takes over entries other consumers have held for longer than
+        `claim_idle()` seconds.  Runs at most every `claim_interval` seconds.
+        """
+        now = time.time()
+        if now - self._last_claim < self.claim_interval:
+            return
+        self._last_claim = now
+        self.ensure_group()
+        reply = self.connection.execute_command(
+            'XAUTOCLAIM', self.key, self.group_name, self.consumer,
+            int(self.claim_idle() * 1000), self._claim_cursor,
+            'COUNT', self.batch_size)
+        self._claim_cursor = reply[0]
+        self._buffer.extend(parse_entries(reply[1]))
+
+    def pop_job_id(self):
+        result = self.read([self], False)
+        if result is None:
+            return None
+        return result[1]
+
+    def pop_job_ids(self, count):
+        """Hands out up to `count` job ids without blocking, reading at most
+        one more batch of entries.  Each of them has to be acknowledged.
+        """
+        job_ids = []
+        filled = False
+        while len(job_ids) < count:
+            result = self.next_from_buffer()
+            if result is not None:
+                job_ids.append(result[1])
+            elif filled:
+                break
+            else:
+                self.fill(self, ['GROUP', self.group_name, self.consumer,
+                                 'COUNT', max(self.batch_size, count)])
+                filled = True
+        return job_ids
+
+    def return_job_ids(self, job_ids):
+        """Puts the entries of the given job ids back at the front of the
+        buffer, keeping their order.  They stay pending meanwhile, so they
+        are claimed by another worker after `claim_idle()` seconds if this
+        one stops before handing them out again.
+        """
+        entries = [(self._in_flight.pop(job_id), job_id)
+                   for job_id in job_ids if job_id in self._in_flight]
+        self._buffer[:0] = entries
+
+    def next_from_buffer(self):
+        """Hands out the next buffered entry, remembering it for `ack`."""
+        while self._buffer:
+            entry_id, job_id = self._buffer.pop(0)
+            if job_id is None:
+                self.remove_entry(entry_id)
+                continue
+            self._in_flight[job_id] = entry_id
+            return self.key, job_id
+        return None
+
+    @classmethod
+    def read(cls, queues, blocking, timeout=None):
+        """Returns (queue key, job id) of the next job on the given queues,
+        in order of priority, reading a batch of entries for each queue
+        whose buffer has run dry.
+        """
+        for queue in queues:
+            queue.claim_stuck()
+        connection = queues[0].connection
+        args = ['GROUP', cls.group_name, queues[0].consumer,
+                'COUNT', max(q.batch_size for q in queues)]
+        across_slots = is_cluster(connection) and \
+            len(group_by_slot([q.key for q in queues])) > 1
+        if timeout:
+            deadline = time.time() + timeout
+        while True:
+            for queue in queues:
+                result = queue.next_from_buffer()
+                if result is not None:
+                    return result
+            if across_slots:
+                # XREADGROUP cannot span slots, so read queue by queue
+                for queue in queues:
+                    cls.fill(queue, args)
+                if not any(q._buffer for q in queues):
+                    if not blocking:
+                        return None
+                    for queue in queues:
+                        cls.fill(queue, args,
+                                 block=cls.cluster_block_timeout)
+                        if queue._buffer:
+                            break
+                    if timeout and time.time() >= deadline:
+                        return None
+                continue
+            read_args = list(args)
+            if blocking:
+                read_args += ['BLOCK', int((timeout or 0) * 1000)]
+            for queue in queues:
+                queue.ensure_group()
+            read_args += ['STREAMS'] + [q.key for q in queues] + \
+                ['>'] * len(queues)
+            reply = connection.execute_command('XREADGROUP', *read_args)
+            if not reply:
+                return None
+            by_key = dict((q.key, q) for q in queues)
+            for key, entries in reply:
+                by_key[key]._buffer.extend(parse_entries(entries))
+
+    @classmethod
+    def fill(cls, queue, args, block=None):
+        """Reads a batch of entries of a single queue into its buffer."""
+        queue.ensure_group()
+        if block is not None:
+            args = args + ['BLOCK', int(block * 1000)]
+        reply = queue.connection.execute_command(
+            'XREADGROUP', *(args + ['STREAMS', queue.key, '>']))
+        for _, entries in reply or []:
+            queue._buffer.extend(parse_entries(entries))
+
+    @classmethod
+    def lpop(cls, queue_keys, blocking, connection=None, timeout=None):
+        """Same contract as `Queue.lpop`: takes the next job id off the
+        first non-empty stream of `queue_keys` for good, acknowledging its
+        entry right away.  Workers use `dequeue_any` instead, which only
+        acknowledges entries once their jobs have been handled.
+
+        Reads a single entry of a single stream at a time, so no other
+        entries are left pending; when blocking, waits on each stream in
+        turn for `cluster_block_timeout` seconds.
+        """
+        connection = resolve_connection(connection)
+        queues = [cls.from_queue_key(key, connection=connection)
+                  for key in queue_keys]
+        args = ['GROUP', cls.group_name, queues[0].consumer, 'COUNT', 1]
+        if timeout:
+            deadline = time.time() + timeout
+        block = None
+        while True:
+            for queue in queues:
+                cls.fill(queue, args, block=block)
+                result = queue.next_from_buffer()
+                if result is not None:
+                    queue.ack(Job(result[1], connection=connection))
+                    return result
+            if not blocking or (timeout and time.time() >= deadline):
+                return None
+            block = cls.cluster_block_timeout
+
+    def dequeue(self):
+        """Dequeue the front-most job from this stream.  The job must be
+        acknowledged with `ack` once it has been handled.
+        """
+        result = self.dequeue_any([self], False)
+        if result is None:
+            return None
+        return result[0]
+
+    @classmethod
+    def dequeue_any(cls, queues, blocking, connection=None, timeout=None):
+        """Same contract as `Queue.dequeue_any`, for stream queues.  The
+        returned job has to be acknowledged with `queue.ack(job)` once it has
+        been handled, or it will be delivered again.
+        """
+        by_key = dict((q.key, q) for q in queues)
+        while True:
+            result = cls.read(queues, blocking, timeout=timeout)
+            if result is None:
+                return None
+            queue_key, job_id = result
+            queue = by_key[queue_key]
+            job = Job(job_id, connection=queue.connection)
+            try:
+                job.refresh(check_expiry=True)
+            except JobExpiredError:
+                job.discard_expired()
+                queue.ack(job)
+                continue
+            except NoSuchJobError:
+                queue.ack(Job(job_id, connection=queue.connection))
+                continue
+            except UnpickleError as e:
+                queue.ack(Job(job_id, connection=queue.connection))
+                e.job_id = job_id
+                e.queue = queue
+                raise e
+            job.unindex()
+            return job, queue
+
+    def __repr__(self):  # noqa
+        return 'StreamQueue(%r)' % (self.name,)
+
+    def __str__(self):
+        return '<StreamQueue \'%s\'>' % (self.name,)
+
+
+def cancel_jobs(job_ids=None, func_name=None, origin=None,
+                connection=None):
+    """Cancels the jobs with the given ids, or the ones waiting in the
+    `origin` queue, or in any queue, of the function named `func_name` (or
+    of any function).  Returns the number of jobs cancelled.
+    """
+    connection = resolve_connection(connection)
+    if job_ids is not None:
+        return Job.cancel_many(job_ids, connection=connection)
+    if origin is not None:
+        queues = [origin_queue(origin, connection)]
+    elif func_name is not None:
+        # Only waiting jobs are cancelled, not the failed ones, nor the ones
+        # in the middle of a compaction
+        failed_key = get_failed_queue(connection).key
+        queues = [queue for queue in
+                  Queue.all(connection) + StreamQueue.all(connection)
+                  if queue.key != failed_key
+                  if not queue.key.endswith(':_compat')]
+    else:
+        raise ValueError('Expected job ids, a func_name or an origin.')
+    return sum(queue.cancel_jobs(func_name) for queue in queues)
+
+
+def origin_queue(name, connection=None):
+    """Returns the queue with the given name, as a stream queue if such a
+    stream exists.
+    """
+    connection = resolve_connection(connection)
+    if connection.exists(StreamQueue.key_for(name, is_cluster(connection))):
+        return StreamQueue(name, connection=connection)
+    return Queue(name, connection=connection)
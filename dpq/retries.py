@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+"""
+Automatic retries of failed jobs, with jittered exponential backoff.
+
+Jobs enqueued with `retry` (or whose function is decorated with `retry`)
+are not moved to the failed queue when they fail, but wait in the retry set
+of their queue and go back to it once their delay is over, until they ran
+out of attempts.
+"""
+
+import time
+import random
+
+from .connections import resolve_connection
+from .cluster import is_cluster, hash_tag, pipeline_for
+from .job import Job
+from .queue import StreamQueue, origin_queue
+from .scripts import Script
+
+
+def retry(max_retries, backoff=1):
+    """Retries failed jobs of the decorated function up to `max_retries`
+    times, the n-th time after about `backoff * 2 ** (n - 1)` seconds::
+
+        @retry(5, backoff=2)
+        def fetch(url):
+            ...
+    """
+    def decorator(func):
+        func._dpq_retry = (max_retries, backoff)
+        return func
+    return decorator
+
+
+def _requeue_due(connection, keys, args):
+    if not connection.zrem(keys[0], args[0]):
+        return 0
+    if args[1] == 'list':
+        connection.rpush(keys[1], args[0])
+    elif args[1] == 'stream':
+        connection.execute_command('XADD', keys[1], '*', 'job_id', args[0])
+    if args[2]:
+        connection.hset(keys[2], args[0], args[2])
+    for names_key, key, name in zip(keys[3::2], keys[4::2], args[3:]):
+        connection.sadd(names_key, name)
+        connection.sadd(key, args[0])
+    return 1
+
+
+# Takes a job off a retry set and, unless another worker got to it first,
+# pushes it onto its (list or stream) queue and adds it to its indexes.
+# KEYS are the retry set, the queue, the `jobs` hash of its indexes, then
+# (names set, index set) pairs; ARGV the job id, the kind of queue (empty
+# for jobs that are gone), the job's entry in the `jobs` hash (empty for
+# jobs that are not indexed), then the indexed names
+requeue_due = Script("""
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+if ARGV[2] == 'list' then
+    redis.call('RPUSH', KEYS[2], ARGV[1])
+elseif ARGV[2] == 'stream' then
+    redis.call('XADD', KEYS[2], '*', 'job_id', ARGV[1])
+end
+if ARGV[3] ~= '' then
+    redis.call('HSET', KEYS[3], ARGV[1], ARGV[3])
+end
+for i = 4, #KEYS, 2 do
+    redis.call('SADD', KEYS[i], ARGV[(i + 4) / 2])
+    redis.call('SADD', KEYS[i + 1], ARGV[1])
+end
+return 1
+""", _requeue_due)
+
+
+class RetryQueue(object):
+    """The time-ordered sets of failed jobs waiting for their next attempt,
+    one per origin queue, scored by when that attempt is due.
+    """
+    key_prefix = 'dpq:retry:'
+    # Set of the names of the queues with a retry set
+    origins_key = 'dpq:retry-origins'
+    default_backoff = 1
+    max_delay = 3600
+
+    @classmethod
+    def key_for(cls, origin, cluster=False):
+        """Return the redis key of the retry set of the given queue.  In
+        cluster mode the queue name is used as hash tag, so the set shares
+        its slot with the queue.
+        """
+        if cluster:
+            origin = hash_tag(origin)
+        return cls.key_prefix + origin
+
+    def __init__(self, connection=None):
+        self.connection = resolve_connection(connection)
+        self._cluster = is_cluster(self.connection)
+
+    def keys(self):
+        """Returns the origin queue names and the keys of their retry sets.
+        """
+        origins = sorted(self.connection.smembers(self.origins_key))
+        return [(origin, self.key_for(origin, self._cluster))
+                for origin in origins]
+
+    @property
+    def count(self):
+        p = self.connection.pipeline(transaction=False)
+        for _, key in self.keys():
+            p.zcard(key)
+        return sum(p.execute())
+
+    def delay(self, job):
+        """Returns the delay before the next attempt of the given job: the
+        exponential backoff, randomly cut by up to half so that jobs which
+        failed together do not come back together.
+        """
+        backoff = job.backoff
+        if backoff is None:
+            backoff = self.default_backoff
+        delay = min(backoff * 2 ** (job.attempts - 1), self.max_delay)
+        return delay / 2.0 + random.uniform(0, delay / 2.0)
+
+    def schedule(self, job, exc_info, reason=None):
+        """Saves the failed job and schedules its next attempt.  Returns the
+        delay in seconds.
+        """
+        job.exc_info = exc_info
+        job.failure_reason = reason
+        delay = self.delay(job)
+        p = pipeline_for(self.connection)
+        p.hmset(job.key, job.dump())
+        p.zadd(self.key_for(job.origin, self._cluster), time.time() + delay,
+               job.id)
+        p.sadd(self.origins_key, job.origin)
+        # Keep equivalent jobs out until the job is back in its queue
+        job.refresh_unique_lock(delay + Job.unique_lock_ttl, pipeline=p)
+        p.execute()
+        return delay
+
+    def enqueue_due(self, limit=100):
+        """Moves up to `limit` jobs per queue whose attempt is due back to
+        their queues.  Returns when the next attempt is due (as a
+        timestamp), or None if no job is waiting.
+
+        The jobs are read first, and then each of them is taken off its
+        retry set and pushed back in a single script, so a worker dying in
+        between loses none of them, and concurrent workers push each job
+        once.  This takes one round trip per queue with due jobs.
+        """
+        now = time.time()
+        keys = self.keys()
+        p = self.connection.pipeline(transaction=False)
+        for _, key in keys:
+            p.zrangebyscore(key, '-inf', now, start=0, num=limit)
+        due_ids = p.execute()
+        next_due = None
+        for (origin, key), job_ids in zip(keys, due_ids):
+            if not job_ids:
+                continue
+            queue = origin_queue(origin, self.connection)
+            kind = 'stream' if isinstance(queue, StreamQueue) else 'list'
+            jobs = Job.fetch_many(job_ids, connection=self.connection)
+            p = pipeline_for(self.connection)
+            jobs_key = Job.index_key(origin, self._cluster, 'jobs')
+            for job_id, job in zip(job_ids, jobs):
+                script_keys = [key, queue.key, jobs_key]
+                args = [job_id, kind if job is not None else '', '']
+                if job is not None and job.indexed:
+                    args[2] = job.index_entry()
+                    for names_key, name, index_key in job.index_keys():
+                        script_keys.extend([names_key, index_key])
+                        args.append(name)
+                requeue_due(script_keys, args, p)
+            p.execute()
+            if len(job_ids) == limit:
+                next_due = now
+        if next_due is not None:
+            return next_due
+        p = self.connection.pipeline(transaction=False)
+        for _, key in keys:
+            p.zrange(key, 0, 0, withscores=True)
+        scores = [due[0][1] for due in p.execute() if due]
+        if not scores:
+            return None
+        return min(scores)
+
+    def empty(self):
+        p = pipeline_for(self.connection)
+        for _, key in self.keys():
+            p.delete(key)
+        p.delete(self.origins_key)
+        p.execute()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+"""
+Scheduling policies deciding in which order a worker polls its queues.
+"""
+
+
+class WeightedRoundRobin(object):
+    """Smooth weighted round-robin (the variant used by nginx) over a worker's
+    queues.
+
+    Each call to `order` moves one queue to the front, such that over time a
+    queue with weight 5 comes first five times as often as a queue with
+    weight 1, interleaved rather than in bursts.  The remaining queues keep
+    their configured order, so a job is still taken from the next non-empty
+    queue when the preferred one is empty.  Queues without a weight get
+    `default_weight`.
+    """
+
+    def __init__(self, weights, default_weight=1):
+        for name, weight in weights.items():
+            if weight < 1:
+                raise ValueError('Weight of queue %s must be a positive '
+                                 'integer.' % (name,))
+        self.weights = dict(weights)
+        self.default_weight = default_weight
+        self._credits = {}
+
+    def weight(self, queue):
+        return self.weights.get(queue.name, self.default_weight)
+
+    def order(self, queues):
+        """Returns the given queues in the order they should be polled."""
+        if len(queues) < 2:
+            return queues
+        total = 0
+        preferred = None
+        for queue in queues:
+            weight = self.weight(queue)
+            total += weight
+            credit = self._credits.get(queue.name, 0) + weight
+            self._credits[queue.name] = credit
+            if preferred is None or credit > self._credits[preferred.name]:
+                preferred = queue
+        self._credits[preferred.name] -= total
+        return [preferred] + [q for q in queues if q is not preferred]
+
+
+def parse_weights(value):
+    """Parses a `name=weight,...` string into a list of (name, weight)
+    pairs, in the given order.
+    """
+    pairs = []
+    for item in value.split(','):
+        if not item:
+            continue
+        name, sep, weight = item.partition('=')
+        if not sep or not name:
+            raise ValueError('Expected name=weight, got %r.' % (item,))
+        pairs.append((name, int(weight)))
+    return pairs
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+"""
+Lua scripts, for the operations that have to be atomic on the server.
+
+Each script comes with an equivalent Python function, which `MemoryRedis`
+runs under its lock instead, since it cannot run Lua.
+"""
+
+import hashlib
+
+from redis.client import Script as RedisScript
+
+
+class Script(object):
+    """A Lua script along with its `fallback(connection, keys, args)`.
+
+    Call it with the keys and arguments, and the connection or pipeline to
+    run it on.  Through redis-py the script is run with EVALSHA, and loaded
+    first when the server does not know it.
+    """
+
+    def __init__(self, lua, fallback):
+        self.lua = lua
+        self.fallback = fallback
+        self._script = RedisScript(None, lua)
+        self._script.sha = hashlib.sha1(lua).hexdigest()
+
+    def __call__(self, keys, args, client):
+        run_script = getattr(client, 'run_script', None)
+        if run_script is not None:
+            return run_script(self, list(keys), list(args))
+        return self._script(keys=keys, args=args, client=client)
+
+
+def _compare_and_delete(connection, keys, args):
+    if connection.get(keys[0]) != str(args[0]):
+        return 0
+    return connection.delete(keys[0])
+
+
+# Deletes a key, unless it no longer holds the given value
+compare_and_delete = Script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""", _compare_and_delete)
+
+
+def _compare_and_expire(connection, keys, args):
+    if connection.get(keys[0]) != str(args[0]):
+        return 0
+    return int(connection.expire(keys[0], int(args[1])))
+
+
+# Sets the TTL of a key, unless it no longer holds the given value
+compare_and_expire = Script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+""", _compare_and_expire)
@@ -11,6 +11,9 @@ class JobTimeoutException(Exception):
 
 
 class death_pentalty_after(object):
+    """Raises a JobTimeoutException in the current process once `timeout`
+    seconds have passed.  Fractions of seconds are honoured.
+    """
     def __init__(self, timeout):
         self._timeout = timeout
 
@@ -35,19 +38,30 @@ class death_pentalty_after(object):
 
     def handle_death_penalty(self, signum, frame):
         raise JobTimeoutException('Job exceeded maximum timeout '
-                                  'value (%d seconds).' % self._timeout)
+                                  'value (%s seconds).' % self._timeout)
 
     def setup_death_penalty(self):
         """Sets up an alarm signal and a signal handler that raises
         a JobTimeoutException after the timeout amount (expressed in
-        seconds).
+        seconds, may be a float).
         """
         signal.signal(signal.SIGALRM, self.handle_death_penalty)
-        signal.alarm(self._timeout)
+        signal.setitimer(signal.ITIMER_REAL, self._timeout)
 
     def cancel_death_penalty(self):
         """Removes the death penalty alarm and puts back the system into
         default signal handling.
         """
-        signal.alarm(0)
+        signal.setitimer(signal.ITIMER_REAL, 0)
         signal.signal(signal.SIGALRM, signal.SIG_DFL)
+
+
+class no_death_penalty(death_pentalty_after):
+    """Does not enforce any timeout.  Used where signals cannot be installed,
+    e.g. when jobs run outside of the main thread.
+    """
+    def setup_death_penalty(self):
+        pass
+
+    def cancel_death_penalty(self):
+        pass
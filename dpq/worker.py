@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
 
 import os
+import math
 import errno
 import time
 import signal
 import socket
 import random
+import resource
+import threading
 import traceback
 from cPickle import dumps
 try:
@@ -15,10 +18,21 @@ except ImportError:
     from logging import Logger
 
 from .connections import resolve_connection
-from .queue import Queue, get_failed_queue
+from .cluster import pipeline_for
+from .queue import Queue, get_failed_queue, origin_queue
+from .job import Job, _job_stack, import_func
+from .chains import Chain
 from .exceptions import NoQueueError, UnpickleError
 from .utils import setproctitle, make_colorizer
-from .timeouts import death_pentalty_after
+from .cache import ResultCache
+from .retries import RetryQueue
+from .events import EventLog
+from .affinity import (
+    format_cpu_list, get_affinity, online_cpus, parse_cpu_list, set_affinity)
+from .limits import CPULimitExceeded, limit_resources, process_rss, usage
+from .scheduling import WeightedRoundRobin
+from .timeouts import (death_pentalty_after, no_death_penalty,
+                       JobTimeoutException)
 
 green = make_colorizer('darkgreen')
 yellow = make_colorizer('darkyellow')
@@ -45,17 +59,26 @@ def compact(l):
 class Worker(object):
     namespace_prefix = "dpq:worker:"
     workers_keys = "dpq:workers"
+    default_job_timeout = 180
+    death_penalty_class = death_pentalty_after
+    dequeue_timeout = None
+    batch_poll_interval = 0.005
+    retry_poll_interval = 5
+    # Seconds between two samples of the work horse's RSS, with a memory
+    # limit
+    memory_poll_interval = 0.1
 
     @classmethod
-    def all(cls):
+    def all(cls, connection=None):
         """Returns an iterable of all Workers.
         """
-        conn = resolve_connection()
+        conn = resolve_connection(connection)
         reported_working = conn.smembers(cls.workers_keys)
-        return compact(map(cls.find_by_key, reported_working))
+        return compact([cls.find_by_key(key, connection=conn)
+                        for key in reported_working])
 
     @classmethod
-    def find_by_key(cls, worker_key):
+    def find_by_key(cls, worker_key, connection=None):
         """Returns a Worker instance, based on the naming conventions for
         naming the internal Redis keys.  Can be used to reverse-lookup Workers
         by their Redis keys.
@@ -65,34 +88,62 @@ class Worker(object):
         if not worker_key.startswith(prefix):
             raise ValueError('Not a valid DQP worker key: %s' % (worker_key,))
 
-        conn = resolve_connection()
+        conn = resolve_connection(connection)
         if not conn.exists(worker_key):
             return None
 
         name = worker_key[len(prefix):]
-        worker = Worker([], name)
+        worker = Worker([], name, connection=conn)
         queues = conn.hget(worker.key, 'queues')
         worker._state = conn.hget(worker.key, 'state') or '?'
+        cpus = conn.hget(worker.key, 'cpu_affinity')
+        if cpus:
+            worker.cpu_affinity = parse_cpu_list(cpus)
         if queues:
-            worker.queues = map(Queue, queues.split(','))
+            worker.queues = [Queue(queue_name, connection=conn)
+                             for queue_name in queues.split(',')]
         return worker
 
-    def __init__(self, queues, name=None, rv_ttl=500, connection=None):  # noqa
-        if connection is None:
-            connection = resolve_connection()
-        self.connection = connection
+    def __init__(self, queues, name=None, rv_ttl=500, connection=None,  # noqa
+                 kill_grace=1, weights=None, events=False, memory_limit=None,
+                 cpu_limit=None, cpu_affinity=None):
         if isinstance(queues, Queue):
             queues = [queues]
+        if connection is None:
+            if queues:
+                # The connection of the queues, wherever the worker is built
+                connection = queues[0].connection
+            else:
+                connection = resolve_connection()
+        self.connection = connection
         self._name = name
         self.queues = queues
         self.validate_queues()
+        self.queue_class = type(queues[0]) if queues else Queue
         self.rv_ttl = rv_ttl
+        self.kill_grace = kill_grace
+        self.memory_limit = memory_limit
+        self.cpu_limit = cpu_limit
+        self.cpu_affinity = cpu_affinity
+        if weights:
+            self.scheduler = WeightedRoundRobin(weights)
+        else:
+            self.scheduler = None
         self._state = 'starting'
         self._is_horse = False
         self._horse_pid = 0
         self._stopped = False
+        self._held = []
         self.log = Logger('worker')
         self.failed_queue = get_failed_queue(connection=self.connection)
+        self.result_cache = ResultCache(connection=self.connection)
+        self.retry_queue = RetryQueue(connection=self.connection)
+        self._next_retry_check = 0
+        if events:
+            self.events = EventLog(connection=self.connection)
+        else:
+            self.events = None
+        self._started_at = None
 
     def validate_queues(self):  # noqa
         """Sanity check for the given queues."""
@@ -101,6 +152,8 @@ class Worker(object):
         for queue in self.queues:
             if not isinstance(queue, Queue):
                 raise NoQueueError('Give each worker at least one Queue.')
+        if len(set(map(type, self.queues))) > 1:
+            raise ValueError('A worker cannot mix different kinds of queues.')
 
     def queue_names(self):
         """Returns the queue names of this worker's queues."""
@@ -153,6 +206,30 @@ class Worker(object):
         """
         setproctitle('DPQ: %s' % (message,))
 
+    def pin(self):
+        """Pins the worker, and so the horses it forks, to the CPUs in
+        `cpu_affinity`.  A worker pinned by someone else (e.g. a pool, or
+        taskset) takes on the CPUs it runs on, to register them.
+        """
+        pinned = False
+        if self.cpu_affinity:
+            try:
+                pinned = set_affinity(self.cpu_affinity)
+                if not pinned:
+                    self.log.warning('Cannot pin workers to CPUs here.')
+            except OSError as e:
+                self.log.warning('Could not pin worker to CPUs %s: %s' % (
+                    format_cpu_list(self.cpu_affinity), e))
+        try:
+            cpus = get_affinity()
+        except OSError as e:
+            self.log.warning('Could not read the CPUs of the worker: %s' % e)
+            cpus = None
+        if cpus is not None and (pinned or cpus != sorted(online_cpus())):
+            self.cpu_affinity = cpus
+        else:
+            self.cpu_affinity = None
+
     def register_birth(self):  # noqa
         """Registers its own birth."""
         self.log.debug('Registering birth of worker %s' % (self.name,))
@@ -164,23 +241,74 @@ class Worker(object):
         key = self.key
         now = time.time()
         queues = ','.join(self.queue_names())
-        with self.connection.pipeline() as p:
+        with pipeline_for(self.connection) as p:
             p.delete(key)
             p.hset(key, 'birth', now)
             p.hset(key, 'queues', queues)
+            if self.cpu_affinity:
+                p.hset(key, 'cpu_affinity',
+                       format_cpu_list(self.cpu_affinity))
             p.sadd(self.workers_keys, key)
             p.execute()
+        self.emit('worker_started', queues=queues)
+        self.flush_events()
 
     def register_death(self):
         """Registers its own death."""
         self.log.debug('Registering death')
-        with self.connection.pipeline() as p:
+        with pipeline_for(self.connection) as p:
             # We cannot use self.state = 'dead' here, because that would
             # rollback the pipeline
             p.srem(self.workers_keys, self.key)
             p.hset(self.key, 'death', time.time())
             p.expire(self.key, 60)
             p.execute()
+        self.emit('worker_stopped')
+        self.flush_events()
+
+    def emit(self, event, job=None, **fields):
+        """Publishes a lifecycle event, about the given job if any, when
+        events are enabled.
+        """
+        if self.events is None:
+            return
+        fields['worker'] = self.name
+        if job is not None:
+            fields['job_id'] = job.id
+            fields['func'] = job.func_name
+            fields['queue'] = job.origin
+        self.events.emit(event, **fields)
+
+    def flush_events(self):
+        if self.events is not None:
+            self.events.flush()
+
+    def start_jobs(self, jobs):
+        """Publishes the start of the given jobs right away, before a work
+        horse is forked for them, so monitors do not learn about it only
+        once the horse has ended.
+
+        Also lets the unique locks of the jobs expire shortly after their
+        timeout, so they do not outlive a worker that dies meanwhile.
+        """
+        self._started_at = time.time()
+        locked = [job for job in jobs if job.unique_lock is not None]
+        if locked:
+            p = pipeline_for(self.connection)
+            for job in locked:
+                job.refresh_unique_lock(
+                    self.job_timeout(job) + Job.unique_lock_grace,
+                    pipeline=p)
+            p.execute()
+        for job in jobs:
+            self.emit('job_started', job)
+        self.flush_events()
+
+    def elapsed(self):
+        """Returns the seconds since the current job (or batch) was handed
+        to a work horse, formatted for events.
+        """
+        return '%.6f' % (time.time() - self._started_at)
 
     def set_state(self, new_state):
         self._state = new_state
@@ -251,7 +379,11 @@ class Worker(object):
         self._install_signal_handlers()
 
         did_perform_work = False
+        self.pin()
         self.register_birth()
+        for queue in self.queues:
+            # Left behind by workers that died right after popping a job
+            queue.drop_stale_index_entries()
         self.state = 'starting'
         try:
             while True:
@@ -266,8 +398,7 @@ class Worker(object):
                     '*** Listening on %s...' % green(', '.join(qnames)))
                 wait_for_job = not burst
                 try:
-                    result = Queue.dequeue_any(self.queues, wait_for_job,
-                                               connection=self.connection)
+                    result = self.dequeue_job(wait_for_job)
                     if result is None:
                         break
                 except UnpickleError as e:
@@ -281,58 +412,349 @@ class Worker(object):
                     continue
 
                 job, queue = result
-                self.log.info('%s: %s (%s)' % (green(queue.name),
-                                               blue(job.description), job.id))
+                if job.batch is not None:
+                    jobs = self.collect_batch(job, queue)
+                    self.log.info('%s: batch of %d x %s' % (
+                        green(queue.name), len(jobs), blue(job.func_name)))
+                else:
+                    jobs = [job]
+                    self.log.info('%s: %s (%s)' % (
+                        green(queue.name), blue(job.description), job.id))
 
                 self.state = 'busy'
-                self.fork_and_perform_job(job)
+                uncached = [j for j in jobs if not self.perform_cached_job(j)]
+                if uncached:
+                    self.fork_and_perform(uncached)
+                for job in jobs:
+                    queue.ack(job)
 
                 did_perform_work = True
         finally:
             if not self.is_horse:
+                self.return_held_jobs()
                 self.register_death()
         return did_perform_work
 
+    def job_timeout(self, job):
+        return job.timeout or self.default_job_timeout
+
+    def dequeue_job(self, blocking):
+        """Returns the next job and its queue.  Returns None when not
+        blocking and all queues are empty, or when the worker got stopped
+        while waiting for a job.
+
+        With `weights`, the queues are polled in the order picked by the
+        weighted round-robin scheduler.  A single BLPOP over the reordered
+        keys takes from the first non-empty queue right away and only blocks
+        when all of them are empty.
+
+        Failed jobs whose retry is due are moved back to their queues first.
+        The worker checks for them at least every `retry_poll_interval`
+        seconds, and when the next one is due, even while blocking.
+        Buffered events are published when no job is waiting.
+        """
+        while True:
+            timeout = self.dequeue_timeout
+            if blocking:
+                wait = self.enqueue_due_retries()
+                if self.events is not None and self.events.pending:
+                    wait = min(wait, self.events.flush_interval)
+                if timeout is None or wait < timeout:
+                    timeout = wait
+            else:
+                self.enqueue_due_retries()
+            queues = self.queues
+            if self.scheduler is not None:
+                queues = self.scheduler.order(queues)
+            result = self.queue_class.dequeue_any(
+                queues, blocking, connection=self.connection,
+                timeout=timeout)
+            if result is None:
+                # Idle, publish the buffered events
+                self.flush_events()
+            if result is not None or not blocking or self.stopped:
+                return result
+
+    def enqueue_due_retries(self):
+        """Moves the retries that are due back to their queues, unless
+        that was done recently.  Returns the number of seconds (at least 1)
+        until that should be done next.
+        """
+        now = time.time()
+        if now >= self._next_retry_check:
+            next_due = self.retry_queue.enqueue_due()
+            next_check = now + self.retry_poll_interval
+            if next_due is not None:
+                next_check = min(next_check, next_due)
+            self._next_retry_check = next_check
+        return max(int(math.ceil(self._next_retry_check - now)), 1)
+
+    def handle_failure(self, job, exc_info, reason=None):
+        """Schedules the next attempt of a failed job, or moves it to the
+        failed queue once it has no retries left.
+        """
+        job.attempts += 1
+        if job.attempts <= job.retries:
+            self.emit('job_retrying', job, duration=self.elapsed(),
+                      reason=reason)
+            delay = self.retry_queue.schedule(job, exc_info, reason=reason)
+            self.log.warning('Retrying job in %.1f seconds (attempt %d of '
+                             '%d).' % (delay, job.attempts + 1,
+                                       job.retries + 1))
+            return
+        self.emit('job_failed', job, duration=self.elapsed(), reason=reason)
+        fq = self.failed_queue
+        self.log.warning('Moving job to %s queue.' % fq.name)
+        fq.quarantine(job, exc_info=exc_info, reason=reason)
+        # Only now, so that no equivalent job is enqueued before this one
+        # is recorded as failed
+        job.release_unique_lock()
+
+    def collect_batch(self, job, queue):
+        """Returns the given batch job together with further jobs of the same
+        function popped off its queue, up to the batch's maximum size.
+
+        Waits up to the batch's maximum wait for more jobs to arrive.  Jobs
+        of other functions popped on the way are held until then, and put
+        back at the front of their queue before the batch is performed, so
+        that they are not lost if the worker dies meanwhile.
+        """
+        max_size, max_wait_ms = job.batch
+        deadline = time.time() + max_wait_ms / 1000.0
+        jobs = [job]
+        collected = []
+        scanned = 1
+        while scanned < max_size:
+            job_ids = queue.pop_job_ids(max_size - scanned)
+            scanned += len(job_ids)
+            fetched = Job.fetch_many(job_ids, connection=self.connection,
+                                     check_expiry=True)
+            for job_id, other in zip(job_ids, fetched):
+                if other is None:
+                    self.skip_unfetchable(job_id, queue)
+                elif other.func_name == job.func_name:
+                    jobs.append(other)
+                    collected.append(other)
+                else:
+                    self._held.append((other, queue))
+            if job_ids:
+                continue
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            time.sleep(min(self.batch_poll_interval, remaining))
+        self.return_held_jobs()
+        if any(other.indexed for other in collected):
+            p = pipeline_for(self.connection)
+            for other in collected:
+                other.unindex(pipeline=p)
+            p.execute()
+        return jobs
+
+    def skip_unfetchable(self, job_id, queue):
+        """Drops a popped job id whose job is gone, and moves the ones whose
+        data cannot be unpickled to the failed queue.
+        """
+        if Job.exists(job_id, self.connection):
+            self.log.warning('*** Ignoring unpickleable data on %s.' %
+                             green(queue.name))
+            self.failed_queue.push_job_id(job_id)
+        queue.ack(Job(job_id, connection=self.connection))
+
+    def return_held_jobs(self):
+        """Puts jobs held back while collecting a batch back on their
+        queues.
+        """
+        held, self._held = self._held, []
+        for queue in set(queue for _, queue in held):
+            queue.return_job_ids([job.id for job, q in held if q is queue])
+        if any(job.indexed for job, _ in held):
+            # They left the indexes when they were popped
+            p = pipeline_for(self.connection)
+            for job, _ in held:
+                job.index(p)
+            p.execute()
+
+    def perform_cached_job(self, job):
+        """Completes a memoized job with its cached result, if there is one,
+        so no work horse has to be forked.  Returns whether it did.
+        """
+        if not job.cache_ttl:
+            return False
+        rv = self.result_cache.get(job)
+        if rv is None:
+            return False
+        self._started_at = time.time()
+        self.emit('job_started', job)
+        self.log.info('Job OK, result from cache')
+        job.release_unique_lock()
+        p = pipeline_for(self.connection)
+        p.hset(job.key, 'result', rv)
+        p.expire(job.key, self.rv_ttl)
+        p.execute()
+        self.emit('job_finished', job, duration=self.elapsed())
+        return True
+
     def fork_and_perform_job(self, job):
-        """Spawns a work horse to perform the actual work and passes it a job.
-        The worker will wait for the work horse and make sure it executes
-        within the given timeout bounds, or will end the work horse with
-        SIGALRM.
+        """Same as `fork_and_perform`, for a single job."""
+        self.fork_and_perform([job])
+
+    def fork_and_perform(self, jobs):
+        """Spawns a work horse to perform the actual work and passes it the
+        job, or the batch of jobs.  The worker will wait for the work horse
+        and make sure it executes within the given timeout bounds, or will
+        end the work horse with SIGTERM and, if that does not help, SIGKILL.
+        The same goes for the memory and CPU limits.
         """
+        timeout = max(self.job_timeout(job) for job in jobs)
+        self.start_jobs(jobs)
         child_pid = os.fork()
         if child_pid == 0:
-            self.main_work_horse(job)
+            self.run_work_horse(jobs)
         else:
             self._horse_pid = child_pid
             self.procline('Forked %d at %d' % (child_pid, time.time()))
+            reason, rusage = self.wait_for_horse(child_pid, timeout)
+            if reason is not None:
+                if reason == 'timeout':
+                    exceeded = 'the job timeout (%s seconds)' % timeout
+                elif reason == 'memory_limit':
+                    exceeded = 'the memory limit (%d bytes)' % \
+                        self.memory_limit
+                elif reason == 'cpu_limit':
+                    exceeded = 'the CPU time limit (%s seconds)' % \
+                        self.cpu_limit
+                else:
+                    exceeded = None
+                if exceeded is None:
+                    msg = 'Horse %d crashed.' % child_pid
+                else:
+                    msg = 'Horse %d killed after exceeding %s.' % (
+                        child_pid, exceeded)
+                self.log.warning(red(msg))
+                peak_rss, cpu_time = usage(rusage)
+                for job in jobs:
+                    job.peak_rss = peak_rss
+                    job.cpu_time = cpu_time
+                    self.handle_failure(job, msg, reason=reason)
+
+    def kill_horse(self, child_pid, sig):
+        try:
+            os.kill(child_pid, sig)
+        except OSError as e:
+            # ESRCH ("No such process") means it ended in the meantime
+            if e.errno != errno.ESRCH:
+                raise
+
+    def wait_for_horse(self, child_pid, timeout):
+        """Waits for the work horse to end, enforcing the job timeout from the
+        worker's side as well, in case the horse's own alarm is swallowed or
+        delayed (e.g. by a C extension).
+
+        Once `timeout` plus `kill_grace` seconds have passed, the horse is sent
+        SIGTERM, and SIGKILL if it is still alive `kill_grace` seconds later.
+        With a `memory_limit`, the horse's RSS is sampled every
+        `memory_poll_interval` seconds, and the horse is sent SIGKILL once it
+        exceeds the limit.
+
+        Returns why the horse was killed (None if it ended by itself,
+        'timeout', 'memory_limit', 'cpu_limit', when the kernel enforced
+        the CPU time limit, or 'crashed', when some other signal ended it)
+        along with its resource usage.
+        """
+        pending = [signal.SIGTERM, signal.SIGKILL]
+        killed_for = []
+
+        def escalate(signum, frame):
+            sig = pending.pop(0)
+            if not killed_for:
+                killed_for.append('timeout')
+            self.kill_horse(child_pid, sig)
+            if pending:
+                signal.setitimer(signal.ITIMER_REAL, self.kill_grace)
+
+        def wake(signum, frame):
+            pass
+
+        sampling = self.memory_limit is not None
+        signal.signal(signal.SIGALRM, escalate)
+        signal.setitimer(signal.ITIMER_REAL, timeout + self.kill_grace)
+        if sampling:
+            # The horse ending interrupts the sleep between two samples
+            signal.signal(signal.SIGCHLD, wake)
+        polling = sampling
+        try:
             while True:
                 try:
-                    os.waitpid(child_pid, 0)
-                    break
+                    pid, status, rusage = os.wait4(
+                        child_pid, os.WNOHANG if polling else 0)
+                    if pid:
+                        break
+                    rss = process_rss(child_pid)
+                    if rss is not None and rss > self.memory_limit:
+                        if not killed_for:
+                            killed_for.append('memory_limit')
+                        self.kill_horse(child_pid, signal.SIGKILL)
+                        polling = False
+                        continue
+                    time.sleep(self.memory_poll_interval)
                 except OSError as e:
                     # In case we encountered an OSError due to EINTR (which is
-                    # caused by a SIGINT or SIGTERM signal during
-                    # os.waitpid()), we simply ignore it and enter the next
-                    # iteration of the loop, waiting for the child to end.  In
-                    # any other case, this is some other unexpected OS error,
-                    # which we don't want to catch, so we re-raise those ones.
+                    # caused by a SIGINT, SIGTERM or our own SIGALRM signal
+                    # during os.waitpid()), we simply ignore it and enter the
+                    # next iteration of the loop, waiting for the child to
+                    # end.  In any other case, this is some other unexpected
+                    # OS error, which we don't want to catch, so we re-raise
+                    # those ones.
                     if e.errno != errno.EINTR:
                         raise
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, signal.SIG_DFL)
+            if sampling:
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        if not killed_for and os.WIFSIGNALED(status):
+            # A SIGKILL may as well come from the kernel's OOM killer, so
+            # only blame the CPU time limit if the horse did reach it
+            if self.cpu_limit is not None and \
+                    os.WTERMSIG(status) in (signal.SIGKILL, signal.SIGXCPU) \
+                    and usage(rusage)[1] >= self.cpu_limit:
+                killed_for.append('cpu_limit')
+            else:
+                # E.g. a segfault, or the OOM killer
+                killed_for.append('crashed')
+        return (killed_for[0] if killed_for else None), rusage
 
     def main_work_horse(self, job):
+        """Same as `run_work_horse`, for a single job."""
+        self.run_work_horse([job])
+
+    def run_work_horse(self, jobs):
         """This is the entry point of the newly spawned work horse."""
         # After fork()'ing, always assure we are generating random sequences
         # that are different from the worker.
         random.seed()
         self._is_horse = True
         self.log = Logger('horse')
+        if self.events is not None:
+            self.events.reset()
+        limit_resources(self.memory_limit, self.cpu_limit, self.kill_grace)
 
-        success = self.perform_job(job)
+        success = self.perform(jobs)
+        self.flush_events()
 
         # os._exit() is the way to exit from childs after a fork(), in
         # constrast to the regular sys.exit()
         os._exit(int(not success))
 
+    def perform(self, jobs):
+        """Performs a single job, or a batch of jobs.  Returns whether all of
+        them succeeded.
+        """
+        if jobs[0].batch is not None:
+            return self.perform_batch(jobs)
+        return self.perform_job(jobs[0])
+
     def perform_job(self, job):
         """Performs the actual work of a job.  Will/should only be called
         inside the work horse's process.
@@ -341,29 +763,205 @@ class Worker(object):
             job.func_name,
             job.origin, time.time()))
 
+        _job_stack.push(job)
         try:
-            with death_pentalty_after(job.timeout or 180):
+            with self.death_penalty_class(self.job_timeout(job)):
                 rv = job.perform()
+            self.continue_chain(job, rv)
         except Exception as e:
-            fq = self.failed_queue
             self.log.exception(red(str(e)))
-            self.log.warning('Moving job to %s queue.' % fq.name)
-
-            fq.quarantine(job, exc_info=traceback.format_exc())
+            self.record_usage([job])
+            self.handle_failure(job, traceback.format_exc(),
+                                reason=self.failure_reason(e))
             return False
+        finally:
+            _job_stack.pop()
+        self.record_usage([job])
 
+        job.release_unique_lock()
+        self.emit('job_finished', job, duration=self.elapsed())
         if rv is None:
             self.log.info('Job OK')
         else:
             self.log.info('Job OK, result = %s' % (yellow(unicode(rv)),))
 
-        if rv is not None:
-            p = self.connection.pipeline()
-            p.hset(job.key, 'result', dumps(rv))
+        # Jobs that handed their chain over are kept, to be followed, and
+        # so are the ones whose resource usage was measured
+        if rv is not None or job.chain_next is not None or \
+                job.peak_rss is not None:
+            pickled_rv = dumps(rv)
+            p = pipeline_for(self.connection)
+            p.hset(job.key, 'result', pickled_rv)
+            # Progress not written yet is coalesced into the result write
+            fields = job.dump_meta()
+            fields.update(job.dump_usage())
+            if job.chain:
+                # The steps that ran since the last checkpoint
+                fields['checkpoint'] = dumps(job.checkpoint)
+            if fields:
+                p.hmset(job.key, fields)
             p.expire(job.key, self.rv_ttl)
             p.execute()
+            if job.cache_ttl and rv is not None:
+                self.result_cache.set(job, pickled_rv, job.cache_ttl)
         else:
             # Cleanup immediately
             job.delete()
 
         return True
+
+    def continue_chain(self, job, rv):
+        """Hands the rest of the job's chain over to the queue its next step
+        runs on, by enqueueing a job calling that step with `rv` there,
+        unless that was done before the job was performed again.
+
+        The new job gets the job's retry settings, tags, and as much time
+        to be started as the job had.  It is enqueued in the same round trip
+        as the job records it, so that it is not enqueued twice if the
+        worker dies in between.
+        """
+        steps = job.remaining_steps
+        if not steps or job.chain_next is not None:
+            return
+        func_name, queue_name = steps[0]
+        func = import_func(func_name)
+        if len(steps) > 1:
+            func = Chain(func, steps[1:])
+        kwargs = {'retry': job.retries, 'backoff': job.backoff,
+                  'tags': job.tags}
+        if job.expires_at is not None and job.enqueued_at is not None:
+            ttl = job.expires_at - job.enqueued_at
+            kwargs['ttl'] = ttl.total_seconds()
+        queue = origin_queue(queue_name, connection=self.connection)
+        next_job = queue.create_job(func, (rv,), kwargs)
+        queue.prepare_job(next_job)
+        job.chain_next = next_job.id
+        p = pipeline_for(self.connection)
+        p.hmset(next_job.key, next_job.dump())
+        next_job.index(p)
+        queue.push_job_ids([next_job.id], pipeline=p)
+        p.hmset(job.key, {
+            'checkpoint': dumps(job.checkpoint),
+            'chain_next': job.chain_next})
+        p.execute()
+        self.log.info('Handed chain over to %s on %s.' % (next_job.id,
+                                                          green(queue_name)))
+
+    def failure_reason(self, e):
+        """Returns the failure reason of jobs that raised the given
+        exception, if it tells more than the exception itself.
+        """
+        if isinstance(e, JobTimeoutException):
+            return 'timeout'
+        if isinstance(e, CPULimitExceeded):
+            return 'cpu_limit'
+        if isinstance(e, MemoryError) and self.memory_limit is not None:
+            return 'memory_limit'
+        return None
+
+    def record_usage(self, jobs):
+        """Sets the peak RSS and the CPU time of the work horse on the
+        given jobs, to be saved along with them.
+        """
+        if not self.is_horse:
+            # No usage of its own in a thread
+            return
+        peak_rss, cpu_time = usage(resource.getrusage(resource.RUSAGE_SELF))
+        for job in jobs:
+            job.peak_rss = peak_rss
+            job.cpu_time = cpu_time
+
+    def perform_batch(self, jobs):
+        """Performs a batch of jobs of the same function with a single call,
+        passing the list of their argument tuples.  Will/should only be
+        called inside the work horse's process.
+
+        The function has to return one result per job, in order.  If it
+        raises, or returns a wrong number of results, all jobs of the batch
+        fail; an exception instance among the results fails just that job.
+        """
+        func_name = jobs[0].func_name
+        self.procline('Processing %d x %s from %s since %s' % (
+            len(jobs), func_name, jobs[0].origin, time.time()))
+
+        timeout = max(self.job_timeout(job) for job in jobs)
+        try:
+            with self.death_penalty_class(timeout):
+                rvs = jobs[0].func([job.args for job in jobs])
+                rvs = list(rvs)
+            if len(rvs) != len(jobs):
+                raise ValueError('Batch function %s returned %d results for '
+                                 '%d jobs.' % (func_name, len(rvs),
+                                               len(jobs)))
+        except Exception as e:
+            self.log.exception(red(str(e)))
+            reason = self.failure_reason(e)
+            exc_info = traceback.format_exc()
+            self.record_usage(jobs)
+            for job in jobs:
+                self.handle_failure(job, exc_info, reason=reason)
+            return False
+        self.record_usage(jobs)
+
+        failed = 0
+        p = pipeline_for(self.connection)
+        for job, rv in zip(jobs, rvs):
+            if isinstance(rv, Exception):
+                failed += 1
+                exc_info = traceback.format_exception_only(type(rv), rv)
+                self.handle_failure(job, ''.join(exc_info))
+                continue
+            job.release_unique_lock()
+            self.emit('job_finished', job, duration=self.elapsed())
+            if rv is not None or job.peak_rss is not None:
+                pickled_rv = dumps(rv)
+                p.hset(job.key, 'result', pickled_rv)
+                fields = job.dump_usage()
+                if fields:
+                    p.hmset(job.key, fields)
+                p.expire(job.key, self.rv_ttl)
+                if job.cache_ttl and rv is not None:
+                    self.result_cache.set(job, pickled_rv, job.cache_ttl)
+            else:
+                p.delete(job.key)
+        p.execute()
+
+        self.log.info('Batch OK, %d of %d jobs failed' % (failed, len(jobs)))
+        return not failed
+
+
+class ThreadWorker(Worker):
+    """A worker that performs jobs in its own thread instead of forking a work
+    horse for each of them, e.g. to run next to the producer in a single
+    process on top of a `dpq.memory.MemoryRedis` connection.
+
+    Jobs are not isolated from the worker and their timeouts are not
+    enforced, since signals are only available in the main thread.  Call
+    `stop()` from another thread to end the work loop; it is noticed within
+    `dequeue_timeout` seconds.
+    """
+    death_penalty_class = no_death_penalty
+    dequeue_timeout = 1
+
+    @property
+    def name(self):
+        if self._name is None:
+            hostname = socket.gethostname()
+            shortname, _, _ = hostname.partition('.')
+            self._name = '%s.%s.%s' % (shortname, self.pid,
+                                       threading.current_thread().name)
+        return self._name
+
+    def stop(self):
+        """Stops the work loop after the current job (warm shutdown)."""
+        self._stopped = True
+
+    def _install_signal_handlers(self):
+        pass
+
+    def procline(self, message):
+        pass
+
+    def fork_and_perform(self, jobs):
+        self.start_jobs(jobs)
+        self.perform(jobs)
@@ -37,8 +37,10 @@ setup(
     zip_safe=False,
     platforms='any',
     install_requires=get_dependencies(),
-    scripts=['bin/dpqinfo', 'bin/dpqworker'],
+    scripts=['bin/dpqinfo', 'bin/dpqworker', 'bin/dpqmigrate',
+             'bin/dpqbench'],
     extras_require={
         ':python_version=="2.6"': ['argparse', 'importlib'],
+        'cluster': ['redis-py-cluster'],
     },
 )
@@ -1 +1,58 @@
 # -*- coding: utf-8 -*-
+
+import os
+import unittest
+
+import redis
+from redis.exceptions import ConnectionError
+
+from dpq import push_connection, pop_connection
+from dpq.memory import MemoryRedis
+
+
+def find_redis():
+    """Returns a legacy `redis.Redis` connection to the test database, given
+    as host:port/db in DPQ_TEST_REDIS (default: localhost:6379/15), or None
+    if no server answers there.
+    """
+    address = os.environ.get('DPQ_TEST_REDIS', 'localhost:6379/15')
+    address, _, db = address.partition('/')
+    host, _, port = address.partition(':')
+    connection = redis.Redis(host=host or 'localhost', port=int(port or 6379),
+                             db=int(db or 0))
+    try:
+        connection.ping()
+    except ConnectionError:
+        return None
+    return connection
+
+
+class DPQTestCase(unittest.TestCase):
+    """Runs every test on a fresh `MemoryRedis`, pushed as the current
+    connection.  Jobs are performed with a `ThreadWorker`.
+    """
+
+    def setUp(self):
+        self.testconn = MemoryRedis()
+        push_connection(self.testconn)
+
+    def tearDown(self):
+        pop_connection()
+
+
+class RedisTestCase(unittest.TestCase):
+    """Runs every test on an emptied Redis database, through the legacy
+    `redis.Redis` client that dpqworker and dpqinfo use.  Skipped when no
+    Redis server is available.
+    """
+
+    def setUp(self):
+        self.testconn = find_redis()
+        if self.testconn is None:
+            self.skipTest('No Redis server for the tests.')
+        self.testconn.flushdb()
+        push_connection(self.testconn)
+
+    def tearDown(self):
+        self.testconn.flushdb()
+        pop_connection()
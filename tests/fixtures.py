@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""
+Job functions for the tests.  The ThreadWorker runs them in the test
+process, so they can record their calls in `calls`.
+"""
+
+import os
+import time
+import signal
+
+from dpq import memoize, retry, batch, get_current_job
+from dpq.events import EventLog
+
+calls = []
+
+
+def add(a, b):
+    calls.append(('add', a, b))
+    return a + b
+
+
+@memoize(ttl=600)
+def cached_add(a, b):
+    calls.append(('cached_add', a, b))
+    return a + b
+
+
+def div_by_zero(x):
+    calls.append(('div_by_zero', x))
+    return x / 0
+
+
+def inc(x):
+    calls.append(('inc', x))
+    return x + 1
+
+
+def unique_lock_ttl():
+    job = get_current_job()
+    return job.connection.ttl(job.unique_lock)
+
+
+def current_job_id():
+    return get_current_job().id
+
+
+def report_progress(steps):
+    job = get_current_job()
+    for i in range(1, steps + 1):
+        job.update_progress(i / float(steps), step=i)
+    return steps
+
+
+def fail_halfway(steps):
+    job = get_current_job()
+    job.update_progress(0.5, step=steps // 2)
+    raise ValueError('halfway')
+
+
+def noop():
+    calls.append(('noop',))
+
+
+@retry(2, backoff=0)
+def flaky(x):
+    calls.append(('flaky', x))
+    return x / 0
+
+
+def published_events():
+    return [fields['event'] for _, fields in EventLog().read('0')]
+
+
+def kill_self():
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+
+
+def sleep_through_signals(seconds):
+    """Stands for a C extension swallowing the horse's own alarm."""
+    signal.signal(signal.SIGALRM, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    time.sleep(seconds)
+
+
+@batch(max_size=10, max_wait_ms=0)
+def double_all(batch_args):
+    calls.append(('double_all', len(batch_args)))
+    return [2 * x for (x,) in batch_args]
+
+
+@batch(max_size=10, max_wait_ms=0)
+def fail_all(batch_args):
+    return [ValueError(u'caf\xe9 %d' % x) for (x,) in batch_args]
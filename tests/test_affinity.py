@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+import errno
+
+import mock
+
+from tests import DPQTestCase
+from dpq import Queue, ThreadWorker
+from dpq.affinity import parse_cpu_list, format_cpu_list, placements
+
+
+class TestAffinity(DPQTestCase):
+
+    def test_cpu_lists(self):
+        self.assertEqual(parse_cpu_list('0-3,8,10-11\n'),
+                         [0, 1, 2, 3, 8, 10, 11])
+        self.assertEqual(format_cpu_list([11, 0, 1, 2, 3, 8, 10]),
+                         '0-3,8,10-11')
+
+    def test_placements(self):
+        self.assertEqual(placements('0-1,4'), [[0, 1, 4]])
+        self.assertTrue(all(len(cpus) == 1 for cpus in placements('core')))
+        self.assertRaises(ValueError, placements, 'round-robin')
+
+    def test_unreadable_affinity_leaves_the_worker_unpinned(self):
+        w = ThreadWorker([Queue()])
+        error = OSError(errno.EINVAL, 'Invalid argument')
+        with mock.patch('dpq.worker.get_affinity', side_effect=error):
+            w.pin()
+        self.assertIsNone(w.cpu_affinity)
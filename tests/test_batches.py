@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+from tests import DPQTestCase
+from tests import fixtures
+from dpq import Queue, ThreadWorker
+from dpq.job import Job
+
+
+class TestBatches(DPQTestCase):
+
+    def setUp(self):
+        super(TestBatches, self).setUp()
+        fixtures.calls[:] = []
+
+    def test_jobs_are_performed_in_batches(self):
+        q = Queue()
+        jobs = [q.enqueue(fixtures.double_all, x) for x in range(3)]
+        ThreadWorker([q]).work(burst=True)
+        self.assertEqual(fixtures.calls, [('double_all', 3)])
+        self.assertEqual([Job.fetch(job.id).result for job in jobs],
+                         [0, 2, 4])
+
+    def test_other_jobs_are_put_back_before_performing(self):
+        q = Queue()
+        first = q.enqueue(fixtures.double_all, 1)
+        other = q.enqueue(fixtures.add, 1, 2)
+        last = q.enqueue(fixtures.double_all, 2)
+        w = ThreadWorker([q])
+        job, queue = w.dequeue_job(False)
+        jobs = w.collect_batch(job, queue)
+        self.assertEqual([j.id for j in jobs], [first.id, last.id])
+        self.assertEqual(q.job_ids, [other.id])
+
+    def test_single_job_entry_points(self):
+        q = Queue()
+        job = q.enqueue(fixtures.add, 1, 2)
+        w = ThreadWorker([q])
+        w.fork_and_perform_job(q.dequeue())
+        self.assertEqual(Job.fetch(job.id).result, 3)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+from tests import DPQTestCase, RedisTestCase
+from tests import fixtures
+from dpq import Queue
+from dpq.bench import RoundTripCounter, Benchmark
+
+
+class RoundTripTests(object):
+    # Through redis-py, a pipeline running scripts checks for them first
+    script_checks = 0
+
+    def setUp(self):
+        super(RoundTripTests, self).setUp()
+        self.counter = RoundTripCounter(self.testconn)
+
+    def fill(self, count):
+        q = Queue()
+        for _ in range(count):
+            q.enqueue(fixtures.noop)
+        return Queue(connection=self.counter)
+
+    def test_commands_count_once_each(self):
+        self.counter.set('dpq:test:key', 'value')
+        self.assertEqual(self.counter.get('dpq:test:key'), 'value')
+        self.assertEqual(self.counter.round_trips, 2)
+
+    def test_pipelines_count_once_when_executed(self):
+        p = self.counter.pipeline()
+        p.set('dpq:test:key', 'value')
+        p.get('dpq:test:key')
+        self.assertEqual(self.counter.round_trips, 0)
+        self.assertEqual(p.execute(), [True, 'value'])
+        self.assertEqual(self.counter.round_trips, 1)
+        with self.counter.pipeline() as p:
+            p.get('dpq:test:key')
+            p.execute()
+        self.assertEqual(self.counter.round_trips, 2)
+
+    def test_scripts_count_once(self):
+        q = self.fill(2)
+        q.pop_job_id()
+        self.counter.round_trips = 0
+        self.assertIsNotNone(q.pop_job_id())
+        self.assertEqual(self.counter.round_trips, 1)
+
+    def test_scripts_on_pipelines_count_with_the_pipeline(self):
+        q = self.fill(4)
+        q.pop_job_id()
+        self.counter.round_trips = 0
+        self.assertEqual(len(q.pop_job_ids(3)), 3)
+        self.assertEqual(self.counter.round_trips, 1 + self.script_checks)
+
+
+class TestRoundTrips(RoundTripTests, DPQTestCase):
+
+    def test_benchmark_figures(self):
+        results = Benchmark(self.testconn, payload_sizes=(16,),
+                            depths=(10,), iterations=10).run()
+        self.assertEqual(
+            dict((result['name'], result['round_trips_per_op'])
+                 for result in results),
+            {'Queue.enqueue': 2.0,
+             'Job.save': 1.0,
+             'Job.refresh': 1.0,
+             'FailedQueue.quarantine': 3.0,
+             # A pop off each queue, and reading the job
+             'Queue.dequeue_any': 3.0,
+             'Queue.compat': 2.8})
+
+
+class TestRoundTripsOnLegacyClient(RoundTripTests, RedisTestCase):
+    script_checks = 1
+
+    def test_loading_scripts_counts(self):
+        q = self.fill(4)
+        self.testconn.script_flush()
+        self.counter.round_trips = 0
+        q.pop_job_id()
+        # Not found, loaded, and run
+        self.assertEqual(self.counter.round_trips, 3)
+
+        self.testconn.script_flush()
+        self.counter.round_trips = 0
+        self.assertEqual(len(q.pop_job_ids(3)), 3)
+        # Checked for, loaded, and run along with the pipeline
+        self.assertEqual(self.counter.round_trips, 3)
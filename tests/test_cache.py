@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+from tests import DPQTestCase, RedisTestCase
+from tests import fixtures
+from dpq import Queue, ThreadWorker
+from dpq.cache import ResultCache
+from dpq.job import Job
+
+
+class TestResultCache(DPQTestCase):
+
+    def setUp(self):
+        super(TestResultCache, self).setUp()
+        fixtures.calls[:] = []
+
+    def test_memoized_jobs_run_once(self):
+        q = Queue()
+        first = q.enqueue(fixtures.cached_add, 1, 2)
+        second = q.enqueue(fixtures.cached_add, 1, 2)
+        ThreadWorker([q]).work(burst=True)
+        self.assertEqual(fixtures.calls, [('cached_add', 1, 2)])
+        self.assertEqual(Job.fetch(first.id).result, 3)
+        self.assertEqual(Job.fetch(second.id).result, 3)
+        self.assertEqual(ResultCache().stats(), {'hits': 1, 'misses': 1})
+
+    def test_different_arguments_are_not_shared(self):
+        q = Queue()
+        q.enqueue(fixtures.cached_add, 1, 2)
+        q.enqueue(fixtures.cached_add, 2, 1)
+        ThreadWorker([q]).work(burst=True)
+        self.assertEqual(len(fixtures.calls), 2)
+
+    def test_eviction(self):
+        cache = ResultCache(max_size=2)
+        for a in range(3):
+            job = Job.create(fixtures.cached_add, a, 0,
+                             connection=self.testconn)
+            cache.set(job, 'rv', 60)
+        oldest = Job.create(fixtures.cached_add, 0, 0,
+                            connection=self.testconn)
+        self.assertIsNone(cache.get(oldest))
+        self.assertEqual(self.testconn.zcard(cache.index_key), 2)
+
+
+class TestResultCacheOnLegacyClient(RedisTestCase):
+
+    def test_set_and_get(self):
+        cache = ResultCache()
+        job = Job.create(fixtures.cached_add, 1, 2, connection=self.testconn)
+        cache.set(job, 'rv', 60)
+        self.assertEqual(cache.get(job), 'rv')
+        self.assertTrue(0 < self.testconn.ttl(cache.key_for(
+            job.get_unique_key())) <= 60)
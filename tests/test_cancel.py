@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+import mock
+
+from tests import DPQTestCase, RedisTestCase
+from tests import fixtures
+from dpq import Queue, ThreadWorker
+from dpq.job import Job
+from dpq.bench import RoundTripCounter
+from dpq.queue import cancel_jobs, get_failed_queue
+
+
+class TestCancellation(DPQTestCase):
+
+    def setUp(self):
+        super(TestCancellation, self).setUp()
+        fixtures.calls[:] = []
+
+    def test_cancelled_jobs_are_not_performed(self):
+        q = Queue()
+        job = q.enqueue(fixtures.add, 1, 2)
+        other = q.enqueue(fixtures.add, 3, 4)
+        job.cancel()
+        self.assertFalse(Job.exists(job.id))
+        ThreadWorker([q]).work(burst=True)
+        self.assertEqual(fixtures.calls, [('add', 3, 4)])
+        self.assertEqual(Job.fetch(other.id).result, 7)
+        self.assertEqual(q.cancelled_count, 1)
+
+    def test_cancel_all_jobs_of_a_queue(self):
+        q = Queue()
+        for x in range(3):
+            q.enqueue(fixtures.add, x, x)
+        self.assertEqual(cancel_jobs(origin=q.name), 3)
+        self.assertEqual(q.count, 0)
+        self.assertEqual(q.cancelled_count, 3)
+
+    def test_cancel_by_function(self):
+        q = Queue()
+        q.enqueue(fixtures.add, 1, 2)
+        kept = q.enqueue(fixtures.noop)
+        q.enqueue(fixtures.add, 3, 4)
+        self.assertEqual(q.cancel_jobs('tests.fixtures.add'), 2)
+        self.assertEqual(q.job_ids, [kept.id])
+
+    def test_cancel_by_function_uses_the_index(self):
+        q = Queue(indexed=True)
+        q.enqueue(fixtures.add, 1, 2)
+        kept = q.enqueue(fixtures.noop)
+        q.enqueue(fixtures.add, 3, 4)
+        self.assertEqual(cancel_jobs(func_name='tests.fixtures.add'), 2)
+        self.assertEqual(q.job_ids, [kept.id])
+        self.assertEqual(q.count_by_func(), {'tests.fixtures.noop': 1})
+
+    def test_missing_jobs_are_dropped_without_touching_live_ones(self):
+        q = Queue()
+        q.skip_batch_size = 2
+        jobs = [q.enqueue(fixtures.add, x, x) for x in range(5)]
+        for job in jobs[:3] + jobs[4:]:
+            job.delete()
+        self.assertEqual(q.drop_missing_jobs(), 3)
+        self.assertEqual(q.job_ids, [jobs[3].id, jobs[4].id])
+
+
+class TestCancellationOnLegacyClient(RedisTestCase):
+
+    def test_cancel_by_function(self):
+        q = Queue()
+        q.enqueue(fixtures.add, 1, 2)
+        kept = q.enqueue(fixtures.noop)
+        self.assertEqual(q.cancel_jobs('tests.fixtures.add'), 1)
+        self.assertEqual(q.job_ids, [kept.id])
+
+    def test_cancel_by_function_keeps_the_order_of_the_others(self):
+        q = Queue()
+        kept = []
+        for x in range(6):
+            q.enqueue(fixtures.add, x, x)
+            kept.append(q.enqueue(fixtures.noop).id)
+        self.assertEqual(q.cancel_jobs('tests.fixtures.add'), 6)
+        self.assertEqual(q.job_ids, kept)
+        self.assertEqual(q.cancel_jobs('tests.fixtures.add'), 0)
+        self.assertEqual(q.job_ids, kept)
+
+    def test_missing_jobs_are_dropped(self):
+        q = Queue()
+        first = q.enqueue(fixtures.add, 1, 2)
+        second = q.enqueue(fixtures.add, 3, 4)
+        first.delete()
+        self.assertEqual(q.drop_missing_jobs(), 1)
+        self.assertEqual(q.job_ids, [second.id])
+
+    def test_missing_jobs_are_skipped_on_the_server(self):
+        q = Queue()
+        cancelled = q.enqueue_many([(fixtures.noop,)] * 2500)
+        kept = q.enqueue(fixtures.noop)
+        self.testconn.delete(*[job.key for job in cancelled])
+        # Have the server know the scripts
+        Queue('other').dequeue()
+        Queue('other').drop_missing_jobs()
+        counter = RoundTripCounter(self.testconn)
+        q = Queue(connection=counter)
+        self.assertEqual(q.dequeue().id, kept.id)
+        # Popping the first id and reading it, a script run per thousand
+        # ids to drop, popping and reading the live job
+        self.assertEqual(counter.round_trips, 2 + 3 + 2)
+
+    def test_cancel_by_function_leaves_failed_jobs_alone(self):
+        q = Queue()
+        failed = q.enqueue(fixtures.div_by_zero, 1)
+        ThreadWorker([q]).work(burst=True)
+        waiting = q.enqueue(fixtures.div_by_zero, 2)
+        fq = get_failed_queue()
+        self.assertEqual(cancel_jobs(func_name='tests.fixtures.div_by_zero'),
+                         1)
+        self.assertFalse(Job.exists(waiting.id))
+        self.assertTrue(Job.exists(failed.id))
+        self.assertEqual(fq.job_ids, [failed.id])
+        self.assertEqual(fq.counts_by('func'),
+                         {'tests.fixtures.div_by_zero': 1})
+
+    def test_concurrent_takes_keep_their_own_ids(self):
+        q = Queue()
+        first = q.enqueue(fixtures.add, 1, 2)
+        rename = self.testconn.rename
+        taken = []
+
+        def rename_and_interleave(src, dst):
+            rv = rename(src, dst)
+            if not taken:
+                # Another take of the queue, between RENAME and LRANGE
+                taken.append(None)
+                second = q.enqueue(fixtures.add, 3, 4)
+                taken.append((second.id, q.take_job_ids()))
+            return rv
+
+        with mock.patch.object(self.testconn, 'rename',
+                               side_effect=rename_and_interleave):
+            self.assertEqual(q.take_job_ids(), [first.id])
+        second_id, second_taken = taken[1]
+        self.assertEqual(second_taken, [second_id])
+        self.assertEqual(self.testconn.keys('dpq:taken:*'), [])
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+from tests import DPQTestCase
+from tests import fixtures
+from dpq import Queue, ThreadWorker, chain
+from dpq.job import Job
+
+
+class TestChains(DPQTestCase):
+
+    def setUp(self):
+        super(TestChains, self).setUp()
+        fixtures.calls[:] = []
+
+    def test_steps_run_in_the_same_job(self):
+        q = Queue()
+        job = q.enqueue(chain(fixtures.inc, fixtures.inc, fixtures.inc), 1)
+        ThreadWorker([q]).work(burst=True)
+        job = Job.fetch(job.id)
+        self.assertEqual(job.result, 4)
+        self.assertEqual(job.checkpoint, (2, 4))
+        self.assertEqual(len(fixtures.calls), 3)
+
+    def test_jobs_performed_again_resume_after_the_checkpoint(self):
+        q = Queue()
+        job = q.enqueue(chain(fixtures.inc, fixtures.inc, fixtures.inc), 1)
+        job.save_checkpoint(1, 10)
+        ThreadWorker([q]).work(burst=True)
+        self.assertEqual(Job.fetch(job.id).result, 11)
+        self.assertEqual(fixtures.calls, [('inc', 10)])
+
+    def test_hand_over_to_another_queue(self):
+        q = Queue()
+        other = Queue('other')
+        job = q.enqueue(chain(fixtures.inc, (fixtures.inc, 'other')), 1,
+                        ttl=60, tags=['numbers'], retry=2, backoff=5)
+        w = ThreadWorker([q])
+        w.work(burst=True)
+        job = Job.fetch(job.id)
+        self.assertEqual(job.checkpoint, (0, 2))
+        self.assertEqual(other.job_ids, [job.chain_next])
+        next_job = Job.fetch(job.chain_next)
+        self.assertEqual(next_job.origin, 'other')
+        self.assertEqual(next_job.args, (2,))
+        self.assertEqual(next_job.tags, ('numbers',))
+        self.assertEqual((next_job.retries, next_job.backoff), (2, 5))
+        self.assertIsNotNone(next_job.expires_at)
+
+        # Performing the job again does not hand the chain over twice
+        w.perform_job(job)
+        self.assertEqual(other.count, 1)
+
+        ThreadWorker([other]).work(burst=True)
+        self.assertEqual(job.chain_end().result, 3)
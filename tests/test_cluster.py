@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+import os
+import imp
+
+from tests import DPQTestCase, RedisTestCase
+from tests import fixtures
+from dpq import Queue, ThreadWorker, chain
+from dpq.cluster import (enable_cluster_mode, crc16, key_slot, group_by_slot,
+                         pipeline_for)
+from dpq.job import Job
+from dpq.queue import get_failed_queue
+from dpq.retries import RetryQueue
+
+
+def load_dpqmigrate():
+    path = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'bin', 'dpqmigrate')
+    module = imp.new_module('dpqmigrate')
+    execfile(path, module.__dict__)
+    return module
+
+
+class TestKeySlots(DPQTestCase):
+
+    def test_key_slots_follow_redis_cluster(self):
+        self.assertEqual(crc16('123456789'), 0x31c3)
+        self.assertEqual(key_slot('foo'), 12182)
+        self.assertEqual(key_slot('{foo}.bar'), key_slot('foo'))
+        self.assertEqual(key_slot(u'{foo}.bar'), key_slot('foo'))
+        # Empty hash tags are not hash tags
+        self.assertEqual(key_slot('{}foo'), crc16('{}foo') % 16384)
+
+    def test_group_by_slot_keeps_the_order(self):
+        self.assertEqual(group_by_slot(['{a}1', '{a}2', '{b}1', '{a}3']),
+                         [['{a}1', '{a}2'], ['{b}1'], ['{a}3']])
+
+
+class TestClusterLayout(DPQTestCase):
+
+    def setUp(self):
+        super(TestClusterLayout, self).setUp()
+        enable_cluster_mode(self.testconn)
+
+    def test_a_queue_and_the_keys_of_its_jobs_share_a_slot(self):
+        q = Queue('high', indexed=True)
+        job = q.enqueue(fixtures.add, 1, 2, unique_key='sum', tags=['t'])
+        self.assertEqual(q.key, 'dpq:queue:{high}')
+        self.assertTrue(job.id.startswith('{high}'))
+        keys = [q.key, Job.key_for(job.id), job.unique_lock,
+                RetryQueue.key_for('high', cluster=True)]
+        keys += [key for _, _, key in job.index_keys()]
+        self.assertEqual(set(key_slot(key) for key in keys),
+                         set([key_slot('high')]))
+        self.assertEqual(Queue.from_queue_key(q.key).name, 'high')
+
+        ThreadWorker([q]).work(burst=True)
+        self.assertEqual(Job.fetch(job.id).result, 3)
+
+
+class TestPipelines(RedisTestCase):
+
+    def test_pipelines_take_the_strict_argument_order(self):
+        p = pipeline_for(self.testconn)
+        self.assertTrue(p.transaction)
+        p.zadd('dpq:test:zset', 1.5, 'member')
+        p.setex('dpq:test:string', 60, 'value')
+        p.execute()
+        self.assertEqual(self.testconn.zscore('dpq:test:zset', 'member'),
+                         1.5)
+        self.assertEqual(self.testconn.get('dpq:test:string'), 'value')
+        self.assertGreater(self.testconn.ttl('dpq:test:string'), 0)
+
+    def test_pipelines_are_not_transactional_in_cluster_mode(self):
+        enable_cluster_mode(self.testconn)
+        self.assertFalse(pipeline_for(self.testconn).transaction)
+
+
+class TestMigration(RedisTestCase):
+
+    def setUp(self):
+        super(TestMigration, self).setUp()
+        self.dpqmigrate = load_dpqmigrate()
+
+    def fill(self):
+        """Leaves a job of each kind in the plain layout."""
+        q = Queue('numbers', indexed=True)
+        jobs = {}
+        jobs['failed'] = q.enqueue(fixtures.div_by_zero, 1)
+        jobs['retried'] = q.enqueue(fixtures.div_by_zero, 2, retry=1,
+                                    backoff=600)
+        jobs['chained'] = q.enqueue(chain(fixtures.inc,
+                                          (fixtures.inc, 'other')), 1)
+        ThreadWorker([q]).work(burst=True)
+        jobs['tagged'] = q.enqueue(fixtures.add, 1, 2, tags=['small'])
+        jobs['unique'] = q.enqueue(fixtures.add, 3, 4, unique_key='k1')
+        jobs['packed'] = Queue('numbers', packed=True).enqueue(
+            fixtures.add, 5, 6, unique_key='k2')
+        return jobs
+
+    def migrate(self, **kwargs):
+        return self.dpqmigrate.migrate(
+            self.testconn,
+            self.dpqmigrate.untagged_queue_names(self.testconn), **kwargs)
+
+    def test_everything_refers_to_the_tagged_ids(self):
+        jobs = self.fill()
+        self.check_migrated(jobs, self.migrate())
+
+    def test_interrupted_runs_can_be_resumed(self):
+        jobs = self.fill()
+        pipeline_for = self.dpqmigrate.pipeline_for
+        executed = []
+
+        def interrupted_pipeline_for(connection):
+            p = pipeline_for(connection)
+            execute = p.execute
+
+            def execute_once():
+                if executed:
+                    raise KeyboardInterrupt()
+                executed.append(True)
+                return execute()
+            p.execute = execute_once
+            return p
+        self.dpqmigrate.pipeline_for = interrupted_pipeline_for
+        self.assertRaises(KeyboardInterrupt, self.migrate)
+        self.assertEqual(len(self.testconn.keys(Job.key_for('{*'))), 1)
+
+        self.dpqmigrate.pipeline_for = pipeline_for
+        renamed = self.migrate()
+        self.assertEqual(len(self.testconn.keys(Job.key_for('{*'))), 6)
+        self.check_migrated(jobs, renamed)
+
+    def check_migrated(self, jobs, renamed):
+        self.assertEqual(self.testconn.keys('dpq:index:numbers:*'), [])
+        enable_cluster_mode(self.testconn)
+
+        def new_id(name):
+            return renamed[jobs[name].id]
+
+        q = Queue('numbers', indexed=True)
+        self.assertEqual(q.job_ids, [new_id('tagged'), new_id('unique'),
+                                     new_id('packed')])
+        self.assertEqual(q.count_by_func(), {'tests.fixtures.add': 2})
+        self.assertEqual([job.id for job in q.find(tag='small')],
+                         [new_id('tagged')])
+
+        # Unique locks
+        self.assertEqual(q.enqueue(fixtures.add, 3, 4, unique_key='k1').id,
+                         new_id('unique'))
+        self.assertEqual(q.enqueue(fixtures.add, 5, 6, unique_key='k2').id,
+                         new_id('packed'))
+        self.assertEqual(q.count, 3)
+
+        # Failed queue
+        fq = get_failed_queue()
+        self.assertEqual(fq.job_ids, [new_id('failed')])
+        self.assertEqual(fq.job_ids_by(origin='numbers'), [new_id('failed')])
+        fq.requeue(new_id('failed'))
+        self.assertEqual(q.job_ids[-1], new_id('failed'))
+
+        # Retries
+        rq = RetryQueue()
+        retry_key = RetryQueue.key_for('numbers', cluster=True)
+        self.assertEqual(self.testconn.zrange(retry_key, 0, -1),
+                         [new_id('retried')])
+        p = pipeline_for(self.testconn)
+        p.zadd(retry_key, 0, new_id('retried'))
+        p.execute()
+        rq.enqueue_due()
+        self.assertEqual(q.job_ids[-1], new_id('retried'))
+        self.assertEqual(q.count_by_func(), {'tests.fixtures.add': 2,
+                                             'tests.fixtures.div_by_zero': 2})
+
+        # Chains
+        chained = Job.fetch(jobs['chained'].id)
+        self.assertTrue(chained.chain_next.startswith('{other}'))
+        ThreadWorker([Queue('other')]).work(burst=True)
+        self.assertEqual(chained.chain_end().result, 3)
+
+    def test_dry_runs_change_nothing(self):
+        self.fill()
+        before = sorted(self.testconn.keys('*'))
+        self.migrate(dry_run=True)
+        self.assertEqual(sorted(self.testconn.keys('*')), before)
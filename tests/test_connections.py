@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+from tests import DPQTestCase
+from tests import fixtures
+from dpq import (Queue, ThreadWorker, pop_connection, push_connection,
+                 set_default_connection, clear_default_connection)
+from dpq.connections import (get_current_connection,
+                             NoRedisConnectionException)
+from dpq.job import Job
+from dpq.queue import get_failed_queue
+from dpq.memory import MemoryRedis
+
+
+def in_thread(func):
+    """Returns what `func` returns, or raises, in a new thread."""
+    outcome = {}
+
+    def run():
+        try:
+            outcome['result'] = func()
+        except Exception as e:
+            outcome['error'] = e
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
+
+
+class TestDefaultConnection(DPQTestCase):
+
+    def tearDown(self):
+        clear_default_connection()
+        super(TestDefaultConnection, self).tearDown()
+
+    def test_other_threads_use_the_default_connection(self):
+        self.assertRaises(NoRedisConnectionException, in_thread, Queue)
+        self.assertIs(set_default_connection(self.testconn), self.testconn)
+        job = in_thread(lambda: Queue().enqueue(fixtures.add, 1, 2))
+        self.assertEqual(Queue().job_ids, [job.id])
+        self.assertIs(in_thread(get_current_connection), self.testconn)
+
+    def test_pushed_connections_come_first(self):
+        set_default_connection(self.testconn)
+        other = MemoryRedis()
+
+        def enqueue_on_pushed():
+            push_connection(other)
+            try:
+                return Queue().enqueue(fixtures.add, 1, 2)
+            finally:
+                pop_connection()
+        job = in_thread(enqueue_on_pushed)
+        self.assertEqual(Queue(connection=other).job_ids, [job.id])
+        self.assertEqual(Queue().job_ids, [])
+
+    def test_the_default_connection_can_be_cleared(self):
+        set_default_connection(self.testconn)
+        clear_default_connection()
+        self.assertRaises(NoRedisConnectionException, in_thread, Queue)
+        # This thread still has its pushed connection
+        self.assertIs(get_current_connection(), self.testconn)
+
+
+class TestConnectionPassing(DPQTestCase):
+
+    def setUp(self):
+        super(TestConnectionPassing, self).setUp()
+        # Without any connection to fall back to
+        pop_connection()
+
+    def tearDown(self):
+        push_connection(self.testconn)
+        super(TestConnectionPassing, self).tearDown()
+
+    def test_queues_workers_and_jobs_use_the_connection_given(self):
+        q = Queue(connection=self.testconn, indexed=True)
+        job = q.enqueue(fixtures.add, 1, 2, tags=['small'])
+        q.enqueue(fixtures.flaky, 1)
+        q.enqueue(fixtures.div_by_zero, 1)
+        q.enqueue(fixtures.double_all, 1)
+        q.enqueue(fixtures.cached_add, 1, 2)
+        self.assertEqual([queue.name for queue in
+                          Queue.all(connection=self.testconn)], ['default'])
+        self.assertEqual(q.count_by_tag(), {'small': 1})
+        ThreadWorker([q]).work(burst=True)
+        self.assertEqual(get_failed_queue(connection=self.testconn).count, 1)
+        self.assertEqual(Job.fetch(job.id, connection=self.testconn).result,
+                         3)
+        self.assertRaises(NoRedisConnectionException, Queue)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+from cPickle import dumps, HIGHEST_PROTOCOL
+
+import times
+
+from tests import DPQTestCase
+from tests import fixtures
+from dpq import Queue
+from dpq.job import Job, to_timestamp, from_timestamp
+
+
+DATE_FIELDS = ['created_at', 'enqueued_at', 'ended_at', 'expires_at']
+DATES = {
+    'created_at': datetime.datetime(2016, 5, 4, 3, 2, 1, 123456),
+    'enqueued_at': datetime.datetime(2016, 5, 4, 3, 2, 2),
+    'ended_at': datetime.datetime(2016, 5, 4, 3, 3, 0, 500000),
+    'expires_at': datetime.datetime(2016, 5, 5),
+}
+
+
+class TestDates(DPQTestCase):
+
+    def test_dates_are_seconds_since_the_epoch(self):
+        self.assertEqual(to_timestamp(datetime.datetime(1970, 1, 1, 0, 0, 1,
+                                                        500000)), 1.5)
+        self.assertEqual(from_timestamp('1.5'),
+                         datetime.datetime(1970, 1, 1, 0, 0, 1, 500000))
+        self.assertIsNone(from_timestamp(None))
+
+    def save_with_dates(self, queue):
+        job = queue.enqueue(fixtures.add, 1, 2)
+        for name in DATE_FIELDS:
+            setattr(job, name, DATES[name])
+        job.save()
+        return job
+
+    def assert_dates(self, job):
+        self.assertEqual(dict((name, getattr(job, name))
+                              for name in DATE_FIELDS), DATES)
+
+    def test_dates_round_trip(self):
+        job = self.save_with_dates(Queue())
+        stored = self.testconn.hmget(job.key, DATE_FIELDS)
+        self.assertEqual([float(value) for value in stored],
+                         [to_timestamp(DATES[name]) for name in DATE_FIELDS])
+        self.assert_dates(Job.fetch(job.id))
+
+    def test_dates_of_packed_jobs_round_trip(self):
+        job = self.save_with_dates(Queue(packed=True))
+        self.assertEqual(self.testconn.hmget(job.key, DATE_FIELDS),
+                         [None] * len(DATE_FIELDS))
+        self.assert_dates(Job.fetch(job.id))
+        self.assert_dates(Job.fetch_many([job.id])[0])
+
+    def old_dates(self):
+        """The dates the way older versions wrote them."""
+        return dict((name, times.format(DATES[name], 'UTC'))
+                    for name in DATE_FIELDS)
+
+    def test_old_string_dates_are_read(self):
+        fields = self.old_dates()
+        fields['data'] = dumps(('tests.fixtures.add', (1, 2), {}))
+        fields['origin'] = 'default'
+        self.testconn.hmset(Job.key_for('old'), fields)
+        job = Job.fetch('old')
+        self.assert_dates(job)
+        self.assertEqual(job.func_name, 'tests.fixtures.add')
+
+        # Saved again with epoch dates
+        job.save()
+        self.assertEqual(float(self.testconn.hget(job.key, 'enqueued_at')),
+                         to_timestamp(DATES['enqueued_at']))
+        self.assert_dates(Job.fetch('old'))
+
+    def test_old_string_dates_in_packed_jobs_are_read(self):
+        fields = self.old_dates()
+        fields['data'] = dumps(('tests.fixtures.add', (1, 2), {}),
+                               HIGHEST_PROTOCOL)
+        fields['origin'] = 'default'
+        packed = tuple(fields.get(name) for name in Job.packed_properties)
+        self.testconn.hset(Job.key_for('old'), 'packed',
+                           dumps(packed, HIGHEST_PROTOCOL))
+        self.assert_dates(Job.fetch('old'))
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+from tests import RedisTestCase
+from tests import fixtures
+from dpq import Queue, Worker
+from dpq.events import EventLog
+from dpq.job import Job
+
+
+class TestEvents(RedisTestCase):
+
+    def events(self):
+        return [(fields['event'], fields.get('job_id'))
+                for _, fields in EventLog().read('0')]
+
+    def test_job_started_is_published_before_the_job_runs(self):
+        q = Queue()
+        job = q.enqueue(fixtures.published_events)
+        Worker([q], events=True).work(burst=True)
+        self.assertEqual(Job.fetch(job.id).result,
+                         ['worker_started', 'job_started'])
+        self.assertIn(('job_finished', job.id), self.events())
+
+    def test_cached_jobs_are_published(self):
+        q = Queue()
+        q.enqueue(fixtures.cached_add, 1, 2)
+        job = q.enqueue(fixtures.cached_add, 1, 2)
+        Worker([q], events=True).work(burst=True)
+        events = self.events()
+        self.assertIn(('job_started', job.id), events)
+        self.assertIn(('job_finished', job.id), events)
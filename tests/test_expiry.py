@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+import mock
+import times
+
+from tests import DPQTestCase
+from tests import fixtures
+from dpq import Queue, ThreadWorker
+from dpq.job import Job
+from dpq.queue import get_failed_queue
+
+
+def later(seconds=3600):
+    now = times.now() + datetime.timedelta(seconds=seconds)
+    return mock.patch('times.now', return_value=now)
+
+
+class TestExpiry(DPQTestCase):
+
+    def test_expired_jobs_are_discarded_on_dequeue(self):
+        q = Queue()
+        job = q.enqueue(fixtures.add, 1, 2, ttl=60)
+        with later():
+            self.assertIsNone(q.dequeue())
+        self.assertFalse(Job.exists(job.id))
+        self.assertEqual(q.expired_count, 1)
+
+    def test_expired_jobs_are_skipped_by_dequeue_any(self):
+        q = Queue()
+        q.enqueue(fixtures.add, 1, 2, ttl=60)
+        fresh = q.enqueue(fixtures.add, 3, 4)
+        with later():
+            job, queue = Queue.dequeue_any([q], None)
+        self.assertEqual(job.id, fresh.id)
+        self.assertEqual(q.expired_count, 1)
+
+    def test_jobs_before_their_expiry_are_performed(self):
+        q = Queue()
+        job = q.enqueue(fixtures.add, 1, 2, ttl=60)
+        ThreadWorker([q]).work(burst=True)
+        self.assertEqual(Job.fetch(job.id).result, 3)
+        self.assertEqual(q.expired_count, 0)
+
+    def test_results_remain_readable_past_the_expiry(self):
+        q = Queue()
+        job = q.enqueue(fixtures.add, 1, 2, ttl=60)
+        ThreadWorker([q]).work(burst=True)
+        with later():
+            self.assertEqual(Job.fetch(job.id).result, 3)
+            self.assertEqual(Job.fetch_many([job.id])[0].result, 3)
+
+    def test_expired_failed_jobs_can_be_requeued(self):
+        q = Queue()
+        job = q.enqueue(fixtures.div_by_zero, 1, ttl=60)
+        ThreadWorker([q]).work(burst=True)
+        fq = get_failed_queue()
+        with later():
+            self.assertIn('ZeroDivisionError', Job.fetch(job.id).exc_info)
+            fq.requeue(job.id)
+        self.assertEqual(fq.count, 0)
+        self.assertEqual(q.job_ids, [job.id])
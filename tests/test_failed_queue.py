@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+from tests import DPQTestCase, RedisTestCase
+from tests import fixtures
+from dpq import Queue, Worker, ThreadWorker
+from dpq.queue import get_failed_queue, fingerprint
+from dpq.job import Job
+
+
+class TestFailedQueue(DPQTestCase):
+
+    def test_failures_are_recorded_and_indexed(self):
+        q = Queue('numbers')
+        job = q.enqueue(fixtures.div_by_zero, 1)
+        q.enqueue(fixtures.div_by_zero, 2)
+        ThreadWorker([q]).work(burst=True)
+
+        fq = get_failed_queue()
+        self.assertEqual(fq.count, 2)
+        groups = fq.groups()
+        self.assertEqual(len(groups), 1)
+        self.assertEqual(groups[0]['count'], 2)
+        self.assertIn('ZeroDivisionError', groups[0]['exception'])
+        self.assertEqual(fq.counts_by('origin'), {'numbers': 2})
+        self.assertEqual(fq.counts_by('func'),
+                         {'tests.fixtures.div_by_zero': 2})
+        self.assertIn(job.id, fq.job_ids_by(origin='numbers'))
+
+    def test_non_ascii_failures_are_recorded(self):
+        q = Queue('numbers')
+        q.enqueue(fixtures.fail_all, 1)
+        q.enqueue(fixtures.fail_all, 2)
+        ThreadWorker([q]).work(burst=True)
+
+        fq = get_failed_queue()
+        self.assertEqual(fq.count, 2)
+        groups = fq.groups()
+        self.assertEqual(len(groups), 1)
+        self.assertEqual(groups[0]['count'], 2)
+        exc_info = u'  File "caf\xe9.py", line 1, in f\nValueError: x'
+        self.assertEqual(fingerprint('f', exc_info),
+                         fingerprint('f', exc_info.encode('utf-8')))
+
+    def test_requeue(self):
+        q = Queue('numbers')
+        job = q.enqueue(fixtures.div_by_zero, 1)
+        ThreadWorker([q]).work(burst=True)
+
+        fq = get_failed_queue()
+        fq.requeue(job.id)
+        self.assertEqual(fq.count, 0)
+        self.assertEqual(fq.counts_by('origin'), {})
+        self.assertEqual(q.job_ids, [job.id])
+        self.assertIsNone(Job.fetch(job.id).exc_info)
+
+    def test_max_length(self):
+        q = Queue('numbers')
+        jobs = [q.enqueue(fixtures.div_by_zero, i) for i in range(3)]
+        ThreadWorker([q]).work(burst=True)
+
+        fq = get_failed_queue()
+        fq.max_length = 2
+        fq.trim()
+        self.assertEqual(fq.job_ids, [job.id for job in jobs[1:]])
+        self.assertFalse(Job.exists(jobs[0].id))
+        self.assertEqual(fq.counts_by('origin'), {'numbers': 2})
+
+
+class TestFailedQueueOnLegacyClient(RedisTestCase):
+
+    def test_failures_are_recorded_and_indexed(self):
+        q = Queue('numbers')
+        job = q.enqueue(fixtures.div_by_zero, 1)
+        Worker([q]).work(burst=True)
+
+        fq = get_failed_queue()
+        self.assertEqual(fq.job_ids, [job.id])
+        self.assertEqual(fq.groups()[0]['count'], 1)
+        self.assertEqual(fq.counts_by('func'),
+                         {'tests.fixtures.div_by_zero': 1})
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+from tests import DPQTestCase, RedisTestCase
+from tests import fixtures
+from dpq import Queue, ThreadWorker
+from dpq.bench import RoundTripCounter
+
+
+class IndexTests(object):
+
+    def test_queued_jobs_are_counted_and_found(self):
+        q = Queue(indexed=True)
+        first = q.enqueue(fixtures.add, 1, 2, tags=['small'])
+        q.enqueue(fixtures.add, 3, 4)
+        noop = q.enqueue(fixtures.noop, tags=['small', 'other'])
+        self.assertEqual(q.count_by_func(), {'tests.fixtures.add': 2,
+                                             'tests.fixtures.noop': 1})
+        self.assertEqual(q.count_by_tag(), {'small': 2, 'other': 1})
+        self.assertEqual(
+            sorted(job.id for job in q.find(tag='small')),
+            sorted([first.id, noop.id]))
+        self.assertEqual(
+            [job.id for job in q.find('tests.fixtures.add', tag='small')],
+            [first.id])
+        self.assertRaises(ValueError, q.find)
+
+    def test_jobs_leave_the_indexes_when_dequeued(self):
+        q = Queue(indexed=True)
+        q.enqueue(fixtures.add, 1, 2)
+        q.enqueue(fixtures.noop)
+        q.dequeue()
+        self.assertEqual(q.count_by_func(), {'tests.fixtures.noop': 1})
+        ThreadWorker([q]).work(burst=True)
+        self.assertEqual(q.count_by_func(), {})
+
+    def test_tagged_jobs_are_indexed_on_any_queue(self):
+        q = Queue()
+        q.enqueue(fixtures.add, 1, 2)
+        tagged = q.enqueue(fixtures.add, 3, 4, tags=['urgent'])
+        self.assertEqual(q.count_by_func(), {'tests.fixtures.add': 1})
+        self.assertEqual([job.id for job in q.find(tag='urgent')],
+                         [tagged.id])
+        self.assertRaises(ValueError, q.enqueue, fixtures.noop,
+                          tags=['a,b'])
+
+    def test_enqueue_many_and_cancel(self):
+        q = Queue(indexed=True)
+        jobs = q.enqueue_many([(fixtures.add, (1, 2)), (fixtures.noop,)])
+        self.assertEqual(q.count_by_func(), {'tests.fixtures.add': 1,
+                                             'tests.fixtures.noop': 1})
+        jobs[0].cancel()
+        self.assertEqual(q.count_by_func(), {'tests.fixtures.noop': 1})
+
+    def test_popped_ids_leave_the_indexes_at_once(self):
+        q = Queue(indexed=True)
+        q.enqueue(fixtures.add, 1, 2, tags=['small'])
+        kept = q.enqueue(fixtures.add, 3, 4, tags=['small'])
+        # Popped by a worker that died before reading the job
+        q.pop_job_id()
+        self.assertEqual(q.count_by_func(), {'tests.fixtures.add': 1})
+        self.assertEqual(q.count_by_tag(), {'small': 1})
+        self.assertEqual([job.id for job in q.find(tag='small')], [kept.id])
+        q.dequeue()
+        self.assertEqual(q.count_by_func(), {})
+        self.assertEqual(sorted(self.testconn.keys('dpq:index:*')),
+                         ['dpq:index:default:funcs',
+                          'dpq:index:default:tags'])
+
+    def test_jobs_held_while_collecting_a_batch_stay_indexed(self):
+        q = Queue(indexed=True)
+        q.enqueue(fixtures.double_all, 1)
+        other = q.enqueue(fixtures.add, 1, 2)
+        q.enqueue(fixtures.double_all, 2)
+        w = ThreadWorker([q])
+        job, queue = w.dequeue_job(False)
+        w.collect_batch(job, queue)
+        self.assertEqual(q.count_by_func(), {'tests.fixtures.add': 1})
+        self.assertEqual([job.id for job in q.find('tests.fixtures.add')],
+                         [other.id])
+
+    def test_blocking_dequeues_from_plain_queues_cost_nothing_extra(self):
+        Queue().enqueue(fixtures.noop)
+        counter = RoundTripCounter(self.testconn)
+        q = Queue(connection=counter)
+        job, _ = Queue.dequeue_any([q], True, connection=counter, timeout=1)
+        self.assertEqual(job.func_name, 'tests.fixtures.noop')
+        # BLPOP, and reading the job
+        self.assertEqual(counter.round_trips, 2)
+
+    def test_jobs_waited_for_leave_the_indexes_once_fetched(self):
+        q = Queue(indexed=True)
+        q.enqueue(fixtures.add, 1, 2, tags=['small'])
+        Queue.dequeue_any([q], True, timeout=1)
+        self.assertEqual(q.count_by_func(), {})
+        self.assertEqual(q.count_by_tag(), {})
+
+    def test_workers_take_stale_ids_out_of_the_indexes(self):
+        q = Queue(indexed=True)
+        q.enqueue(fixtures.add, 1, 2, tags=['small'])
+        kept = q.enqueue(fixtures.add, 3, 4, tags=['small'])
+        # Popped by a worker that died right after BLPOP
+        self.testconn.blpop([q.key], 1)
+        self.assertEqual(q.count_by_func(), {'tests.fixtures.add': 2})
+        self.assertEqual(q.drop_stale_index_entries(), 1)
+        self.assertEqual(q.count_by_tag(), {'small': 1})
+        self.assertEqual([job.id for job in q.find(tag='small')], [kept.id])
+
+        self.testconn.blpop([q.key], 1)
+        ThreadWorker([q]).work(burst=True)
+        self.assertEqual(q.count_by_func(), {})
+        self.assertEqual(self.testconn.hlen(q.index_key('jobs')), 0)
+
+
+class TestIndexes(IndexTests, DPQTestCase):
+    pass
+
+
+class TestIndexesOnLegacyClient(IndexTests, RedisTestCase):
+    pass
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+from tests import RedisTestCase
+from tests import fixtures
+from dpq import Queue, Worker
+from dpq.job import Job
+from dpq.queue import get_failed_queue
+
+
+class TestLimits(RedisTestCase):
+
+    def test_usage_of_jobs_returning_none_is_kept(self):
+        q = Queue()
+        job = q.enqueue(fixtures.noop)
+        Worker([q]).work(burst=True)
+        job = Job.fetch(job.id)
+        self.assertIsNone(job.result)
+        self.assertGreater(job.peak_rss, 0)
+        self.assertIsNotNone(job.cpu_time)
+        self.assertGreater(self.testconn.ttl(job.key), 0)
+
+    def test_killed_horses_within_the_cpu_limit_crashed(self):
+        q = Queue()
+        job = q.enqueue(fixtures.kill_self)
+        Worker([q], cpu_limit=60).work(burst=True)
+        self.assertEqual(get_failed_queue().job_ids, [job.id])
+        job = Job.fetch(job.id)
+        self.assertEqual(job.failure_reason, 'crashed')
+        self.assertIn('crashed', job.exc_info)
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from dpq.memory import MemoryRedis
+
+
+class TestMemoryRedis(unittest.TestCase):
+
+    def test_score_bounds_keep_their_precision(self):
+        r = MemoryRedis()
+        r.zadd('z', 1792381806.513124, 'a')
+        self.assertEqual(r.zrangebyscore('z', '-inf', 1792381806.513299),
+                         ['a'])
+        self.assertEqual(r.zrangebyscore('z', '-inf', '(1792381806.513124'),
+                         [])
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+from cPickle import dumps, loads
+
+from tests import DPQTestCase
+from tests import fixtures
+from dpq import Queue, ThreadWorker
+from dpq.job import Job
+from dpq.queue import get_failed_queue
+
+
+class TestPackedJobs(DPQTestCase):
+
+    def test_packed_jobs_are_a_single_field(self):
+        q = Queue(packed=True)
+        job = q.enqueue(fixtures.add, 1, 2, timeout=30, ttl=60, retry=2,
+                        backoff=5, tags=['numbers'], unique_key='sum')
+        self.assertEqual(self.testconn.hkeys(job.key), ['packed'])
+
+        fetched = Job.fetch(job.id)
+        self.assertTrue(fetched.packed)
+        self.assertEqual((fetched.func_name, fetched.args),
+                         ('tests.fixtures.add', (1, 2)))
+        self.assertEqual(fetched.origin, q.name)
+        self.assertEqual(fetched.timeout, 30)
+        self.assertEqual((fetched.retries, fetched.backoff), (2, 5))
+        self.assertEqual(fetched.tags, ('numbers',))
+        self.assertEqual(fetched.unique_lock, job.unique_lock)
+        self.assertEqual(fetched.expires_at, job.expires_at)
+        self.assertEqual(fetched.description, job.description)
+
+    def test_older_packed_jobs_are_readable(self):
+        q = Queue(packed=True)
+        job = q.enqueue(fixtures.add, 1, 2)
+        # As written before fields were appended to `packed_properties`
+        values = loads(self.testconn.hget(job.key, 'packed'))[:3]
+        self.testconn.hset(job.key, 'packed', dumps(values))
+        fetched = Job.fetch(job.id)
+        self.assertEqual(fetched.args, (1, 2))
+        self.assertEqual(fetched.origin, q.name)
+        self.assertEqual(fetched.tags, ())
+
+    def test_packed_jobs_are_performed(self):
+        q = Queue(packed=True)
+        job = q.enqueue(fixtures.add, 1, 2)
+        failed = q.enqueue(fixtures.div_by_zero, 1)
+        ThreadWorker([q]).work(burst=True)
+        self.assertEqual(Job.fetch(job.id).result, 3)
+        self.assertIn('result', self.testconn.hkeys(job.key))
+        self.assertIn('ZeroDivisionError', Job.fetch(failed.id).exc_info)
+
+        get_failed_queue().requeue(failed.id)
+        requeued = Job.fetch(failed.id)
+        self.assertTrue(requeued.packed)
+        self.assertIsNone(requeued.exc_info)
+        self.assertEqual(q.job_ids, [failed.id])
+
+    def test_packed_and_plain_jobs_share_a_queue(self):
+        plain = Queue('numbers')
+        packed = Queue('numbers', packed=True)
+        first = plain.enqueue(fixtures.add, 1, 2)
+        second = packed.enqueue(fixtures.add, 3, 4)
+        ThreadWorker([plain]).work(burst=True)
+        self.assertEqual(Job.fetch(first.id).result, 3)
+        self.assertEqual(Job.fetch(second.id).result, 7)
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import shutil
+import signal
+import tempfile
+from datetime import timedelta
+
+import times
+
+from tests import DPQTestCase, RedisTestCase
+from tests import fixtures
+from dpq import Queue, Worker
+from dpq.job import Job
+from dpq.pool import WorkerPool
+
+
+JOBS = """
+def version():
+    return %d
+"""
+
+
+def module_path(test):
+    """Returns a directory to write the modules of the given test to,
+    importable until the test ends.
+    """
+    path = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, path)
+    sys.path.insert(0, path)
+    test.addCleanup(sys.path.remove, path)
+
+    def forget_modules():
+        for name in list(sys.modules):
+            if name.split('.')[0] == 'dpq_reloaded':
+                del sys.modules[name]
+    test.addCleanup(forget_modules)
+    return path
+
+
+def write_module(path, name, source):
+    filename = os.path.join(path, name)
+    if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    with open(filename, 'w') as f:
+        f.write(source)
+    # Not to be taken for the old module within the same second
+    if os.path.exists(filename + 'c'):
+        os.remove(filename + 'c')
+
+
+class RecordingPool(WorkerPool):
+    """Keeps track of its workers without forking them."""
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingPool, self).__init__(*args, **kwargs)
+        self.spawned = []
+        self.retired = []
+
+    def spawn(self):
+        pid = 1000 + len(self.spawned)
+        self.spawned.append(pid)
+        self.workers.append(pid)
+        return pid
+
+    def retire(self, pid):
+        self.retired.append(pid)
+        self.workers.remove(pid)
+
+    def reap(self, block=False):
+        pass
+
+
+class TestAutoscaling(DPQTestCase):
+
+    def test_desired_size_follows_the_backlog_and_latency(self):
+        pool = RecordingPool([Queue()], None, min_workers=1, max_workers=4)
+        pool.jobs_per_worker = 10
+        self.assertEqual(pool.desired_size(0, 0), 1)
+        self.assertEqual(pool.desired_size(11, 0), 2)
+        self.assertEqual(pool.desired_size(1000, 0), 4)
+        # One more worker than it has while jobs wait too long
+        pool.spawn()
+        self.assertEqual(pool.desired_size(0, pool.target_latency + 1), 2)
+
+    def test_sample_sums_the_backlog_and_takes_the_longest_wait(self):
+        high, low = Queue('high'), Queue('low')
+        high.enqueue(fixtures.add, 1, 2)
+        job = low.enqueue(fixtures.add, 3, 4)
+        job.enqueued_at = times.now() - timedelta(seconds=60)
+        job.save()
+        pool = RecordingPool([high, low], None)
+        backlog, latency = pool.sample()
+        self.assertEqual(backlog, 2)
+        self.assertGreaterEqual(latency, 60)
+        self.assertEqual(Queue('empty').latency, 0)
+
+    def test_scaling_up_and_down_takes_a_streak_of_samples(self):
+        pool = RecordingPool([Queue()], None, min_workers=1, max_workers=4)
+        pool.scale_up_samples = 2
+        pool.scale_down_samples = 3
+        pool.spawn()
+        pool.scale(3)
+        self.assertEqual(pool.size, 1)
+        pool.scale(3)
+        self.assertEqual(pool.size, 3)
+
+        # A sample at the current size resets the streak
+        pool.scale(1)
+        pool.scale(1)
+        pool.scale(3)
+        pool.scale(1)
+        pool.scale(1)
+        self.assertEqual(pool.size, 3)
+        pool.scale(1)
+        # One worker at a time, the newest first
+        self.assertEqual(pool.size, 2)
+        self.assertEqual(pool.retired, [1002])
+
+    def test_sizes_are_checked(self):
+        with self.assertRaises(ValueError):
+            WorkerPool([Queue()], None, min_workers=3, max_workers=2)
+
+
+class TestReload(DPQTestCase):
+
+    def setUp(self):
+        super(TestReload, self).setUp()
+        self.handlers = [(signum, signal.getsignal(signum)) for signum in
+                         (signal.SIGINT, signal.SIGTERM, signal.SIGHUP)]
+
+    def tearDown(self):
+        for signum, handler in self.handlers:
+            signal.signal(signum, handler)
+        super(TestReload, self).tearDown()
+
+    def make_pool(self, size, **kwargs):
+        pool = RecordingPool([Queue()], None, **kwargs)
+        pool.reload_warmup = 0
+        for _ in range(size):
+            pool.spawn()
+        return pool
+
+    def test_workers_are_replaced_without_dropping_capacity(self):
+        pool = self.make_pool(3)
+        sizes = []
+        retire = pool.retire
+
+        def record_retire(pid):
+            retire(pid)
+            sizes.append(pool.size)
+        pool.retire = record_retire
+
+        pool.reload()
+        self.assertEqual(pool.retired, [1000, 1001, 1002])
+        self.assertEqual(pool.workers, [1003, 1004, 1005])
+        self.assertEqual(sizes, [3, 3, 3])
+
+    def test_workers_are_kept_when_a_module_fails_to_import(self):
+        pool = self.make_pool(2, preload=['tests.no_such_module'])
+        pool.reload()
+        self.assertEqual(pool.workers, [1000, 1001])
+        self.assertEqual(pool.retired, [])
+
+    def test_preloaded_modules_are_imported_anew(self):
+        path = module_path(self)
+        write_module(path, 'dpq_reloaded/__init__.py',
+                     'from dpq_reloaded.jobs import version\n')
+        write_module(path, 'dpq_reloaded/jobs.py', JOBS % 1)
+        pool = self.make_pool(1, preload=['dpq_reloaded'])
+        self.assertTrue(pool.import_modules())
+        self.assertEqual(sys.modules['dpq_reloaded.jobs'].version(), 1)
+
+        # Only the submodule changed
+        write_module(path, 'dpq_reloaded/jobs.py', JOBS % 2)
+        pool.reload()
+        self.assertEqual(sys.modules['dpq_reloaded.jobs'].version(), 2)
+        self.assertEqual(sys.modules['dpq_reloaded'].version(), 2)
+        self.assertEqual(pool.workers, [1001])
+
+    def test_sighup_reloads_the_running_pool(self):
+        pool = self.make_pool(0)
+        pool.interval = 0.01
+        reloads = []
+
+        def sample():
+            os.kill(os.getpid(), signal.SIGHUP)
+            return 0, 0
+
+        def reload():
+            reloads.append(pool.size)
+            pool._stopped = True
+        pool.sample = sample
+        pool.reload = reload
+
+        pool.run()
+        self.assertEqual(reloads, [1])
+        self.assertEqual(pool.retired, [1000])
+
+
+class TestPoolProcesses(RedisTestCase):
+
+    def setUp(self):
+        super(TestPoolProcesses, self).setUp()
+        self.handlers = [(signum, signal.getsignal(signum))
+                         for signum in (signal.SIGINT, signal.SIGTERM)]
+
+    def tearDown(self):
+        for signum, handler in self.handlers:
+            signal.signal(signum, handler)
+        super(TestPoolProcesses, self).tearDown()
+
+    def worker_factory(self, queues):
+        def make_worker():
+            worker = Worker(queues)
+            # Stopped workers notice once their wait for jobs ends
+            worker.dequeue_timeout = 1
+            return worker
+        return make_worker
+
+    def test_workers_are_forked_and_retired_warmly(self):
+        q = Queue()
+        job = q.enqueue(fixtures.add, 1, 2)
+        pool = WorkerPool([q], self.worker_factory([q]))
+        pid = pool.spawn()
+        self.assertEqual(pool.workers, [pid])
+        for _ in range(100):
+            if Job.fetch(job.id).result is not None:
+                break
+            time.sleep(0.05)
+        self.assertEqual(Job.fetch(job.id).result, 3)
+        pool.shutdown()
+        self.assertEqual(pool.workers, [])
+        self.assertEqual(pool.draining, [])
+        self.assertEqual(Worker.all(), [])
+
+    def test_workers_run_the_reloaded_code(self):
+        path = module_path(self)
+        write_module(path, 'dpq_reloaded/__init__.py',
+                     'import dpq_reloaded.jobs\n')
+        write_module(path, 'dpq_reloaded/jobs.py', JOBS % 1)
+        q = Queue()
+        pool = WorkerPool([q], self.worker_factory([q]),
+                          preload=['dpq_reloaded'])
+        pool.reload_warmup = 0
+        self.assertTrue(pool.import_modules())
+        pool.spawn()
+        try:
+            self.assertEqual(self.perform(q, 'dpq_reloaded.jobs'), 1)
+
+            write_module(path, 'dpq_reloaded/jobs.py', JOBS % 2)
+            pool.reload()
+            # The old worker could still take the next job until it ended
+            for _ in range(100):
+                pool.reap()
+                if not pool.draining:
+                    break
+                time.sleep(0.05)
+            self.assertEqual(self.perform(q, 'dpq_reloaded.jobs'), 2)
+        finally:
+            pool.shutdown()
+
+    def perform(self, queue, module_name):
+        """Returns the version of the given module of jobs, as seen by a
+        worker of the pool.
+        """
+        job = queue.enqueue(sys.modules[module_name].version)
+        for _ in range(100):
+            result = Job.fetch(job.id).result
+            if result is not None:
+                return result
+            time.sleep(0.05)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+from tests import DPQTestCase
+from tests import fixtures
+from dpq import Queue, ThreadWorker, get_current_job
+from dpq.job import Job
+from dpq.queue import get_failed_queue
+
+
+class TestCurrentJob(DPQTestCase):
+
+    def test_jobs_know_themselves(self):
+        q = Queue()
+        job = q.enqueue(fixtures.current_job_id)
+        ThreadWorker([q]).work(burst=True)
+        self.assertEqual(Job.fetch(job.id).result, job.id)
+        self.assertIsNone(get_current_job())
+
+
+class TestProgress(DPQTestCase):
+
+    def count_writes(self):
+        writes = []
+        hmset = self.testconn.hmset
+
+        def counting_hmset(name, mapping):
+            writes.append(name)
+            return hmset(name, mapping)
+        self.testconn.hmset = counting_hmset
+        return writes
+
+    def test_writes_are_coalesced(self):
+        job = Queue().enqueue(fixtures.noop)
+        writes = self.count_writes()
+        for i in range(1, 1001):
+            job.update_progress(i / 1000.0, step=i)
+        self.assertEqual(writes, [job.key])
+        self.assertEqual(Job.fetch_progress([job.id]), [(0.001, {'step': 1})])
+
+        self.assertTrue(job.save_meta())
+        self.assertEqual(Job.fetch_progress([job.id]), [(1.0, {'step': 1000})])
+
+    def test_meta_is_kept_across_updates(self):
+        job = Queue().enqueue(fixtures.noop)
+        job.update_progress(0.1, stage='download')
+        job.update_progress(0.9, done=3)
+        job.save_meta()
+        job = Job.fetch(job.id)
+        self.assertEqual(job.progress, 0.9)
+        self.assertEqual(job.meta, {'stage': 'download', 'done': 3})
+
+    def test_unwritten_progress_goes_out_with_the_result(self):
+        q = Queue()
+        job = q.enqueue(fixtures.report_progress, 1000)
+        ThreadWorker([q]).work(burst=True)
+        job = Job.fetch(job.id)
+        self.assertEqual(job.result, 1000)
+        self.assertEqual(job.progress, 1.0)
+        self.assertEqual(job.meta, {'step': 1000})
+
+    def test_progress_of_many_jobs_is_fetched_at_once(self):
+        q = Queue()
+        job = q.enqueue(fixtures.report_progress, 10)
+        waiting = q.enqueue(fixtures.noop)
+        ThreadWorker([q]).work(burst=True)
+        self.assertEqual(Job.fetch_progress([job.id, waiting.id, 'gone']),
+                         [(1.0, {'step': 10}), (None, {}), (None, {})])
+
+    def test_failed_jobs_keep_their_progress(self):
+        q = Queue()
+        job = q.enqueue(fixtures.fail_halfway, 10)
+        ThreadWorker([q]).work(burst=True)
+        self.assertEqual(get_failed_queue().job_ids, [job.id])
+        job = Job.fetch(job.id)
+        self.assertEqual(job.progress, 0.5)
+        self.assertEqual(job.meta, {'step': 5})
+
+    def test_packed_jobs_keep_progress_outside_the_packed_field(self):
+        q = Queue(packed=True)
+        job = q.enqueue(fixtures.report_progress, 10)
+        ThreadWorker([q]).work(burst=True)
+        self.assertEqual(
+            sorted(self.testconn.hkeys(job.key)),
+            ['meta', 'packed', 'progress', 'result'])
+        job = Job.fetch(job.id)
+        self.assertEqual(job.result, 10)
+        self.assertEqual(job.progress, 1.0)
+        self.assertEqual(job.meta, {'step': 10})
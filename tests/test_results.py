@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+from tests import DPQTestCase
+from tests import fixtures
+from dpq import Queue, ThreadWorker
+from dpq.bench import RoundTripCounter
+from dpq.job import Job
+
+
+class TestWaitForResult(DPQTestCase):
+
+    def work_later(self, queue, delay=0.1):
+        """Performs the jobs of the queue in another thread, after
+        `delay` seconds.
+        """
+        def work():
+            time.sleep(delay)
+            ThreadWorker([queue]).work(burst=True)
+        thread = threading.Thread(target=work)
+        thread.start()
+        self.addCleanup(thread.join)
+
+    def test_the_return_value_is_waited_for(self):
+        q = Queue()
+        job = q.enqueue(fixtures.add, 1, 2)
+        self.work_later(q)
+        self.assertEqual(job.wait_for_result(timeout=5), 3)
+        self.assertEqual(job.result, 3)
+
+    def test_jobs_returning_none_end_the_wait(self):
+        q = Queue()
+        job = q.enqueue(fixtures.noop)
+        self.work_later(q)
+        started = time.time()
+        self.assertIsNone(job.wait_for_result(timeout=5))
+        self.assertLess(time.time() - started, 2)
+        self.assertFalse(Job.exists(job.id))
+
+    def test_failed_jobs_end_the_wait(self):
+        for q in [Queue(), Queue('packed', packed=True)]:
+            job = q.enqueue(fixtures.div_by_zero, 1)
+            self.work_later(q)
+            started = time.time()
+            self.assertIsNone(job.wait_for_result(timeout=5))
+            self.assertLess(time.time() - started, 2)
+            self.assertIsNotNone(Job.fetch(job.id).ended_at)
+
+    def test_waiting_times_out(self):
+        job = Queue().enqueue(fixtures.add, 1, 2)
+        started = time.time()
+        self.assertIsNone(job.wait_for_result(timeout=0.2))
+        waited = time.time() - started
+        self.assertGreaterEqual(waited, 0.2)
+        self.assertLess(waited, 1)
+
+
+class TestEnqueueMany(DPQTestCase):
+
+    def test_jobs_are_enqueued_in_one_round_trip(self):
+        counter = RoundTripCounter(self.testconn)
+        q = Queue(connection=counter)
+        jobs = q.enqueue_many([(fixtures.add, (1, 2)),
+                               (fixtures.add, (3,), {'b': 4}),
+                               (fixtures.noop,)])
+        self.assertEqual(counter.round_trips, 1)
+        self.assertEqual(q.job_ids, [job.id for job in jobs])
+        self.assertEqual(q.enqueue_many([]), [])
+
+        ThreadWorker([q]).work(burst=True)
+        self.assertEqual([Job.fetch(job.id).result for job in jobs[:2]],
+                         [3, 7])
+
+    def test_unique_keys_are_refused(self):
+        q = Queue()
+        with self.assertRaises(ValueError):
+            q.enqueue_many([(fixtures.add, (1, 2), {'unique_key': 'k'})])
+        self.assertEqual(q.count, 0)
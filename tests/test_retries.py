@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+import mock
+
+from tests import DPQTestCase, RedisTestCase
+from tests import fixtures
+from dpq import Queue, Worker, ThreadWorker
+from dpq.queue import get_failed_queue
+from dpq.retries import RetryQueue
+from dpq.job import Job
+
+
+class TestRetries(DPQTestCase):
+
+    def setUp(self):
+        super(TestRetries, self).setUp()
+        fixtures.calls[:] = []
+
+    def test_failed_jobs_are_retried(self):
+        q = Queue()
+        job = q.enqueue(fixtures.div_by_zero, 1, retry=1, backoff=0)
+        ThreadWorker([q]).work(burst=True)
+        rq = RetryQueue()
+        self.assertEqual(rq.count, 1)
+        self.assertEqual(get_failed_queue().count, 0)
+        job = Job.fetch(job.id)
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('ZeroDivisionError', job.exc_info)
+
+        rq.enqueue_due()
+        self.assertEqual(rq.count, 0)
+        self.assertEqual(q.job_ids, [job.id])
+        ThreadWorker([q]).work(burst=True)
+        self.assertEqual(len(fixtures.calls), 2)
+        self.assertEqual(get_failed_queue().job_ids, [job.id])
+        self.assertEqual(Job.fetch(job.id).attempts, 2)
+
+    def test_decorated_functions_are_retried(self):
+        q = Queue()
+        job = q.enqueue(fixtures.flaky, 1)
+        self.assertEqual((job.retries, job.backoff), (2, 0))
+        for _ in range(3):
+            ThreadWorker([q]).work(burst=True)
+            RetryQueue().enqueue_due()
+        self.assertEqual(len(fixtures.calls), 3)
+        self.assertEqual(get_failed_queue().job_ids, [job.id])
+
+    def test_unique_lock_is_held_until_the_last_attempt(self):
+        q = Queue()
+        job = q.enqueue(fixtures.div_by_zero, 1, retry=1, backoff=0,
+                        unique_key='k1')
+        lock = q.unique_lock_key('k1')
+        ThreadWorker([q]).work(burst=True)
+        self.assertEqual(self.testconn.get(lock), job.id)
+        RetryQueue().enqueue_due()
+        ThreadWorker([q]).work(burst=True)
+        self.assertIsNone(self.testconn.get(lock))
+
+    def test_backoff(self):
+        rq = RetryQueue()
+        job = Job.create(fixtures.add, 1, 2, connection=self.testconn)
+        job.backoff = 2
+        for attempts, longest in ((1, 2), (2, 4), (3, 8)):
+            job.attempts = attempts
+            delay = rq.delay(job)
+            self.assertTrue(longest / 2.0 <= delay <= longest)
+
+
+class DueRetryTests(object):
+
+    def fail_once(self, queue):
+        job = queue.enqueue(fixtures.div_by_zero, 1, retry=1, backoff=0)
+        ThreadWorker([queue]).work(burst=True)
+        return job
+
+    def test_due_jobs_are_indexed_again(self):
+        q = Queue(indexed=True)
+        self.fail_once(q)
+        self.assertEqual(q.count_by_func(), {})
+        RetryQueue().enqueue_due()
+        self.assertEqual(q.count_by_func(), {'tests.fixtures.div_by_zero': 1})
+        q.pop_job_id()
+        self.assertEqual(q.count_by_func(), {})
+
+    def test_due_jobs_stay_scheduled_until_pushed(self):
+        q = Queue()
+        job = self.fail_once(q)
+        rq = RetryQueue()
+        with mock.patch.object(Job, 'fetch_many', side_effect=IOError):
+            self.assertRaises(IOError, rq.enqueue_due)
+        self.assertEqual(rq.count, 1)
+        rq.enqueue_due()
+        self.assertEqual(q.job_ids, [job.id])
+
+    def test_concurrent_workers_push_due_jobs_once(self):
+        q = Queue()
+        job = self.fail_once(q)
+        rq = RetryQueue()
+        fetch_many = Job.fetch_many
+
+        def fetch_and_race(*args, **kwargs):
+            jobs = fetch_many(*args, **kwargs)
+            if fetch_and_race.racing:
+                fetch_and_race.racing = False
+                rq.enqueue_due()
+            return jobs
+        fetch_and_race.racing = True
+        with mock.patch.object(Job, 'fetch_many', side_effect=fetch_and_race):
+            rq.enqueue_due()
+        self.assertEqual(q.job_ids, [job.id])
+        self.assertEqual(rq.count, 0)
+
+
+class TestDueRetries(DueRetryTests, DPQTestCase):
+    pass
+
+
+class TestRetriesOnLegacyClient(DueRetryTests, RedisTestCase):
+
+    def test_failed_jobs_are_scheduled(self):
+        q = Queue()
+        job = q.enqueue(fixtures.div_by_zero, 1, retry=1, backoff=60)
+        Worker([q]).work(burst=True)
+        due = self.testconn.zscore(RetryQueue.key_for(q.name), job.id)
+        self.assertTrue(time.time() + 29 < due <= time.time() + 60)
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+from tests import DPQTestCase
+from tests import fixtures
+from dpq import Queue, ThreadWorker
+from dpq.scheduling import WeightedRoundRobin, parse_weights
+
+
+class TestWeightedRoundRobin(DPQTestCase):
+
+    def test_queues_come_first_by_weight_interleaved(self):
+        queues = [Queue(name) for name in ['a', 'b', 'c']]
+        scheduler = WeightedRoundRobin({'a': 5, 'b': 1, 'c': 1})
+        orders = [[q.name for q in scheduler.order(queues)]
+                  for _ in range(7)]
+        self.assertEqual([order[0] for order in orders],
+                         ['a', 'a', 'b', 'a', 'c', 'a', 'a'])
+        # The others keep their configured order
+        self.assertEqual(orders[2], ['b', 'a', 'c'])
+        self.assertEqual(orders[4], ['c', 'a', 'b'])
+
+    def test_queues_without_a_weight_get_the_default(self):
+        queues = [Queue('a'), Queue('b')]
+        scheduler = WeightedRoundRobin({'a': 2})
+        self.assertEqual([scheduler.order(queues)[0].name for _ in range(6)],
+                         ['a', 'b', 'a'] * 2)
+
+    def test_weights_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            WeightedRoundRobin({'a': 0})
+
+    def test_parse_weights(self):
+        self.assertEqual(parse_weights('high=5,low=1'),
+                         [('high', 5), ('low', 1)])
+        with self.assertRaises(ValueError):
+            parse_weights('high')
+
+
+class TestWeightedWorker(DPQTestCase):
+
+    def setUp(self):
+        super(TestWeightedWorker, self).setUp()
+        fixtures.calls[:] = []
+
+    def test_a_busy_first_queue_does_not_starve_the_rest(self):
+        high, low = Queue('high'), Queue('low')
+        for i in range(4):
+            high.enqueue(fixtures.add, 'high', i)
+        for i in range(2):
+            low.enqueue(fixtures.add, 'low', i)
+        ThreadWorker([high, low],
+                     weights={'high': 2, 'low': 1}).work(burst=True)
+        self.assertEqual([call[1] for call in fixtures.calls],
+                         ['high', 'low', 'high', 'high', 'low', 'high'])
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+from tests import RedisTestCase
+from tests import fixtures
+from dpq.job import Job
+from dpq.queue import StreamQueue, cancel_jobs
+
+
+class TestStreamQueue(RedisTestCase):
+
+    def test_lpop_takes_job_ids_off_for_good(self):
+        low = StreamQueue('low')
+        high = StreamQueue('high')
+        first = low.enqueue(fixtures.add, 1, 2)
+        second = high.enqueue(fixtures.add, 3, 4)
+        keys = [high.key, low.key]
+        self.assertEqual(StreamQueue.lpop(keys, False), (high.key, second.id))
+        self.assertEqual(StreamQueue.lpop(keys, True, timeout=1),
+                         (low.key, first.id))
+        self.assertIsNone(StreamQueue.lpop(keys, False))
+        self.assertIsNone(StreamQueue.lpop(keys, True, timeout=1))
+        self.assertEqual(high.count + low.count, 0)
+
+    def test_claim_idle_follows_the_longest_job_timeout(self):
+        q = StreamQueue(default_job_timeout=180)
+        self.assertEqual(q.claim_idle(), 180 + q.claim_grace)
+        q.enqueue(fixtures.add, 1, 2, timeout=600)
+        q.enqueue(fixtures.add, 1, 2, timeout=30)
+        self.assertEqual(q.claim_idle(), 600 + q.claim_grace)
+        self.assertEqual(StreamQueue().claim_idle(), 600 + q.claim_grace)
+        self.assertEqual(StreamQueue(claim_after=5).claim_idle(), 5)
+
+    def test_returned_job_ids_are_handed_out_again(self):
+        q = StreamQueue()
+        jobs = [q.enqueue(fixtures.add, x, x) for x in range(3)]
+        self.assertEqual(q.pop_job_ids(3), [job.id for job in jobs])
+        q.return_job_ids([jobs[1].id, jobs[2].id])
+        self.assertEqual(q.pop_job_ids(3), [jobs[1].id, jobs[2].id])
+
+    def test_cancel_by_function_removes_the_entries(self):
+        q = StreamQueue()
+        q.enqueue(fixtures.add, 1, 2)
+        kept = q.enqueue(fixtures.noop)
+        self.assertEqual(q.cancel_jobs('tests.fixtures.add'), 1)
+        self.assertEqual(q.job_ids, [kept.id])
+
+    def test_cancelling_leaves_handed_out_jobs_alone(self):
+        q = StreamQueue(batch_size=1)
+        running = q.enqueue(fixtures.add, 1, 2)
+        waiting = q.enqueue(fixtures.add, 3, 4)
+        self.assertEqual(q.dequeue().id, running.id)
+        self.assertEqual(q.waiting_job_ids(), [waiting.id])
+        self.assertEqual(cancel_jobs(origin=q.name), 1)
+        self.assertTrue(Job.exists(running.id))
+        self.assertFalse(Job.exists(waiting.id))
+        self.assertEqual(q.cancel_jobs('tests.fixtures.add'), 0)
+        self.assertTrue(Job.exists(running.id))
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from tests import DPQTestCase, RedisTestCase
+from tests import fixtures
+from dpq import Queue, Worker
+from dpq.job import Job
+from dpq.queue import get_failed_queue
+from dpq.timeouts import death_pentalty_after, JobTimeoutException
+
+
+class TestDeathPenalty(DPQTestCase):
+
+    def test_fractions_of_seconds_are_honoured(self):
+        started = time.time()
+        with self.assertRaises(JobTimeoutException):
+            with death_pentalty_after(0.1):
+                time.sleep(5)
+        self.assertLess(time.time() - started, 1)
+
+
+class TestTimeouts(RedisTestCase):
+
+    def test_sub_second_timeouts_fail_the_job(self):
+        q = Queue()
+        job = q.enqueue(fixtures.sleep, 5, timeout=0.2)
+        started = time.time()
+        Worker([q]).work(burst=True)
+        self.assertLess(time.time() - started, 1)
+        self.assertEqual(get_failed_queue().job_ids, [job.id])
+        job = Job.fetch(job.id)
+        self.assertEqual(job.timeout, 0.2)
+        self.assertEqual(job.failure_reason, 'timeout')
+        self.assertIn('JobTimeoutException', job.exc_info)
+
+    def test_the_worker_kills_horses_ignoring_their_alarm(self):
+        q = Queue()
+        job = q.enqueue(fixtures.sleep_through_signals, 30, timeout=0.2)
+        started = time.time()
+        # The horse ignores SIGTERM too, so it takes a SIGKILL
+        Worker([q], kill_grace=0.2).work(burst=True)
+        self.assertLess(time.time() - started, 5)
+        self.assertEqual(get_failed_queue().job_ids, [job.id])
+        job = Job.fetch(job.id)
+        self.assertEqual(job.failure_reason, 'timeout')
+        self.assertIn('killed after exceeding the job timeout (0.2 seconds)',
+                      job.exc_info)
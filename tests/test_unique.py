@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+from tests import DPQTestCase, RedisTestCase
+from tests import fixtures
+from dpq import Queue, ThreadWorker
+from dpq.exceptions import InvalidJobOperationError
+from dpq.queue import get_failed_queue
+from dpq.job import Job
+
+
+class UniqueLockTests(object):
+
+    def test_equivalent_jobs_are_enqueued_once(self):
+        q = Queue()
+        first = q.enqueue(fixtures.add, 1, 2, unique_key=True)
+        second = q.enqueue(fixtures.add, 1, 2, unique_key=True)
+        other = q.enqueue(fixtures.add, 2, 1, unique_key=True)
+        self.assertEqual(second.id, first.id)
+        self.assertNotEqual(other.id, first.id)
+        self.assertEqual(q.job_ids, [first.id, other.id])
+
+    def test_explicit_keys(self):
+        q = Queue()
+        first = q.enqueue(fixtures.add, 1, 2, unique_key='sum')
+        second = q.enqueue(fixtures.add, 3, 4, unique_key='sum')
+        self.assertEqual(second.id, first.id)
+        self.assertEqual(q.count, 1)
+
+    def test_lock_is_released_after_success(self):
+        q = Queue()
+        first = q.enqueue(fixtures.add, 1, 2, unique_key='sum')
+        ThreadWorker([q]).work(burst=True)
+        second = q.enqueue(fixtures.add, 1, 2, unique_key='sum')
+        self.assertNotEqual(second.id, first.id)
+        self.assertEqual(q.job_ids, [second.id])
+
+    def test_lock_is_released_after_failure(self):
+        q = Queue()
+        failed = q.enqueue(fixtures.div_by_zero, 1, unique_key='k1')
+        ThreadWorker([q]).work(burst=True)
+        self.assertIsNone(self.testconn.get(q.unique_lock_key('k1')))
+        self.assertEqual(get_failed_queue().job_ids, [failed.id])
+
+        again = q.enqueue(fixtures.div_by_zero, 1, unique_key='k1')
+        self.assertNotEqual(again.id, failed.id)
+        self.assertEqual(q.job_ids, [again.id])
+        self.assertEqual(self.testconn.get(q.unique_lock_key('k1')),
+                         again.id)
+
+    def test_requeue_waits_for_the_lock(self):
+        q = Queue()
+        failed = q.enqueue(fixtures.div_by_zero, 1, unique_key='k1')
+        ThreadWorker([q]).work(burst=True)
+        holder = q.enqueue(fixtures.div_by_zero, 1, unique_key='k1')
+        fq = get_failed_queue()
+        self.assertRaises(InvalidJobOperationError, fq.requeue, failed.id)
+        self.assertEqual(fq.job_ids, [failed.id])
+        self.assertEqual(q.job_ids, [holder.id])
+
+        holder.cancel()
+        fq.requeue(failed.id)
+        self.assertEqual(fq.job_ids, [])
+        self.assertEqual(q.job_ids, [holder.id, failed.id])
+        self.assertEqual(self.testconn.get(q.unique_lock_key('k1')),
+                         failed.id)
+
+    def test_losers_are_not_saved(self):
+        q = Queue()
+        q.enqueue(fixtures.add, 1, 2, unique_key='sum')
+        q.enqueue(fixtures.add, 1, 2, unique_key='sum')
+        self.assertEqual(len(self.testconn.keys(Job.key_for('*'))), 1)
+
+    def test_locks_expire(self):
+        q = Queue()
+        job = q.enqueue(fixtures.unique_lock_ttl, unique_key='k1',
+                        timeout=30)
+        self.assertGreater(self.testconn.ttl(job.unique_lock),
+                           Job.unique_lock_ttl - 5)
+        ThreadWorker([q]).work(burst=True)
+        # Shortened to the timeout once the job started
+        ttl = Job.fetch(job.id).result
+        self.assertGreater(ttl, 0)
+        self.assertLessEqual(ttl, 30 + Job.unique_lock_grace)
+
+    def test_release_leaves_the_locks_of_others(self):
+        q = Queue()
+        job = q.enqueue(fixtures.add, 1, 2, unique_key='sum')
+        self.testconn.set(job.unique_lock, 'other')
+        job.release_unique_lock()
+        self.assertEqual(self.testconn.get(job.unique_lock), 'other')
+        job.refresh_unique_lock(5)
+        # No expiry
+        self.assertIn(self.testconn.ttl(job.unique_lock), (None, -1))
+
+
+class TestUniqueJobs(UniqueLockTests, DPQTestCase):
+    pass
+
+
+class TestUniqueJobsOnLegacyClient(UniqueLockTests, RedisTestCase):
+    pass